@@ -0,0 +1,109 @@
+# Modules import
+from modules.benchmark import runBenchmarks, printReport, saveBaseline, loadBaseline
+from modules.benchmark import benchmarkEndToEnd, checkReferenceFit, checkTrackChi2
+from modules.ImportH5 import flavourFilter
+from modules.singleVertexFitter import singleVertexFitter_straightTracks as SVFs
+from modules.singleVertexFitter import singleVertexFitter_irls as SVFirls
+from modules.singleVertexFitter import singleVertexFitter_kalman as SVFk
+from modules.synthetic import writeSyntheticH5
+from modules.trackSelection import TrackSelection
+from modules.trackSelection import truthHeavyFlavour, gn2HeavyFlavour
+
+# Python import
+import argparse
+import json
+import os
+import sys
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Microbenchmarks of the import and fit stages on synthetic jets."
+    )
+    parser.add_argument(
+        "--save", metavar="PATH", help="save the results as a JSON baseline"
+    )
+    parser.add_argument(
+        "--compare", metavar="PATH", help="compare the results with a JSON baseline"
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="smaller scans, for a fast check"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="check the Newton fits against the original fit loop and the tracks' chi2 "
+        "at the true vertexes, and exit (non-zero if a check fails)",
+    )
+    parser.add_argument(
+        "--endToEnd",
+        metavar="H5PATH",
+        help="run the end-to-end benchmark (import, fit and results) on an H5 file; "
+        "a synthetic file is written there if it does not exist",
+    )
+    parser.add_argument(
+        "--jets",
+        type=int,
+        default=100000,
+        help="number of jets of the synthetic H5 file of --endToEnd",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="worker processes of --endToEnd"
+    )
+    parser.add_argument(
+        "--fitter",
+        choices=["newton", "irls", "kalman"],
+        default="newton",
+        help="fitter engine: Newton iterations, iteratively reweighted least squares "
+        "or sequential Kalman fit",
+    )
+    args = parser.parse_args()
+
+    # Same fitter settings of fit.py
+    if args.fitter == "irls":
+        svfs = SVFirls(eps=1e-6, maxIter=1e3)
+    elif args.fitter == "kalman":
+        svfs = SVFk()
+    else:
+        svfs = SVFs(eps=1e-6, maxIter=1e3)
+
+    if args.check:
+        report = {
+            "referenceFit": checkReferenceFit(SVFs(eps=1e-6, maxIter=1e3)),
+            "trackChi2": checkTrackChi2(),
+        }
+        print(json.dumps(report, indent=1))
+        sys.exit(0 if all(r["passed"] for r in report.values()) else 1)
+
+    if args.endToEnd:
+        if not os.path.exists(args.endToEnd):
+            print("Writing the synthetic H5 file...")
+            writeSyntheticH5(args.endToEnd, args.jets)
+        # Same selections and filters of fit.py
+        report = benchmarkEndToEnd(
+            args.endToEnd,
+            svfs,
+            [
+                TrackSelection("perfect_tracksel", truthHeavyFlavour),
+                TrackSelection("GN2_tracksel", gn2HeavyFlavour),
+            ],
+            nWorkers=args.workers,
+            requiredSelections=["perfect_tracksel", "GN2_tracksel"],
+            jetFilters=[flavourFilter([4, 5])],
+        )
+        print(json.dumps(report, indent=1))
+        if args.save:
+            with open(args.save, "w") as ofile:
+                json.dump(report, ofile, indent=1)
+        sys.exit(0)
+
+    if args.quick:
+        report = runBenchmarks(
+            svfs, trackCounts=[5, 20], batchSizes=[100, 1000], nJets=200, repeats=3
+        )
+    else:
+        report = runBenchmarks(svfs)
+
+    printReport(report, loadBaseline(args.compare) if args.compare else None)
+    if args.save:
+        saveBaseline(report, args.save)
+        print("Baseline saved in", args.save)
@@ -1,154 +1,181 @@
 # Modules import
-from modules.ImportH5 import importH5
+from modules.ImportH5 import flavourFilter
+from modules.fitDriver import parallelFitFile
+from modules.columnStore import ColumnStoreWriter
+from modules.convergence import ConvergencePolicy
+from modules.fitCache import FitCache
+from modules.geometryCache import (
+    buildGeometryCache,
+    geometryCachePath,
+    hasGeometryCache,
+)
+from modules.profiling import Profiler
+from modules.scheduler import MultiplicityScheduler
 from modules.singleVertexFitter import singleVertexFitter_straightTracks as SVFs
+from modules.singleVertexFitter import singleVertexFitter_irls as SVFirls
+from modules.singleVertexFitter import singleVertexFitter_kalman as SVFk
+from modules.singleVertexFitter import singleVertexFitter_helix as SVFh
+from modules.trackSelection import TrackSelection, SoftTrackSelection, WorkingPointScan
+from modules.trackSelection import truthHeavyFlavour, gn2HeavyFlavour
+from modules.trackSelection import gn2HeavyFlavourProbability
 
 # Python import
-import numpy as np
 import os
 import sys
 
-N = int(1e4)
-
-filepath = None
-# searching for the H5 database
-for file in os.listdir():
-    filename, ext = os.path.splitext(file)
-    if ext == ".h5":
-        filepath = file
-        print(f"Found h5 database: {filepath}")
-
-# If no h5 file, break
-if filepath is None:
-    sys.exit(1)
-
-print("Importing jets.")
-jets = importH5(
-    filepath=filepath,
-    Nevents=N,
-    onlySV1=False,
-    customProperties=["HadronConeExclTruthLabelLxy"],
-)
-
-# Single Secondary Vertex Fitter with straight line approximation
-svfs = SVFs(eps=1e-6, maxIter=1e3)
-
-# Number of successfully fitted jets
-nFittedJets = 0
-# Vertexes fitted with perfect track selection
-perfect_tracksel_vertexes = []
-# Chi2 of the perfect track selection fits
-perfect_tracksel_chi2 = []
-# Vertexes fitted with GN2 track selection
-GN2_tracksel_vertexes = []
-# Chi2 of the GN2 track selection fits
-GN2_tracksel_chi2 = []
-# Lxy by SV1
-SV1_Lxy = []
-# Montecarlo truth Lxy
-MCtruth_Lxy = []
-# Jet flavour label
-jet_flavour = []
-
-# Wether to fit or not light jets
-filterLightJets = True
-
-# Fitting jets
-print("Begin fitting...")
-for i, j in enumerate(jets):
-    # Status
-    if i % 50 == 0:
-        print("Fitting jet", i, "out of", N, end="\r")
-
-    # If enabled, skip light jets
-    if j.properties["HadronConeExclTruthLabelID"] not in [4, 5] and filterLightJets:
-        continue
-
-    # Read track origins of the current jet and store the tracks in a list
-    truth_track_origin = []
-    GN2_track_origins = []
-    tracks = []
-    for t in j.allTracks:
-        tracks.append(t)
-        truth_track_origin.append(t.truthOriginLabel)
-        GN2_track_origins.append(t.gn2Origin)
-
-    truth_track_origin = np.array(truth_track_origin)
-    GN2_track_origins = np.array(GN2_track_origins)
-    tracks = np.array(tracks)
-
-    # Track Selection with GN2
-    maskGN2 = (
-        (GN2_track_origins == "FromB")
-        | (GN2_track_origins == "FromBC")
-        | (GN2_track_origins == "FromC")
-    )
-
-    # Track Selection with MC truth origin
-    maskTruth = (
-        (truth_track_origin == "FromB")
-        | (truth_track_origin == "FromBC")
-        | (truth_track_origin == "FromC")
+if __name__ == "__main__":
+    N = int(1e4)
+
+    filepath = None
+    # searching for the H5 database
+    for file in os.listdir():
+        filename, ext = os.path.splitext(file)
+        if ext == ".h5":
+            filepath = file
+            print(f"Found h5 database: {filepath}")
+
+    # If no h5 file, break
+    if filepath is None:
+        sys.exit(1)
+
+    # Wether to use a faster stopping rule for the fits (first iteration that moves the vertex
+    # by less than 10 nm, at most 100 iterations) instead of the strict default one; fits that
+    # stop without converging are flagged in the <selection>_converged columns
+    fastTurnaround = False
+    policy = (
+        ConvergencePolicy(absoluteTolerance=1e-5, nConsecutive=1, maxIter=1e2)
+        if fastTurnaround
+        else None
     )
 
-    # tracks list masked with perfect track selection
-    ptracksel_tracks = tracks[maskTruth]
-    # tracks list masked with GN2 track selection
-    GN2tracksel_tracks = tracks[maskGN2]
-
-    # If no tracks are left, skip the jet
-    if len(ptracksel_tracks) == 0 or len(GN2tracksel_tracks) == 0:
-        continue
-
-    # perfect tracksel fit
-    vertexTruth, chi2Truth = svfs.fit(ptracksel_tracks.tolist())
-
-    # GN2 tracksel fit
-    vertexGN2, chi2GN2 = svfs.fit(GN2tracksel_tracks.tolist())
-
-    # Saving results for this jet
-    SV1_Lxy.append(j.properties["SV1_Lxy"])
-    MCtruth_Lxy.append(j.properties["HadronConeExclTruthLabelLxy"])
-    perfect_tracksel_vertexes.append(vertexTruth)
-    perfect_tracksel_chi2.append(chi2Truth)
-    GN2_tracksel_vertexes.append(vertexGN2)
-    GN2_tracksel_chi2.append(chi2GN2)
-    jet_flavour.append(j.properties["HadronConeExclTruthLabelID"])
-    nFittedJets += 1
-
-perfect_tracksel_vertexes = np.array(perfect_tracksel_vertexes)
-GN2_tracksel_vertexes = np.array(GN2_tracksel_vertexes)
-SV1_Lxy = np.array(SV1_Lxy)
-MCtruth_Lxy = np.array(MCtruth_Lxy)
-jet_flavour = np.array(jet_flavour)
-
-# Calculating Lxy of the fitted vertex
-# (for the coordinate system see H5Track docs)
-GN2_Lxy = []
-perfect_tracksel_Lxy = []
-for i in range(nFittedJets):
-    GN2_Lxy.append(
-        np.linalg.norm([0, GN2_tracksel_vertexes[i, 1], GN2_tracksel_vertexes[i, 2]])
-    )
-    perfect_tracksel_Lxy.append(
-        np.linalg.norm(
-            [0, perfect_tracksel_vertexes[i, 1], perfect_tracksel_vertexes[i, 2]]
+    # Single Secondary Vertex Fitter with straight line approximation: "newton" iterations,
+    # "irls" iteratively reweighted least squares or "kalman" sequential fit; the latter also
+    # gives the covariance of the vertexes, saved as the uncertainty of Lxy in the
+    # <selection>_LxySigma columns.
+    # The "helix" engine fits curved tracks (it needs the qOverP field of the tracks),
+    # linearized around the vertex at each step of a kalman fit
+    engine = "newton"
+    straightTracks = engine != "helix"
+    if engine == "helix":
+        svfs = SVFh(SVFk())
+    elif engine == "kalman":
+        svfs = SVFk()
+    elif engine == "irls":
+        svfs = SVFirls(eps=1e-6, maxIter=1e3, policy=policy)
+    else:
+        svfs = SVFs(eps=1e-6, maxIter=1e3, policy=policy)
+
+    # Track selections to be fitted: jets are kept if the perfect and GN2 track selections
+    # select at least one track; other selections can be appended to the list, and are
+    # saved as additional columns (nan if they select no tracks)
+    selections = [
+        # Track Selection with MC truth origin
+        TrackSelection("perfect_tracksel", truthHeavyFlavour),
+        # Track Selection with GN2
+        TrackSelection("GN2_tracksel", gn2HeavyFlavour),
+    ]
+    requiredSelections = ["perfect_tracksel", "GN2_tracksel"]
+
+    # Wether to also fit a scan of GN2 working points: the tracks with
+    # P(FromB)+P(FromBC)+P(FromC) >= each threshold are saved as the selection GN2_wp_<threshold>
+    scanWorkingPoints = False
+    if scanWorkingPoints:
+        thresholds = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+        selections.append(WorkingPointScan("GN2_wp", thresholds))
+
+    # Wether to also fit all the tracks of each jet, with deterministic annealing started from
+    # the GN2 (argmax) selection, as the selection GN2_soft: the selected tracks have weight 1
+    # and the others the 4th power of their GN2 probability P(FromB)+P(FromBC)+P(FromC)
+    softSelection = False
+    if softSelection:
+        selections.append(
+            SoftTrackSelection(
+                "GN2_soft", gn2HeavyFlavourProbability, seed=gn2HeavyFlavour, power=4
+            )
         )
+
+    # The jets of each chunk are sent to the fitter in batches of similar number of selected
+    # tracks (buckets up to 1, 2, 3, 4, 6, ... 32 tracks, and above), of at most batchSize jets,
+    # to limit the padding of the batched fits; set it to None to fit each chunk as a whole
+    scheduler = MultiplicityScheduler(
+        edges=[1, 2, 3, 4, 6, 8, 12, 16, 24, 32], batchSize=2048
     )
 
-# Saving results
-with open("fit_results.dat", "w") as ofile:
+    # Wether to fit or not light jets
+    filterLightJets = True
+
+    # Number of worker processes, each fitting a shard of the file
+    nWorkers = os.cpu_count()
+
+    # Binary columnar store of the results, appended as the shards are fitted
+    resultsPath = "fit_results"
+
+    # Persistent cache of the per-jet fit results: reruns only fit the jets (and selections)
+    # that are missing in it; set it to None to disable it
+    cache = FitCache("fit_cache", filepath, maxBytes=2e9, straightTracks=straightTracks)
+
+    # Memory-mapped geometry cache of the N jets to be fitted (by default in the working
+    # directory): the first run decodes them into it, and the following runs read it instead of
+    # the H5 file (it is rebuilt if they need more jets); set it to None to disable it
+    geometryCache = geometryCachePath(filepath)
+    customProperties = ["HadronConeExclTruthLabelLxy"]
+    if geometryCache is not None and not hasGeometryCache(
+        filepath,
+        geometryCache,
+        customProperties=customProperties,
+        straightTracks=straightTracks,
+        Nevents=N,
+    ):
+        print("Building the geometry cache...")
+        try:
+            buildGeometryCache(
+                filepath,
+                geometryCache,
+                customProperties=customProperties,
+                straightTracks=straightTracks,
+                Nevents=N,
+            )
+        except OSError as e:
+            # e.g. a read-only or full disk: the jets are decoded from the H5 file instead
+            print("Could not write the geometry cache, reading the H5 file:", e)
+            geometryCache = None
+
+    # Instrumentation of the run (time per stage and fit iterations), saved in profilePath;
+    # set trackMemory to True to also measure the peak memory of each stage (slower)
+    profiler = Profiler(trackMemory=False)
+    profilePath = "fit_profile.json"
+
+    # Importing and fitting jets
+    print("Begin fitting...")
+    with ColumnStoreWriter(resultsPath) as writer:
+        parallelFitFile(
+            filepath,
+            fitter=svfs,
+            selections=selections,
+            nWorkers=nWorkers,
+            Nevents=N,
+            writer=writer,
+            verbose=True,
+            profiler=profiler,
+            cache=cache,
+            requiredSelections=requiredSelections,
+            properties=[
+                "SV1_Lxy",
+                "HadronConeExclTruthLabelLxy",
+                "HadronConeExclTruthLabelID",
+            ],
+            customProperties=customProperties,
+            straightTracks=straightTracks,
+            geometryCache=geometryCache,
+            scheduler=scheduler,
+            # If enabled, skip light jets before reading their tracks
+            jetFilters=[flavourFilter([4, 5])] if filterLightJets else [],
+        )
+        print("Fitted", writer.nRows, "jets, results saved in", resultsPath)
+    profiler.save(profilePath)
+    print("Profile of the run saved in", profilePath)
     print(
-        "GN2_tracksel_Lxy perfect_tracksel_Lxy SV1_Lxy HadronConeExclTruthLabelLxy HadronConeExclTruthLabelID Truth_Chi2 GN2_chi2",
-        file=ofile,
-    )
-    for i in range(nFittedJets):
-        print(
-            GN2_Lxy[i],
-            perfect_tracksel_Lxy[i],
-            SV1_Lxy[i],
-            MCtruth_Lxy[i],
-            jet_flavour[i],
-            perfect_tracksel_chi2[i],
-            GN2_tracksel_chi2[i],
-            file=ofile,
+        "Padding efficiency of the fits: {:.1%}".format(
+            profiler.report()["padding"]["efficiency"]
         )
+    )
@@ -0,0 +1,31 @@
+# Modules import
+from modules.synthetic import writeSyntheticH5
+
+# Python import
+import argparse
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Writes a synthetic H5 file with the schema of the ATLAS files, "
+        "GN2 origin probabilities and the true secondary vertexes of the jets."
+    )
+    parser.add_argument("filepath", help="path of the H5 file")
+    parser.add_argument("nJets", type=int, help="number of jets")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--chunkSize", type=int, default=10000, help="jets generated at a time"
+    )
+    parser.add_argument(
+        "--compression", default=None, help="h5py compression filter (gzip, lzf)"
+    )
+    args = parser.parse_args()
+
+    writeSyntheticH5(
+        args.filepath,
+        args.nJets,
+        chunkSize=args.chunkSize,
+        compression=args.compression,
+        seed=args.seed,
+        verbose=True,
+    )
+    print(f"\nSynthetic H5 file written in {args.filepath}")
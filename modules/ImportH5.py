@@ -1,12 +1,129 @@
 # Modules import
 from modules.containers import H5Track
 from modules.containers import JetContainer
+from modules.containers import JetBatch
+from modules.containers import trackGeometry
+from modules.containers import trackCurvature
+from modules.profiling import profileStage
 
 # Python import
 import h5py
 import sys
 import math as m
 import numpy as np
+from functools import partial
+
+# Jet fields read from the H5 file (aside from the custom properties)
+jetFields = [
+    "n_tracks_loose",
+    "n_tracks",
+    "SV1_L3d",
+    "SV1_Lxy",
+    "eta",
+    "phi",
+    "pt",
+    "primaryVertexDetectorZ",
+    "HadronConeExclTruthLabelID",
+]
+# Track fields read from the H5 file
+trackFields = [
+    "pt",
+    "eta",
+    "dphi",
+    "IP3D_signed_d0",
+    "z0RelativeToBeamspot",
+    "ftagTruthOriginLabel",
+    "SV1VertexIndex",
+    "z0RelativeToBeamspotUncertainty",
+    "phiUncertainty",
+    "thetaUncertainty",
+    "d0Uncertainty",
+]
+# Track fields read from the H5 file for curved tracks
+helixFields = ["qOverP"]
+# GN2 track origin probabilities, ordered as H5Track.truthOriginDict
+originProbabilityFields = [
+    "Pileup",
+    "Fake",
+    "Primary",
+    "FromB",
+    "FromBC",
+    "FromC",
+    "FromTau",
+    "OtherSecondary",
+]
+
+
+class JetFilter:
+    """Class that wraps a jet-level predicate, evaluated on a chunk of jet records of the H5 file
+    before their tracks are read.
+
+    Public Members
+    --------------
+    self.predicate : callable that takes the structured array of the jets' records and
+        returns a boolean mask of the jets to keep;
+    self.fields : list of the jet fields (H5 key names) needed by the predicate;
+    """
+
+    def __init__(self, predicate, fields: list = []) -> None:
+        """Constructor of the class.
+
+        Parameters
+        ----------
+        predicate : callable
+            function of the structured array of the jets' records returning a boolean mask
+        fields : list, optional
+            jet fields needed by the predicate, by default []
+        """
+        self.predicate = predicate
+        self.fields = list(fields)
+
+    def __call__(self, jets: np.ndarray) -> np.ndarray:
+        return np.asarray(self.predicate(jets), dtype=bool)
+
+
+# Predicates of the JetFilter helpers, defined at module level
+# so that the filters can be pickled (e.g. sent to worker processes)
+def _isIn(jets: np.ndarray, field: str, values: list):
+    return np.isin(jets[field], values)
+
+
+def _isNotNan(jets: np.ndarray, field: str):
+    return ~np.isnan(jets[field])
+
+
+def _inRange(jets: np.ndarray, field: str, low: float, high: float):
+    return (jets[field] >= low) & (jets[field] < high)
+
+
+def flavourFilter(flavours: list = [4, 5]):
+    """Function that returns a JetFilter keeping the jets whose
+    HadronConeExclTruthLabelID is in flavours (by default b and c jets)."""
+    return JetFilter(
+        partial(_isIn, field="HadronConeExclTruthLabelID", values=list(flavours)),
+        ["HadronConeExclTruthLabelID"],
+    )
+
+
+def SV1Filter():
+    """Function that returns a JetFilter keeping the jets that have been fitted by SV1."""
+    return JetFilter(partial(_isNotNan, field="SV1_L3d"), ["SV1_L3d"])
+
+
+def rangeFilter(field: str, low: float = -np.inf, high: float = np.inf):
+    """Function that returns a JetFilter keeping the jets with low <= field < high
+    (e.g. rangeFilter("pt", 20e3) or rangeFilter("eta", -2.5, 2.5))."""
+    return JetFilter(partial(_inRange, field=field, low=low, high=high), [field])
+
+
+def _projectFields(dataset, fields: list):
+    """Function that returns the view of an H5 dataset restricted to the given fields
+    (the ones missing in the dataset are skipped), so that only those columns are read.
+    """
+    available = dataset.dtype.names
+    fields = [f for f in dict.fromkeys(fields) if f in available]
+    return dataset.fields(fields)
+
 
 def importH5(
     filepath="",
@@ -14,15 +131,18 @@ def importH5(
     customProperties: list = [],
     onlySV1: bool = True,
     straightTracks: bool = True,
+    jetFilters: list = [],
+    asBatch: bool = False,
 ):
-    """Function that imports jets from an H5 file and store them in a list of JetContainer.
+    """Function that imports jets from an H5 file and store them in a list of JetContainer
+    (or in a JetBatch).
 
     Parameters
     ----------
     filepath : str, optional
         Path to the H5 file, by default ""
     Nevents : int, optional
-        Number of jet to be read (does NOT correspond to the number of 
+        Number of jet to be read (does NOT correspond to the number of
         imported jets if onlySV1==True), by default -1 which means import all dataset
     customProperties : list, optional
         other jet properties to import aside from the default of JetContainer;
@@ -30,46 +150,322 @@ def importH5(
     onlySV1 : bool, optional
         Wether to filter only jets that have been fitted by SV1, by default True
     straightTracks : bool, optional
-        Wether to use straight (True) or curved (False) tracks, by default True
+        Wether to use straight (True) or curved (False) tracks, by default True; curved tracks
+        need the qOverP field of the tracks (see trackCurvature)
+    jetFilters : list, optional
+        JetFilter (or callables of the jets' records) that select the jets to import;
+        they are applied before reading the jets' tracks, by default []
+    asBatch : bool, optional
+        Wether to store the jets in a JetBatch instead of a list of JetContainer, by default False
 
     Returns
     -------
-    list
-        a list of JetContainer.
+    list or JetBatch
+        a list of JetContainer, or a JetBatch if asBatch==True.
     """
     if onlySV1:
         print(
             "Warning: filtering out jets that have no SV1 fit. This might lead to fewer imported jets than specified in Nevents."
         )
 
-    # File reading
-    try:
-        with h5py.File(filepath, "r") as h5Database:
-            if Nevents != -1:
-                jets = h5Database["jets"][:Nevents]
-                rawTracks = (
-                    h5Database["tracks_loose"][:Nevents]
-                    if "tracks_loose" in h5Database.keys()
-                    else h5Database["tracks"][:Nevents]
-                )
-            else:
-                jets = h5Database["jets"][:]
-                rawTracks = (
-                    h5Database["tracks_loose"][:]
-                    if "tracks_loose" in h5Database.keys()
-                    else h5Database["tracks"][:]
-                )
+    importedJets = []
+    for chunkJets in iterateH5(
+        filepath=filepath,
+        Nevents=Nevents,
+        customProperties=customProperties,
+        onlySV1=onlySV1,
+        straightTracks=straightTracks,
+        jetFilters=jetFilters,
+        asBatch=asBatch,
+    ):
+        if asBatch:
+            importedJets.append(chunkJets)
+        else:
+            importedJets.extend(chunkJets)
+
+    if asBatch:
+        importedJets = JetBatch.concatenate(importedJets)
+
+    print("Successfully imported", len(importedJets), "jets.")
 
+    # Return the list of JetContainer (or the JetBatch)
+    return importedJets
+
+
+def iterateH5(
+    filepath="",
+    Nevents: int = -1,
+    firstEvent: int = 0,
+    chunkSize: int = None,
+    customProperties: list = [],
+    onlySV1: bool = True,
+    straightTracks: bool = True,
+    jetFilters: list = [],
+    asBatch: bool = False,
+    profiler=None,
+):
+    """Generator that streams jets from an H5 file chunk by chunk, yielding them as lists
+    of JetContainer (or as JetBatch). Only one chunk of the jets and tracks datasets is held in memory at a time.
+
+    Parameters
+    ----------
+    filepath : str, optional
+        Path to the H5 file, by default ""
+    Nevents : int, optional
+        Number of jet to be read (does NOT correspond to the number of
+        imported jets if onlySV1==True), by default -1 which means import all dataset
+    firstEvent : int, optional
+        Index of the first jet to be read; the jets are read from firstEvent to
+        firstEvent + Nevents, by default 0
+    chunkSize : int, optional
+        Number of jets read from the file at a time; it is rounded up to a multiple of the
+        on-disk chunk size of the jets dataset, by default None which means exactly one on-disk chunk
+    customProperties : list, optional
+        other jet properties to import aside from the default of JetContainer;
+        specify them by their key name in the H5 file, by default []
+    onlySV1 : bool, optional
+        Wether to filter only jets that have been fitted by SV1, by default True
+    straightTracks : bool, optional
+        Wether to use straight (True) or curved (False) tracks, by default True; curved tracks
+        need the qOverP field of the tracks (see trackCurvature)
+    jetFilters : list, optional
+        JetFilter (or callables of the jets' records) that select the jets to import;
+        they are evaluated on the jets dataset first, and tracks are read only for the
+        jets that pass all of them, by default []
+    asBatch : bool, optional
+        Wether to yield a JetBatch instead of a list of JetContainer, by default False
+    profiler : Profiler, optional
+        if given, the time spent reading the file ("read" stage) and decoding the tracks
+        ("decode" stage) is added to it, by default None
+
+    Yields
+    ------
+    list or JetBatch
+        a list of JetContainer (or a JetBatch if asBatch==True) for each chunk of the file.
+    """
+    # File opening
+    try:
+        h5Database = h5py.File(filepath, "r")
+        jetsDataset = h5Database["jets"]
+        tracksDataset = (
+            h5Database["tracks_loose"]
+            if "tracks_loose" in h5Database.keys()
+            else h5Database["tracks"]
+        )
     except Exception as e:
         print("Error reading the file!")
         print(e)
         print("Ended exception")
         sys.exit(1)
 
+    with h5Database:
+        lastEvent = (
+            len(jetsDataset)
+            if Nevents == -1
+            else min(firstEvent + Nevents, len(jetsDataset))
+        )
+        # Following the on-disk chunking of the file
+        diskChunk = jetsDataset.chunks[0] if jetsDataset.chunks is not None else 1000
+        if chunkSize is None:
+            chunkSize = diskChunk
+        else:
+            chunkSize = -(-chunkSize // diskChunk) * diskChunk
+
+        # Reading only the fields that are used
+        filterFields = [
+            f for jetFilter in jetFilters for f in getattr(jetFilter, "fields", [])
+        ]
+        jetsView = _projectFields(
+            jetsDataset, jetFields + list(customProperties) + filterFields
+        )
+        tracksView = _projectFields(
+            tracksDataset,
+            trackFields
+            + (helixFields if not straightTracks else [])
+            + originProbabilityFields,
+        )
+
+        for start in range(firstEvent, lastEvent, chunkSize):
+            stop = min(start + chunkSize, lastEvent)
+            with profileStage(profiler, "read", stop - start):
+                jets = jetsView[start:stop]
+
+                # Jet-level selection, evaluated before reading the tracks
+                keep = np.ones(len(jets), dtype=bool)
+                if onlySV1:
+                    keep &= ~np.isnan(jets["SV1_L3d"])
+                for jetFilter in jetFilters:
+                    keep &= jetFilter(jets)
+
+                # Reading the tracks of the selected jets only: the chunk is read as a contiguous
+                # slice and masked in memory, as point selections are slower on compressed files
+                jetIndex = start + np.flatnonzero(keep)
+                if keep.all():
+                    rawTracks = tracksView[start:stop]
+                elif keep.any():
+                    jets = jets[keep]
+                    rawTracks = tracksView[start:stop][keep]
+                else:
+                    jets = jets[keep]
+                    rawTracks = tracksView[start:start]
+
+            with profileStage(profiler, "decode", len(jets)):
+                if asBatch:
+                    importedJets = _buildBatch(
+                        jets,
+                        rawTracks,
+                        jetIndex,
+                        customProperties,
+                        onlySV1,
+                        straightTracks,
+                    )
+                else:
+                    importedJets = _buildJets(
+                        jets,
+                        rawTracks,
+                        customProperties,
+                        onlySV1,
+                        straightTracks,
+                    )
+            yield importedJets
+
+
+def _flattenTracks(jets: np.ndarray, rawTracks: np.ndarray):
+    """Function that returns the non zero-padded tracks of all the jets, flattened in jet order,
+    and the offsets of each jet's tracks."""
+    nTracksName = (
+        "n_tracks_loose" if "n_tracks_loose" in jets.dtype.names else "n_tracks"
+    )
+    validTracks = np.arange(rawTracks.shape[1]) < jets[nTracksName][:, None]
+    tracks = rawTracks[validTracks]
+    trackOffsets = np.concatenate(([0], np.cumsum(validTracks.sum(axis=1))))
+    return tracks, trackOffsets
+
+
+def _straightGeometry(tracks: np.ndarray):
+    """Function that computes the straight line representation of all the given track records;
+    tracks are rotated so that the jet is displayed vertically."""
+    return trackGeometry(
+        tracks["eta"],
+        tracks["dphi"] + m.pi / 2.0,
+        tracks["IP3D_signed_d0"],
+        tracks["z0RelativeToBeamspot"],
+        tracks["thetaUncertainty"],
+        tracks["phiUncertainty"],
+        tracks["d0Uncertainty"],
+        tracks["z0RelativeToBeamspotUncertainty"],
+    )
+
+
+def _curvatures(tracks: np.ndarray, straightTracks: bool):
+    """Function that returns the curvatures of the given track records (see trackCurvature),
+    or null curvatures if using straight tracks."""
+    if straightTracks:
+        return np.zeros(len(tracks))
+    if "qOverP" not in tracks.dtype.names:
+        raise ValueError("Curved tracks need the qOverP field of the tracks.")
+    return trackCurvature(tracks["qOverP"], tracks["pt"])
+
+
+def _originProbabilities(tracks: np.ndarray):
+    """Function that returns the GN2 origin probabilities of the given track records,
+    as an array of shape (Ntracks, 8)."""
+    return np.stack([tracks[f] for f in originProbabilityFields], axis=1)
+
+
+def _buildBatch(
+    jets: np.ndarray,
+    rawTracks: np.ndarray,
+    jetIndex: np.ndarray,
+    customProperties: list,
+    onlySV1: bool,
+    straightTracks: bool,
+):
+    """Function that converts the jets and tracks records read from an H5 file into
+    a JetBatch (see importH5 for the parameters); jetIndex are the jets' rows in the file.
+    """
+    tracks, trackOffsets = _flattenTracks(jets, rawTracks)
+    # Curved tracks are stored as the straight line tangent at the perigee plus the curvature
+    origins, versors, covDiag = _straightGeometry(tracks)
+    curvatures = _curvatures(tracks, straightTracks)
+    originProbabilities = _originProbabilities(tracks)
+
+    # Jets' properties, with the same defaults of _buildJets
+    jetKeys = jets.dtype.names
+    nTracksName = "n_tracks_loose" if "n_tracks_loose" in jetKeys else "n_tracks"
+    properties = {
+        "nTracks": jets[nTracksName],
+        "SV1_L3d": jets["SV1_L3d"],
+        "SV1_Lxy": jets["SV1_Lxy"],
+        "eta": jets["eta"],
+        "phi": jets["phi"] if "phi" in jetKeys else np.zeros(len(jets)),
+        "pt": jets["pt"],
+        "primaryVertexDetectorZ": (
+            jets["primaryVertexDetectorZ"]
+            if "primaryVertexDetectorZ" in jetKeys
+            else np.zeros(len(jets))
+        ),
+        "HadronConeExclTruthLabelID": jets["HadronConeExclTruthLabelID"],
+        "jetIndex": np.asarray(jetIndex, dtype=np.int64),
+    }
+    for p in customProperties:
+        properties[p] = jets[p]
+
+    batch = JetBatch(
+        trackOffsets,
+        properties,
+        origins=origins,
+        versors=versors,
+        covDiag=covDiag,
+        curvatures=curvatures,
+        pt=tracks["pt"],
+        IP3D_signed_d0=tracks["IP3D_signed_d0"],
+        truthOriginLabel=tracks["ftagTruthOriginLabel"].astype(np.int8),
+        gn2Origin=np.argmax(originProbabilities, axis=1).astype(np.int8),
+        originProbabilities=originProbabilities.astype(np.float32),
+        SV1Selected=tracks["SV1VertexIndex"] == 0,
+    )
+
+    # Filtering events that have a SV1 tracks list
+    if onlySV1:
+        batch = batch.selectJets(batch.nSV1Tracks() > 0)
+
+    return batch
+
+
+def _buildJets(
+    jets: np.ndarray,
+    rawTracks: np.ndarray,
+    customProperties: list,
+    onlySV1: bool,
+    straightTracks: bool,
+):
+    """Function that converts the jets and tracks records read from an H5 file into
+    a list of JetContainer (see importH5 for the parameters)."""
+    tracks, trackOffsets = _flattenTracks(jets, rawTracks)
+
+    # Curved tracks are stored as the straight line tangent at the perigee plus the curvature
+    origins, versors, covDiag = _straightGeometry(tracks)
+    curvatures = _curvatures(tracks, straightTracks)
+    # Track origin prediction
+    predictedOrigin = np.argmax(_originProbabilities(tracks), axis=1)
+    # Rotating the tracks so that the jet is displayed vertically
+    dphi = tracks["dphi"] + m.pi / 2.0
+    # Tracks' errors, ordered as H5Track.errors
+    errors = np.stack(
+        [
+            tracks["thetaUncertainty"],
+            tracks["phiUncertainty"],
+            tracks["d0Uncertainty"],
+            tracks["z0RelativeToBeamspotUncertainty"],
+        ],
+        axis=1,
+    )
+
     # Loop to import as many jets as possible (but < Nevents)
     importedJets = []
     # iterating over jets in the H5 file
-    for jet, jetRawTracks in zip(jets, rawTracks):
+    for i, jet in enumerate(jets):
         # Saving jet's variables based on fields' names
         jetKeys = [str(name) for name in jet.dtype.names]
         nTracks = (
@@ -104,63 +500,28 @@ def importH5(
         tracksSV1 = []
         tracksNoSV1 = []
         # Iterating over non zero-padded tracks of the jet
-        for rawTrack in jetRawTracks[:nTracks]:
-            # If using straight tracks
-            if straightTracks:
-                # Saving track's fields' name
-                trackKeys = [str(name) for name in rawTrack.dtype.names]
-                pt = rawTrack[trackKeys.index("pt")]
-                # Reading track's variables
-                eta = rawTrack[trackKeys.index("eta")]
-                # Rotating the track so that the jet is displayed vertically
-                dphi = rawTrack[trackKeys.index("dphi")] + m.pi / 2.0
-                IP3D_signed_d0 = rawTrack[trackKeys.index("IP3D_signed_d0")]
-                z0RelativeToBeamspot = rawTrack[trackKeys.index("z0RelativeToBeamspot")]
-                truthOriginLabel = rawTrack[trackKeys.index("ftagTruthOriginLabel")]
-                SV1VertexIndex = rawTrack[trackKeys.index("SV1VertexIndex")]
-
-                # Track's error
-                sigmaz0 = rawTrack[trackKeys.index("z0RelativeToBeamspotUncertainty")]
-                sigmaPhi = rawTrack[trackKeys.index("phiUncertainty")]
-                sigmaTheta = rawTrack[trackKeys.index("thetaUncertainty")]
-                sigmaD0 = rawTrack[trackKeys.index("d0Uncertainty")]
-                error = [sigmaTheta, sigmaPhi, sigmaD0, sigmaz0]
-
-                # Track origin prediction
-                originProbabilities = []
-                originProbabilities.append(rawTrack[trackKeys.index("Pileup")])
-                originProbabilities.append(rawTrack[trackKeys.index("Fake")])
-                originProbabilities.append(rawTrack[trackKeys.index("Primary")])
-                originProbabilities.append(rawTrack[trackKeys.index("FromB")])
-                originProbabilities.append(rawTrack[trackKeys.index("FromBC")])
-                originProbabilities.append(rawTrack[trackKeys.index("FromC")])
-                originProbabilities.append(rawTrack[trackKeys.index("FromTau")])
-                originProbabilities.append(rawTrack[trackKeys.index("OtherSecondary")])
-
-                predictedOrigin = np.argmax(np.array(originProbabilities))
-
-                # Creating the H5Track object
-                track = H5Track(
-                    pt,
-                    eta,
-                    dphi,
-                    IP3D_signed_d0,
-                    z0RelativeToBeamspot,
-                    error,
-                    truthOriginLabel,
-                    predictedOrigin,
-                    SV1VertexIndex,
-                )
-
-                # Saving the track in its respective list (selected by SV1 or not)
-                if SV1VertexIndex == 0:
-                    tracksSV1.append(track)
-                else:
-                    tracksNoSV1.append(track)
+        for k in range(trackOffsets[i], trackOffsets[i + 1]):
+            # Creating the H5Track object from the precomputed geometry
+            track = H5Track.fromGeometry(
+                origins[k],
+                versors[k],
+                covDiag[k],
+                tracks["pt"][k],
+                tracks["eta"][k],
+                dphi[k],
+                tracks["IP3D_signed_d0"][k],
+                errors[k],
+                tracks["ftagTruthOriginLabel"][k],
+                predictedOrigin[k],
+                tracks["SV1VertexIndex"][k],
+                curvatures[k],
+            )
+
+            # Saving the track in its respective list (selected by SV1 or not)
+            if tracks["SV1VertexIndex"][k] == 0:
+                tracksSV1.append(track)
             else:
-                # Implement charged tracks import
-                # for non linear vertex fit
-                pass
+                tracksNoSV1.append(track)
 
         # Filtering events that have a SV1 tracks list
         if onlySV1 and len(tracksSV1) == 0:
@@ -183,7 +544,5 @@ def importH5(
         # Store jet's container
         importedJets.append(importedJet)
 
-    print("Successfully imported", len(importedJets), "jets.")
-
     # Return the list of JetContainer
     return importedJets
@@ -0,0 +1,559 @@
+# Modules import
+from modules.ImportH5 import _buildBatch, _buildJets, _flattenTracks, _straightGeometry
+from modules.columnStore import ColumnStoreWriter, readColumnStore
+from modules.containers import H5Track
+from modules.fitDriver import parallelFitFile
+from modules.singleVertexFitter import _trackChi2, padTracks
+from modules.synthetic import syntheticRecords
+from modules.trackSelection import truthHeavyFlavour
+
+# Python import
+import json
+import math as m
+import platform
+import resource
+import shutil
+import tempfile
+import time
+import h5py
+import numpy as np
+
+# Stages measured by benchmarkStages
+benchmarkStageNames = [
+    "trackGeometry",
+    "H5Track",
+    "importBatch",
+    "importJets",
+    "fit",
+    "fitBatch",
+]
+
+
+def timeIt(function, repeats: int = 5, minTime: float = 0.05) -> float:
+    """Function that measures the execution time of a function without arguments: each repeat
+    calls it as many times as needed to last at least minTime seconds, and the best repeat is kept.
+
+    Parameters
+    ----------
+    function : callable
+        the function to be timed
+    repeats : int, optional
+        Number of repeats, by default 5
+    minTime : float, optional
+        Minimum duration of each repeat in seconds, by default 0.05
+
+    Returns
+    -------
+    float
+        the best time of a single call, in seconds.
+    """
+    best = m.inf
+    for _ in range(repeats):
+        nCalls = 0
+        start = time.perf_counter()
+        while True:
+            function()
+            nCalls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= minTime:
+                break
+        best = min(best, elapsed / nCalls)
+    return best
+
+
+def benchmarkStages(
+    nJets: int,
+    fitter,
+    stages: list = benchmarkStageNames,
+    repeats: int = 5,
+    maxScalarJets: int = 200,
+    **settings,
+):
+    """Function that measures the speed of each stage of the import and fit chain on the same
+    synthetic jets (see syntheticRecords):
+    - trackGeometry: straight line representation of all the tracks (vectorized);
+    - H5Track: construction of the H5Track objects and of their geometry, one track at a time;
+    - importBatch: conversion of the H5 records into a JetBatch (as iterateH5 with asBatch=True);
+    - importJets: conversion of the H5 records into a list of JetContainer;
+    - fit: fit of all the tracks of each jet with fitter.fit, one jet at a time;
+    - fitBatch: fit of all the tracks of all the jets with fitter.fitBatch.
+    Stages that loop over jets or tracks in Python run on the first maxScalarJets jets only.
+
+    Parameters
+    ----------
+    nJets : int
+        Number of jets (batch size)
+    fitter : singleVertexFitter_straightTracks
+        the vertex fitter
+    stages : list, optional
+        names of the stages to be measured, by default all of them
+    repeats : int, optional
+        Number of repeats of each measure (see timeIt), by default 5
+    maxScalarJets : int, optional
+        Maximum number of jets of the Python loop stages, by default 200
+    **settings:
+        other arguments of syntheticRecords (nTracks, displacement, errorScale, ...).
+
+    Returns
+    -------
+    list
+        one dict per stage with the stage name, the number of jets and tracks it ran on,
+        the best time in seconds, the jets per second and the time per track in microseconds.
+    """
+    jets, rawTracks, _ = syntheticRecords(nJets, **settings)
+    tracks, _ = _flattenTracks(jets, rawTracks)
+    nScalar = min(nJets, maxScalarJets)
+    scalarTracks, _ = _flattenTracks(jets[:nScalar], rawTracks[:nScalar])
+    jetIndex = np.arange(nJets)
+
+    batch = _buildBatch(jets, rawTracks, jetIndex, [], False, True)
+    padded = batch.padded()
+    jetLists = [
+        jet.allTracks
+        for jet in _buildJets(jets[:nScalar], rawTracks[:nScalar], [], False, True)
+    ]
+
+    def h5Tracks():
+        for t in scalarTracks:
+            _h5Track(t).origin
+
+    def scalarFits():
+        for jetTracks in jetLists:
+            fitter.fit(jetTracks)
+
+    # stage name -> (function, number of jets, number of tracks)
+    measures = {
+        "trackGeometry": (lambda: _straightGeometry(tracks), nJets, len(tracks)),
+        "H5Track": (h5Tracks, nScalar, len(scalarTracks)),
+        "importBatch": (
+            lambda: _buildBatch(jets, rawTracks, jetIndex, [], False, True),
+            nJets,
+            len(tracks),
+        ),
+        "importJets": (
+            lambda: _buildJets(jets[:nScalar], rawTracks[:nScalar], [], False, True),
+            nScalar,
+            len(scalarTracks),
+        ),
+        "fit": (scalarFits, nScalar, len(scalarTracks)),
+        "fitBatch": (lambda: fitter.fitBatch(*padded), nJets, len(tracks)),
+    }
+
+    results = []
+    for stage in stages:
+        function, stageJets, stageTracks = measures[stage]
+        seconds = timeIt(function, repeats)
+        results.append(
+            {
+                "stage": stage,
+                "nJets": stageJets,
+                "nTracks": stageTracks,
+                "seconds": seconds,
+                "jetsPerSecond": stageJets / seconds,
+                "microsecondsPerTrack": 1e6 * seconds / max(stageTracks, 1),
+            }
+        )
+    return results
+
+
+def runBenchmarks(
+    fitter,
+    trackCounts: list = [2, 5, 10, 20, 40],
+    batchSizes: list = [10, 100, 1000, 10000],
+    nJets: int = 1000,
+    repeats: int = 5,
+    seed: int = 0,
+):
+    """Function that runs the benchmark suite: all the stages are measured for jets with a fixed
+    number of tracks (scaling with Ntracks, batches of nJets jets), then the vectorized stages are
+    measured for batches of different sizes (scaling with the batch size, 2 to 20 tracks per jet).
+
+    Parameters
+    ----------
+    fitter : singleVertexFitter_straightTracks
+        the vertex fitter
+    trackCounts : list, optional
+        numbers of tracks per jet of the Ntracks scaling, by default [2, 5, 10, 20, 40]
+    batchSizes : list, optional
+        numbers of jets of the batch size scaling, by default [10, 100, 1000, 10000]
+    nJets : int, optional
+        Number of jets of the Ntracks scaling, by default 1000
+    repeats : int, optional
+        Number of repeats of each measure (see timeIt), by default 5
+    seed : int, optional
+        Seed of the synthetic jets, by default 0
+
+    Returns
+    -------
+    dict
+        the machine description and the list of the results (see benchmarkStages),
+        with the scan each result belongs to.
+    """
+    results = []
+    for nTracks in trackCounts:
+        for r in benchmarkStages(
+            nJets, fitter, repeats=repeats, nTracks=nTracks, seed=seed
+        ):
+            results.append(dict(r, scan="nTracks", value=nTracks))
+    for batchSize in batchSizes:
+        for r in benchmarkStages(
+            batchSize,
+            fitter,
+            stages=["trackGeometry", "importBatch", "fitBatch"],
+            repeats=repeats,
+            nTracks=(2, 20),
+            seed=seed,
+        ):
+            results.append(dict(r, scan="batchSize", value=batchSize))
+    return {
+        "machine": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "processor": platform.processor() or platform.machine(),
+        },
+        "fitter": fitter.key(),
+        "results": results,
+    }
+
+
+def benchmarkEndToEnd(
+    filepath: str,
+    fitter,
+    selections: list,
+    nWorkers: int = 1,
+    Nevents: int = -1,
+    **settings,
+):
+    """Function that measures the whole chain (H5 import, fit and writing of the results to a
+    columnar store) on an H5 file, as run by fit.py. If the file has the "truthVertices" dataset
+    (see writeSyntheticH5), the fitted vertexes are also compared with the true ones.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the H5 file
+    fitter : singleVertexFitter_straightTracks
+        the vertex fitter
+    selections : list
+        list of TrackSelection to be fitted
+    nWorkers : int, optional
+        Number of worker processes (see parallelFitFile), by default 1
+    Nevents : int, optional
+        Number of jets to be read, by default -1 which means all the dataset
+    **settings:
+        other arguments of fitFile (requiredSelections, jetFilters, onlySV1, ...).
+
+    Returns
+    -------
+    dict
+        numbers of read and fitted jets and of read tracks, time in seconds, jets and tracks
+        per second, peak resident memory in MB of this process and of the workers, and for each
+        selection the median distance between the fitted and the true vertexes and the median
+        absolute Lxy residual (in mm) of the jets with at least 2 selected tracks.
+    """
+    with h5py.File(filepath, "r") as h5Database:
+        jetsDataset = h5Database["jets"]
+        nJets = len(jetsDataset) if Nevents == -1 else min(Nevents, len(jetsDataset))
+        nTracksName = (
+            "n_tracks_loose"
+            if "n_tracks_loose" in jetsDataset.dtype.names
+            else "n_tracks"
+        )
+        nTracks = int(jetsDataset.fields(nTracksName)[:nJets].sum())
+        truthVertices = (
+            h5Database["truthVertices"][:nJets]
+            if "truthVertices" in h5Database
+            else None
+        )
+
+    resultsPath = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        with ColumnStoreWriter(resultsPath) as writer:
+            parallelFitFile(
+                filepath,
+                fitter,
+                selections,
+                nWorkers=nWorkers,
+                Nevents=Nevents,
+                writer=writer,
+                properties=["jetIndex"],
+                **settings,
+            )
+        seconds = time.perf_counter() - start
+        results = readColumnStore(resultsPath, mmap=False)
+    finally:
+        shutil.rmtree(resultsPath, ignore_errors=True)
+
+    nFitted = len(results["jetIndex"]) if len(results) > 0 else 0
+    report = {
+        "nJetsRead": nJets,
+        "nJetsFitted": nFitted,
+        "nTracksRead": nTracks,
+        "seconds": seconds,
+        "jetsPerSecond": nJets / seconds,
+        "tracksPerSecond": nTracks / seconds,
+        # ru_maxrss is in kB on Linux
+        "peakMemoryMB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "workersPeakMemoryMB": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        / 1024,
+    }
+    if truthVertices is not None and nFitted > 0:
+        truth = truthVertices[results["jetIndex"]]
+        truthLxy = np.linalg.norm(truth[:, 1:], axis=1)
+        for selection in selections:
+            fitted = results[f"{selection.name}_nTracks"] >= 2
+            if not fitted.any():
+                continue
+            vertexes = results[f"{selection.name}_vertex"][fitted]
+            report[f"{selection.name}_medianVertexResidual"] = float(
+                np.median(np.linalg.norm(vertexes - truth[fitted], axis=1))
+            )
+            report[f"{selection.name}_medianLxyResidual"] = float(
+                np.median(
+                    np.abs(results[f"{selection.name}_Lxy"][fitted] - truthLxy[fitted])
+                )
+            )
+    return report
+
+
+def checkReferenceFit(
+    fitter, nJets: int = 200, tolerance: float = 1e-9, seed: int = 0, **settings
+):
+    """Function that checks the fits of singleVertexFitter_straightTracks against the original
+    fit loop, one track at a time (see _referenceFit), on the same synthetic jets: fit (on
+    H5Track built one at a time from the float32 records, as in the H5 files) and fitBatch (on
+    the same tracks, padded) must give the same vertexes, chi2 and numbers of iterations.
+
+    Parameters
+    ----------
+    fitter : singleVertexFitter_straightTracks
+        the vertex fitter, with the default convergence policy
+    nJets : int, optional
+        Number of jets, by default 200
+    tolerance : float, optional
+        maximum distance in mm between the vertexes of the fitter and of the reference,
+        by default 1e-9
+    seed : int, optional
+        Seed of the synthetic jets, by default 0
+    **settings:
+        other arguments of syntheticRecords (nTracks, displacement, errorScale, ...).
+
+    Returns
+    -------
+    dict
+        largest vertex distance ("fit", "fitBatch"), largest relative chi2 difference
+        ("fitChi2", "fitBatchChi2") and number of fits with a different number of iterations
+        ("fitIterations", "fitBatchIterations") with respect to the reference, and wether all the
+        vertex distances are within tolerance with the same numbers of iterations ("passed").
+    """
+    jets, rawTracks, _ = syntheticRecords(nJets, seed=seed, **settings)
+    tracks, offsets = _flattenTracks(jets, rawTracks)
+    h5Tracks = [_h5Track(t) for t in tracks]
+    jetLists = [h5Tracks[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+    reference = [
+        _referenceFit(tracks, fitter.eps, fitter.maxIter) for tracks in jetLists
+    ]
+    refVertexes = np.array([r[0] for r in reference])
+    refChi2 = np.array([r[1] for r in reference])
+    refIterations = np.array([r[2] for r in reference])
+
+    fits = [fitter.fit(tracks, returnInfo=True) for tracks in jetLists]
+    vertexes = {"fit": np.array([f[0] for f in fits])}
+    chi2 = {"fit": np.array([f[1] for f in fits])}
+    iterations = {"fit": np.array([f[2]["nIterations"] for f in fits])}
+    vertexes["fitBatch"], chi2["fitBatch"], info = fitter.fitBatch(
+        *padTracks(jetLists), returnInfo=True
+    )
+    iterations["fitBatch"] = info["nIterations"]
+
+    report = {}
+    for name in ["fit", "fitBatch"]:
+        report[name] = float(
+            np.max(np.linalg.norm(vertexes[name] - refVertexes, axis=1))
+        )
+        report[name + "Chi2"] = float(np.max(np.abs(chi2[name] / refChi2 - 1)))
+        report[name + "Iterations"] = int(np.sum(iterations[name] != refIterations))
+    report["passed"] = all(
+        report[name] <= tolerance and report[name + "Iterations"] == 0
+        for name in ["fit", "fitBatch"]
+    )
+    return report
+
+
+def checkTrackChi2(
+    nJets: int = 5000, tolerance: float = 0.4, seed: int = 0, **settings
+):
+    """Function that checks the tracks' chi2 (see singleVertexFitter._trackChi2) at the true
+    vertexes of synthetic jets: the chi2 of the heavy flavour tracks, which come from the vertex,
+    must follow a chi2 distribution with about 2 degrees of freedom.
+
+    Parameters
+    ----------
+    nJets : int, optional
+        Number of jets, by default 5000
+    tolerance : float, optional
+        maximum relative difference of the median and of the mean of the tracks' chi2 from the
+        ones of a chi2 distribution with 2 degrees of freedom (2 ln 2 and 2), by default 0.4
+    seed : int, optional
+        Seed of the synthetic jets, by default 0
+    **settings:
+        other arguments of syntheticRecords (nTracks, displacement, errorScale, ...).
+
+    Returns
+    -------
+    dict
+        median, mean, 90th percentile and fraction above 9 of the tracks' chi2 ("median", "mean",
+        "p90", "above9"), the same for 2 degrees of freedom ("reference") and wether the median
+        and the mean are within tolerance ("passed").
+    """
+    jets, rawTracks, truthVertices = syntheticRecords(nJets, seed=seed, **settings)
+    batch = _buildBatch(jets, rawTracks, np.arange(len(jets)), [], False, True)
+    origins, versors, covDiag, valid = batch.padded(truthHeavyFlavour(batch))
+    chi2 = _trackChi2(origins, versors, covDiag, truthVertices)[valid]
+
+    report = {
+        "median": float(np.median(chi2)),
+        "mean": float(np.mean(chi2)),
+        "p90": float(np.percentile(chi2, 90)),
+        "above9": float(np.mean(chi2 > 9)),
+        # Quantiles of a chi2 distribution with 2 degrees of freedom: 1 - exp(-x/2)
+        "reference": {
+            "median": 2 * m.log(2),
+            "mean": 2.0,
+            "p90": 2 * m.log(10),
+            "above9": m.exp(-4.5),
+        },
+    }
+    report["passed"] = all(
+        abs(report[name] / report["reference"][name] - 1) <= tolerance
+        for name in ["median", "mean"]
+    )
+    return report
+
+
+def _h5Track(t) -> H5Track:
+    """Function that builds the H5Track of a track record, with its own (scalar) geometry."""
+    return H5Track(
+        t["pt"],
+        t["eta"],
+        t["dphi"] + m.pi / 2.0,
+        t["IP3D_signed_d0"],
+        t["z0RelativeToBeamspot"],
+        [
+            t["thetaUncertainty"],
+            t["phiUncertainty"],
+            t["d0Uncertainty"],
+            t["z0RelativeToBeamspotUncertainty"],
+        ],
+    )
+
+
+def _referenceFit(tracks: list, eps: float, maxIter: float):
+    """Original fit loop of singleVertexFitter_straightTracks, one track at a time; returns the
+    vertex, the chi2 and the number of iterations."""
+    Ntracks = len(tracks)
+    iter = 0
+    dv = 100
+    v = np.zeros(3)
+    for t in tracks:
+        v = v + t.origin
+    v = v / Ntracks
+    nStuck = 0
+
+    while iter < maxIter:
+        if dv < eps:
+            nStuck += 1
+            if nStuck > 5:
+                break
+        else:
+            nStuck = 0
+
+        gradS = np.zeros(3)
+        laplS = np.zeros((3, 3))
+        for t in tracks:
+            di = t.origin - v
+            ai = t.versor
+            eta = np.outer(ai, di) - np.outer(di, ai)
+            Dir = (
+                2
+                / Ntracks
+                * np.array(
+                    [
+                        ai[1] * eta[1, 0] - ai[2] * eta[0, 2],
+                        ai[2] * eta[2, 1] - ai[0] * eta[1, 0],
+                        ai[0] * eta[0, 2] - ai[1] * eta[2, 1],
+                    ]
+                )
+            )
+            Dia = (
+                2
+                / Ntracks
+                * np.array(
+                    [
+                        di[2] * eta[0, 2] - di[1] * eta[1, 0],
+                        di[0] * eta[1, 0] - di[2] * eta[2, 1],
+                        di[1] * eta[2, 1] - di[0] * eta[0, 2],
+                    ]
+                )
+            )
+            Ji = np.concatenate((Dir, Dia), axis=0)
+            sigmai = Ji.T @ t.covMat @ Ji + 1e-9
+            gradS = gradS - (sigmai**-1) * Dir
+            Hi = np.sum(ai**2) * np.eye(3) - np.outer(ai, ai)
+            laplS = laplS + 2 / Ntracks * (sigmai**-1) * Hi
+
+        vold = np.copy(v)
+        v -= np.linalg.pinv(laplS) @ gradS
+        dv = np.linalg.norm(vold - v)
+        iter += 1
+
+    chi2 = 0.0
+    for t in tracks:
+        Di = np.cross(t.origin - v, t.versor) ** 2
+        chi2 += np.sqrt(np.sum(Di**2))
+    return v, chi2, iter
+
+
+def _resultKey(result: dict) -> tuple:
+    return (result["scan"], result["value"], result["stage"])
+
+
+def saveBaseline(report: dict, filepath: str):
+    """Function that saves a benchmark report (see runBenchmarks) as a JSON baseline."""
+    with open(filepath, "w") as ofile:
+        json.dump(report, ofile, indent=1)
+
+
+def loadBaseline(filepath: str) -> dict:
+    """Function that loads a JSON baseline saved by saveBaseline."""
+    with open(filepath, "r") as ifile:
+        return json.load(ifile)
+
+
+def printReport(report: dict, baseline: dict = None):
+    """Function that prints a benchmark report as a table; if a baseline is given, the speedup
+    of each measure with respect to it is printed too (>1 means faster than the baseline).
+
+    Parameters
+    ----------
+    report : dict
+        benchmark report (see runBenchmarks)
+    baseline : dict, optional
+        baseline report to compare with, by default None
+    """
+    reference = {}
+    if baseline is not None:
+        reference = {_resultKey(r): r for r in baseline["results"]}
+    header = f"{'scan':>9} {'value':>6} {'stage':>13} {'jets/s':>12} {'us/track':>10}"
+    print(header + (f" {'speedup':>8}" if baseline is not None else ""))
+    for r in report["results"]:
+        line = (
+            f"{r['scan']:>9} {r['value']:>6} {r['stage']:>13} "
+            f"{r['jetsPerSecond']:>12.1f} {r['microsecondsPerTrack']:>10.3f}"
+        )
+        if _resultKey(r) in reference:
+            speedup = reference[_resultKey(r)]["seconds"] / r["seconds"]
+            line += f" {speedup:>8.2f}"
+        print(line)
@@ -0,0 +1,187 @@
+# Python import
+import json
+import os
+import numpy as np
+
+# Name of the file that describes the columns of a store
+metaFilename = "meta.json"
+
+
+class ColumnStoreWriter:
+    """Class that writes a binary columnar store: a directory with one raw binary file per column
+    (<name>.bin) plus a meta.json file with the columns' dtypes, row shapes and the number of rows.
+    Rows are appended in batches; the number of rows in meta.json is only updated once a batch has
+    been flushed to disk, so a crash never leaves partially written rows visible to readers.
+
+    Public Members
+    --------------
+    self.directory : str, path of the store;
+    self.nRows : int, number of rows written so far;
+
+    Public Methods
+    --------------
+    append(columns) : appends a batch of rows to the store;
+    close() : closes the column files;
+    """
+
+    def __init__(self, directory: str, overwrite: bool = True) -> None:
+        """Constructor of the class.
+
+        Parameters
+        ----------
+        directory : str
+            path of the store
+        overwrite : bool, optional
+            Wether to overwrite an existing store (True) or to append to it (False), by default True
+        """
+        self.directory = directory
+        self.__files = {}
+        os.makedirs(directory, exist_ok=True)
+        metaPath = os.path.join(directory, metaFilename)
+        if not overwrite and os.path.exists(metaPath):
+            with open(metaPath, "r") as ifile:
+                meta = json.load(ifile)
+            self.nRows = meta["nRows"]
+            self.__columns = meta["columns"]
+            # Dropping rows written after the last update of meta.json
+            for name, column in self.__columns.items():
+                with open(self.__path(name), "r+b") as f:
+                    f.truncate(self.nRows * self.__rowSize(column))
+        else:
+            self.nRows = 0
+            self.__columns = {}
+            for file in os.listdir(directory):
+                if file.endswith(".bin") or file == metaFilename:
+                    os.remove(os.path.join(directory, file))
+
+    def __path(self, name: str) -> str:
+        return os.path.join(self.directory, name + ".bin")
+
+    def __rowSize(self, column: dict) -> int:
+        return np.dtype(column["dtype"]).itemsize * int(np.prod(column["shape"]))
+
+    def append(self, columns: dict):
+        """Function that appends a batch of rows to the store.
+
+        Parameters
+        ----------
+        columns : dict
+            column name -> np.ndarray of shape (Nrows, ...); all the columns of the store must be
+            given, with the same number of rows.
+        """
+        if len(columns) == 0:
+            return
+        nRows = {len(v) for v in columns.values()}
+        if len(nRows) != 1:
+            raise ValueError("All the columns must have the same number of rows.")
+        if len(self.__columns) == 0:
+            self.__columns = {
+                name: {"dtype": np.asarray(v).dtype.str, "shape": list(np.shape(v)[1:])}
+                for name, v in columns.items()
+            }
+        elif set(columns) != set(self.__columns):
+            raise ValueError("The columns do not match the ones of the store.")
+
+        for name, column in self.__columns.items():
+            if name not in self.__files:
+                self.__files[name] = open(self.__path(name), "ab")
+            data = np.ascontiguousarray(columns[name], dtype=column["dtype"])
+            if list(data.shape[1:]) != column["shape"]:
+                raise ValueError(f"Wrong row shape for column {name}.")
+            self.__files[name].write(data.tobytes())
+            self.__files[name].flush()
+            os.fsync(self.__files[name].fileno())
+
+        # Committing the rows
+        self.nRows += nRows.pop()
+        metaPath = os.path.join(self.directory, metaFilename)
+        with open(metaPath + ".tmp", "w") as ofile:
+            json.dump({"nRows": self.nRows, "columns": self.__columns}, ofile)
+        os.replace(metaPath + ".tmp", metaPath)
+
+    def close(self):
+        for f in self.__files.values():
+            f.close()
+        self.__files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def readColumnStore(directory: str, columns: list = None, mmap: bool = True):
+    """Function that reads a binary columnar store written by ColumnStoreWriter.
+
+    Parameters
+    ----------
+    directory : str
+        path of the store
+    columns : list, optional
+        names of the columns to read, by default None which means all the columns
+    mmap : bool, optional
+        Wether to memory-map the columns (read-only) instead of loading them in memory,
+        by default True
+
+    Returns
+    -------
+    dict
+        column name -> np.ndarray (or np.memmap) of shape (Nrows, ...).
+    """
+    with open(os.path.join(directory, metaFilename), "r") as ifile:
+        meta = json.load(ifile)
+    nRows = meta["nRows"]
+    data = {}
+    for name, column in meta["columns"].items():
+        if columns is not None and name not in columns:
+            continue
+        path = os.path.join(directory, name + ".bin")
+        shape = tuple([nRows] + column["shape"])
+        if mmap and nRows > 0:
+            data[name] = np.memmap(path, dtype=column["dtype"], mode="r", shape=shape)
+        else:
+            count = int(np.prod(shape))
+            data[name] = np.fromfile(path, dtype=column["dtype"], count=count).reshape(
+                shape
+            )
+    return data
+
+
+# Columns of the fit_results.dat text file written by the first versions of fit.py,
+# with their names in the store
+legacyColumns = {
+    "GN2_tracksel_Lxy": "GN2_tracksel_Lxy",
+    "perfect_tracksel_Lxy": "perfect_tracksel_Lxy",
+    "SV1_Lxy": "SV1_Lxy",
+    "HadronConeExclTruthLabelLxy": "HadronConeExclTruthLabelLxy",
+    "HadronConeExclTruthLabelID": "HadronConeExclTruthLabelID",
+    "Truth_Chi2": "perfect_tracksel_chi2",
+    "GN2_chi2": "GN2_tracksel_chi2",
+}
+
+
+def convertLegacyResults(filepath: str, directory: str):
+    """Function that converts a fit_results.dat text file, written by the first versions of fit.py
+    (a header with the column names, then one space separated line per jet), into a binary
+    columnar store.
+
+    Parameters
+    ----------
+    filepath : str
+        path of the text file
+    directory : str
+        path of the store to be written (overwritten if it exists)
+    """
+    with open(filepath, "r") as ifile:
+        names = ifile.readline().split()
+    rows = np.loadtxt(filepath, skiprows=1, ndmin=2)
+    columns = {
+        legacyColumns.get(name, name): rows[:, i] for i, name in enumerate(names)
+    }
+    if "HadronConeExclTruthLabelID" in columns:
+        columns["HadronConeExclTruthLabelID"] = columns[
+            "HadronConeExclTruthLabelID"
+        ].astype(int)
+    with ColumnStoreWriter(directory) as writer:
+        writer.append(columns)
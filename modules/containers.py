@@ -3,6 +3,206 @@ import numpy as np
 import math as m
 
 
+def trackGeometry(
+    eta: np.ndarray,
+    dphi: np.ndarray,
+    IP3D_signed_d0: np.ndarray,
+    z0RelativeToBeamspot: np.ndarray,
+    sigmaTheta: np.ndarray,
+    sigmaPhi: np.ndarray,
+    sigmaD0: np.ndarray,
+    sigmaZ0: np.ndarray,
+):
+    """Function that computes the straight line representation of many tracks at once,
+    with the same conventions and numbers of the H5Track constructor (see H5Track docs).
+
+    Parameters
+    ----------
+    eta : np.ndarray
+        tracks's eta field in h5 file, of shape (Ntracks,)
+    dphi : np.ndarray
+        tracks's dphi field in h5 file, of shape (Ntracks,)
+    IP3D_signed_d0 : np.ndarray
+        tracks's IP3D_signed_d0 field in h5 file, of shape (Ntracks,)
+    z0RelativeToBeamspot : np.ndarray
+        tracks's z0RelativeToBeamspot field in h5 file, of shape (Ntracks,)
+    sigmaTheta, sigmaPhi, sigmaD0, sigmaZ0 : np.ndarray
+        tracks's uncertainties on theta, phi, d0 and z0, of shape (Ntracks,)
+
+    Returns
+    -------
+    tuple of np.ndarray
+        origins and versors of shape (Ntracks, 3) and diagonals of the tracks'
+        covariance matrices (origin errors followed by versor errors) of shape (Ntracks, 6).
+    """
+    eta, dphi, d0, z0, sigmaTheta, sigmaPhi, sigmaD0, sigmaZ0 = [
+        np.asarray(x, dtype=float)
+        for x in (
+            eta,
+            dphi,
+            IP3D_signed_d0,
+            z0RelativeToBeamspot,
+            sigmaTheta,
+            sigmaPhi,
+            sigmaD0,
+            sigmaZ0,
+        )
+    ]
+    # eta -> theta conversion
+    thetaT = 2 * np.arctan(np.exp(-eta))
+    sinTheta, cosTheta = np.sin(thetaT), np.cos(thetaT)
+    sinPhi, cosPhi = np.sin(dphi), np.cos(dphi)
+    # versors
+    versors = np.stack([cosTheta, sinTheta * cosPhi, sinTheta * sinPhi], axis=1)
+
+    # origins
+    phiP = np.where(d0 > 0, dphi - np.pi / 2, dphi + np.pi / 2)
+    sinPhiP, cosPhiP = np.sin(phiP), np.cos(phiP)
+    origins = np.stack([z0, np.abs(d0) * cosPhiP, np.abs(d0) * sinPhiP], axis=1)
+
+    # versors' errors
+    eVersor = np.stack(
+        [
+            ((cosTheta * cosPhi * sigmaTheta) ** 2)
+            + ((sinPhi * sinTheta * sigmaPhi) ** 2),
+            ((cosTheta * sinPhi * sigmaTheta) ** 2)
+            + ((sinTheta * cosPhi * sigmaPhi) ** 2),
+            (sinTheta * sigmaTheta) ** 2,
+        ],
+        axis=1,
+    )
+    # origins' errors
+    eOrigin = np.stack(
+        [
+            sigmaZ0**2,
+            (cosPhiP * sigmaD0) ** 2 + (sinPhiP * d0 * sigmaPhi) ** 2,
+            (sinPhiP * sigmaD0) ** 2 + (cosPhiP * d0 * sigmaPhi) ** 2,
+        ],
+        axis=1,
+    )
+
+    covDiag = np.sqrt(np.concatenate((eOrigin, eVersor), axis=1))
+    return origins, versors, covDiag
+
+
+# Magnetic field of the ATLAS solenoid in T
+magneticField = 2.0
+
+
+def trackCurvature(
+    qOverP: np.ndarray, pt: np.ndarray, magneticField: float = magneticField
+):
+    """Function that computes the signed transverse curvature of many tracks at once,
+    from the radius R[mm] = pt[MeV] / (0.3 B[T]) and the sign of the charge; positive tracks
+    bend clockwise (decreasing phi) in the field along the beam axis.
+
+    Parameters
+    ----------
+    qOverP : np.ndarray
+        tracks's qOverP field in h5 file (only its sign is used), of shape (Ntracks,)
+    pt : np.ndarray
+        tracks's pt in MeV, of shape (Ntracks,)
+    magneticField : float, optional
+        magnetic field along the beam axis in T, by default 2.0
+
+    Returns
+    -------
+    np.ndarray
+        curvatures in 1/mm of shape (Ntracks,), the derivative of the track's phi with respect
+        to its transverse path length; tracks with qOverP == 0 have null curvature.
+    """
+    qOverP = np.asarray(qOverP, dtype=float)
+    pt = np.asarray(pt, dtype=float)
+    return -np.sign(qOverP) * 0.3 * magneticField / np.where(pt > 0, pt, np.inf)
+
+
+def helixPoint(
+    origins: np.ndarray, versors: np.ndarray, curvatures: np.ndarray, s: np.ndarray
+):
+    """Function that moves along helical tracks, given by their perigee (origins), their
+    versors at the perigee and their curvatures (see trackCurvature), by the transverse path
+    length s. Arrays can have any leading shape (e.g. (Ntracks,) or (Njets, maxTracks));
+    straight tracks (null curvature) are handled without loss of precision.
+
+    Parameters
+    ----------
+    origins : np.ndarray
+        tracks' perigees of shape (..., 3)
+    versors : np.ndarray
+        tracks' versors at the perigee of shape (..., 3)
+    curvatures : np.ndarray
+        tracks' curvatures in 1/mm of shape (...)
+    s : np.ndarray
+        transverse path lengths in mm of shape (...), positive along the momentum
+
+    Returns
+    -------
+    tuple of np.ndarray
+        points on the tracks and tracks' versors at those points, of shape (..., 3).
+    """
+    sinTheta = np.hypot(versors[..., 1], versors[..., 2])
+    phi0 = np.arctan2(versors[..., 2], versors[..., 1])
+    halfTurn = 0.5 * curvatures * s
+    # (sin(phi0 + k s) - sin(phi0)) / k, written with sinc so that it is exact for k = 0
+    chord = s * np.sinc(halfTurn / np.pi)
+    phiMid = phi0 + halfTurn
+    phi = phi0 + 2 * halfTurn
+    cotTheta = versors[..., 0] / np.where(sinTheta > 0, sinTheta, 1.0)
+    points = origins + np.stack(
+        [s * cotTheta, chord * np.cos(phiMid), chord * np.sin(phiMid)], axis=-1
+    )
+    tangents = np.stack(
+        [
+            np.broadcast_to(versors[..., 0], phi.shape),
+            sinTheta * np.cos(phi),
+            sinTheta * np.sin(phi),
+        ],
+        axis=-1,
+    )
+    return points, tangents
+
+
+def helixClosestApproach(
+    origins: np.ndarray,
+    versors: np.ndarray,
+    curvatures: np.ndarray,
+    points: np.ndarray,
+    nSteps: int = 3,
+):
+    """Function that finds the transverse path length (see helixPoint) of the point of helical
+    tracks closest to the given points in the transverse plane, with Newton steps starting
+    from the straight line approximation.
+
+    Parameters
+    ----------
+    origins, versors, curvatures : np.ndarray
+        tracks' perigees, versors at the perigee and curvatures (see helixPoint)
+    points : np.ndarray
+        points of shape (..., 3), broadcastable to origins
+    nSteps : int, optional
+        number of Newton steps, by default 3
+
+    Returns
+    -------
+    np.ndarray
+        transverse path lengths in mm of shape (...).
+    """
+    sinTheta = np.hypot(versors[..., 1], versors[..., 2])
+    sinTheta = np.where(sinTheta > 0, sinTheta, 1.0)
+    # Straight line approximation
+    s = np.sum((points - origins)[..., 1:] * versors[..., 1:], axis=-1) / sinTheta
+    for _ in range(nSteps):
+        helix, tangents = helixPoint(origins, versors, curvatures, s)
+        distance = (points - helix)[..., 1:]
+        # Derivatives of the projection of the distance on the transverse tangent
+        direction = tangents[..., 1:] / sinTheta[..., None]
+        normal = np.stack([-direction[..., 1], direction[..., 0]], axis=-1)
+        f = np.sum(distance * direction, axis=-1)
+        df = curvatures * np.sum(distance * normal, axis=-1) - 1.0
+        s = s - f / df
+    return s
+
+
 class JetContainer:
     """Class that contains the important elements of a jet in a vertex fitting perspective."""
 
@@ -33,6 +233,258 @@ class JetContainer:
         self.allTracks = self.tracksNoSV1 + self.tracksSV1
 
 
+class JetBatch:
+    """Class that stores a batch of jets in columnar form: the tracks of all the jets are stored
+    in contiguous arrays, in jet order, and the tracks of the i-th jet are the rows
+    offsets[i]:offsets[i+1] of each track column. Per-jet views are slices of these arrays,
+    hence they do not copy data.
+
+    Public Members
+    --------------
+    self.offsets : np.array of shape (Njets+1,), offsets of the jets' tracks in the track columns;
+    self.origins : np.array of shape (Ntracks, 3), tracks' origins (see H5Track);
+    self.versors : np.array of shape (Ntracks, 3), tracks' versors (see H5Track);
+    self.covDiag : np.array of shape (Ntracks, 6), diagonals of the tracks' covariance matrices;
+    self.curvatures : np.array of shape (Ntracks,), tracks' curvatures in 1/mm (see trackCurvature),
+        null for straight tracks;
+    self.pt : np.array of shape (Ntracks,), tracks' pt in MeV;
+    self.IP3D_signed_d0 : np.array of shape (Ntracks,), tracks' IP3D_signed_d0;
+    self.truthOriginLabel : np.array of shape (Ntracks,), tracks' MC truth origin codes
+        (see H5Track.truthOriginDict);
+    self.gn2Origin : np.array of shape (Ntracks,), tracks' GN2 origin prediction codes;
+    self.originProbabilities : np.array of shape (Ntracks, 8), GN2 origin probabilities, ordered
+        as H5Track.truthOriginDict;
+    self.SV1Selected : np.array of shape (Ntracks,), boolean mask of the tracks selected by SV1;
+    self.properties : dict of np.array of shape (Njets,), properties of the jets as a whole
+        (same keys of JetContainer.properties, plus jetIndex, the jets' row in the H5 file);
+
+    Public Methods
+    --------------
+    nTracks() : returns np.array of shape (Njets,), the number of tracks of each jet;
+    jetSlice(i) : returns the slice of the track columns of the i-th jet;
+    trackJetIndex() : returns np.array of shape (Ntracks,), the jet index of each track;
+    nSV1Tracks() : returns np.array of shape (Njets,), the number of SV1 selected tracks of each jet;
+    selectJets(jetMask) : returns a new JetBatch with only the selected jets;
+    jetRange(start, stop) : returns a JetBatch with the jets start:stop, as views (no copies);
+    padded(trackMask, jetMask, trackWeights) : returns the (selected) tracks (and their weights) as
+        zero-padded arrays, as expected by singleVertexFitter_straightTracks.fitBatch;
+    paddedColumn(values, trackMask, jetMask) : returns a track column (e.g. curvatures) as a
+        zero-padded array, with the same packing of padded;
+    nbytes() : returns the memory used by the batch's arrays in bytes;
+    concatenate(batches) : static method that concatenates a list of JetBatch;
+    """
+
+    # Names of the track columns
+    trackColumns = (
+        "origins",
+        "versors",
+        "covDiag",
+        "curvatures",
+        "pt",
+        "IP3D_signed_d0",
+        "truthOriginLabel",
+        "gn2Origin",
+        "originProbabilities",
+        "SV1Selected",
+    )
+
+    def __init__(self, offsets: np.ndarray, properties: dict, **trackColumns) -> None:
+        """Constructor of the class.
+
+        Parameters
+        ----------
+        offsets : np.ndarray
+            offsets of the jets' tracks, of shape (Njets+1,)
+        properties : dict
+            properties of the jets as a whole, as arrays of shape (Njets,)
+        **trackColumns:
+            track columns, as arrays of shape (Ntracks, ...); the names are the ones in
+            JetBatch.trackColumns.
+        """
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.properties = properties
+        for name in self.trackColumns:
+            setattr(self, name, trackColumns[name])
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def nTracks(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def jetSlice(self, i: int) -> slice:
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def trackJetIndex(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self)), self.nTracks())
+
+    def nSV1Tracks(self) -> np.ndarray:
+        return np.bincount(self.trackJetIndex()[self.SV1Selected], minlength=len(self))
+
+    def selectJets(self, jetMask: np.ndarray):
+        """Function that returns a new JetBatch that only contains the selected jets.
+
+        Parameters
+        ----------
+        jetMask : np.ndarray
+            boolean mask of the jets to keep, of shape (Njets,)
+
+        Returns
+        -------
+        JetBatch
+            the batch of the selected jets.
+        """
+        jetMask = np.asarray(jetMask, dtype=bool)
+        trackMask = np.repeat(jetMask, self.nTracks())
+        offsets = np.concatenate(([0], np.cumsum(self.nTracks()[jetMask])))
+        properties = {k: v[jetMask] for k, v in self.properties.items()}
+        return JetBatch(
+            offsets,
+            properties,
+            **{name: getattr(self, name)[trackMask] for name in self.trackColumns},
+        )
+
+    def jetRange(self, start: int, stop: int):
+        """Function that returns a JetBatch with the jets from start to stop (excluded);
+        its columns are views of the ones of this batch.
+
+        Parameters
+        ----------
+        start : int
+            index of the first jet
+        stop : int
+            index of the last jet (excluded)
+
+        Returns
+        -------
+        JetBatch
+            the batch of the jets in the range.
+        """
+        stop = min(stop, len(self))
+        tracks = slice(self.offsets[start], self.offsets[stop])
+        return JetBatch(
+            self.offsets[start : stop + 1] - self.offsets[start],
+            {k: v[start:stop] for k, v in self.properties.items()},
+            **{name: getattr(self, name)[tracks] for name in self.trackColumns},
+        )
+
+    def padded(
+        self,
+        trackMask: np.ndarray = None,
+        jetMask: np.ndarray = None,
+        trackWeights: np.ndarray = None,
+    ):
+        """Function that packs the tracks of the jets (optionally only the selected ones)
+        into zero-padded arrays.
+
+        Parameters
+        ----------
+        trackMask : np.ndarray, optional
+            boolean mask of the tracks to use, of shape (Ntracks,), by default None which
+            means that all tracks are used
+        jetMask : np.ndarray, optional
+            boolean mask of the jets to pack, of shape (Njets,), by default None which
+            means that all jets are packed
+        trackWeights : np.ndarray, optional
+            weights of the tracks of shape (Ntracks,) to be packed too, by default None
+
+        Returns
+        -------
+        tuple of np.ndarray
+            origins and versors of shape (NselectedJets, maxTracks, 3), diagonals of the tracks'
+            covariance matrices of shape (NselectedJets, maxTracks, 6) and the boolean mask of the
+            non-padded tracks of shape (NselectedJets, maxTracks); if trackWeights is given, also
+            the tracks' weights of shape (NselectedJets, maxTracks), zero for the padded tracks.
+        """
+        select, jetIndex, rank, nJets, maxTracks = self.__packing(trackMask, jetMask)
+        origins = np.zeros((nJets, maxTracks, 3))
+        versors = np.zeros((nJets, maxTracks, 3))
+        covDiag = np.zeros((nJets, maxTracks, 6))
+        mask = np.zeros((nJets, maxTracks), dtype=bool)
+        origins[jetIndex, rank] = self.origins[select]
+        versors[jetIndex, rank] = self.versors[select]
+        covDiag[jetIndex, rank] = self.covDiag[select]
+        mask[jetIndex, rank] = True
+        if trackWeights is not None:
+            weights = np.zeros((nJets, maxTracks))
+            weights[jetIndex, rank] = trackWeights[select]
+            return origins, versors, covDiag, mask, weights
+        return origins, versors, covDiag, mask
+
+    def paddedColumn(
+        self,
+        values: np.ndarray,
+        trackMask: np.ndarray = None,
+        jetMask: np.ndarray = None,
+    ) -> np.ndarray:
+        """Function that packs a track column (of shape (Ntracks, ...)) of the jets
+        (optionally only of the selected tracks) into a zero-padded array, with the same
+        layout of the arrays returned by padded (see padded for the parameters)."""
+        select, jetIndex, rank, nJets, maxTracks = self.__packing(trackMask, jetMask)
+        column = np.zeros((nJets, maxTracks) + values.shape[1:], dtype=values.dtype)
+        column[jetIndex, rank] = values[select]
+        return column
+
+    def __packing(self, trackMask: np.ndarray, jetMask: np.ndarray):
+        """Returns the mask of the packed tracks, their jet and position in the padded arrays,
+        the number of packed jets and the maximum number of tracks of a packed jet."""
+        select = (
+            np.ones(len(self.origins), dtype=bool) if trackMask is None else trackMask
+        )
+        jetIndex = self.trackJetIndex()
+        nJets = len(self)
+        if jetMask is not None:
+            select = select & jetMask[jetIndex]
+            # Index of the jets among the packed ones
+            jetIndex = np.cumsum(jetMask) - 1
+            jetIndex = jetIndex[self.trackJetIndex()]
+            nJets = np.count_nonzero(jetMask)
+        jetIndex = jetIndex[select]
+        # Position of each track in its jet
+        counts = np.bincount(jetIndex, minlength=nJets)
+        rank = np.arange(len(jetIndex)) - (np.cumsum(counts) - counts)[jetIndex]
+        return select, jetIndex, rank, nJets, counts.max(initial=0)
+
+    def nbytes(self) -> int:
+        return (
+            self.offsets.nbytes
+            + sum(getattr(self, name).nbytes for name in self.trackColumns)
+            + sum(v.nbytes for v in self.properties.values())
+        )
+
+    @staticmethod
+    def concatenate(batches: list):
+        """Function that concatenates a list of JetBatch (with the same properties) into a single one.
+
+        Parameters
+        ----------
+        batches : list
+            list of JetBatch
+
+        Returns
+        -------
+        JetBatch
+            the concatenated batch.
+        """
+        # Shifting the offsets of each batch by the tracks of the previous ones
+        shifts = np.cumsum([0] + [b.offsets[-1] for b in batches[:-1]])
+        offsets = np.concatenate(
+            [[0]] + [b.offsets[1:] + shift for b, shift in zip(batches, shifts)]
+        )
+        properties = {
+            k: np.concatenate([b.properties[k] for b in batches])
+            for k in batches[0].properties
+        }
+        return JetBatch(
+            offsets,
+            properties,
+            **{
+                name: np.concatenate([getattr(b, name) for b in batches])
+                for name in JetBatch.trackColumns
+            },
+        )
+
+
 class H5Track:
     """Class that stores the representation of a track as a straight line with an origin and a versor,
     plus other track's relevant information.
@@ -44,23 +496,32 @@ class H5Track:
     y    ->    z
     z    ->    x
     ```
+    The straight line representation (origin, versor and errors) is computed on first access
+    and then cached, so that tracks which are never fitted do not pay for it.
+    Curved tracks also store their curvature: their origin and versor are then the perigee and
+    the direction at the perigee of a helix (see helixPoint).
 
     Public Members
     --------------
     self.origin : np.array of shape (3,), (x,y,z) coordinates of the track's origin (perigee wrt beamline);
     self.versor : np.array of shape (3,), (x,y,z) components of the track's versor
         with LHC choice of reference system they are (cos(theta),cos(phi)sin(theta),sin(phi)sin(theta));
-    self.truthOriginLabel : str indicating the track's provenience's MC truth;
-    self.SV1VertexIndex : str indicating the SV1 selection for the track's vertex ('From PV' or 'From SV');
+    self.covDiag : np.array of shape (6,), errors on the origin's and versor's components;
+    self.covMat : np.array of shape (6,6), diagonal covariance matrix built from covDiag;
+    self.curvature : float, track's curvature in 1/mm (see trackCurvature), 0 for straight tracks;
+    self.truthOriginLabel : int code of the track's provenience's MC truth (see truthOriginDict);
+    self.gn2Origin : int code of the track's provenience predicted by GN2 (see truthOriginDict);
+    self.SV1VertexIndex : int SV1VertexIndex field in h5 file (0 means selected by SV1 for the secondary vertex);
 
     Public Methods
     --------------
-    evaluate(t) : returns np.array of shape (3,), evaluates the parametric representation of the line
-        where t is the value of the line's parameter;
+    fromGeometry(...) : class method that builds the track from its precomputed straight line
+        representation (see trackGeometry);
 
     Private Methods
     ---------------
     __theta(eta) : converts the pseudorapidity into polar angle theta;
+    __computeGeometry() : computes and caches the straight line representation;
     """
 
     # Dictionary to map the numeric value of the track's truthOriginDict to its meaning
@@ -77,6 +538,22 @@ class H5Track:
         8: "ND",
     }
 
+    __slots__ = (
+        "pt",
+        "eta",
+        "dphi",
+        "IP3D_signed_d0",
+        "z0RelativeToBeamspot",
+        "errors",
+        "truthOriginLabel",
+        "gn2Origin",
+        "SV1VertexIndex",
+        "curvature",
+        "_origin",
+        "_versor",
+        "_covDiag",
+    )
+
     # Private methods
     # eta -> theta conversion
     def __theta(self, eta):
@@ -94,6 +571,7 @@ class H5Track:
         ftagTruthOriginLabel: int = 8,
         gn2Origin: int = 8,
         SV1VertexIndex: int = -2,
+        curvature: float = 0.0,
     ):
         """Constructor of the class from h5 track's parameter.
 
@@ -110,35 +588,76 @@ class H5Track:
         z0RelativeToBeamspot : float
             tracks's z0RelativeToBeamspot field in h5 file
         errors : list
-            _description_
+            tracks's uncertainties on theta, phi, d0 and z0, in this order
         ftagTruthOriginLabel : int, optional
             tracks's ftagTruthOriginLabel field in h5 file, by default 8
         gn2Origin : int, optional
             tracks's GN2's origin prediction, by default 8
         SV1VertexIndex : int, optional
             tracks' SV1VertexIndex field in h5 file, by default -2
+        curvature : float, optional
+            tracks's curvature in 1/mm (see trackCurvature), by default 0.0 (straight track)
         """
-
         self.pt = pt
+        self.eta = eta
+        self.dphi = dphi
+        self.IP3D_signed_d0 = IP3D_signed_d0
+        self.z0RelativeToBeamspot = z0RelativeToBeamspot
+        self.errors = tuple(errors)
+
+        # MC truth and GN2 label
+        self.truthOriginLabel = int(ftagTruthOriginLabel)
+        self.gn2Origin = int(gn2Origin)
+        self.SV1VertexIndex = int(SV1VertexIndex)
+        self.curvature = float(curvature)
+
+        # Straight line representation, computed on first access
+        self._origin = None
+        self._versor = None
+        self._covDiag = None
+
+    @property
+    def origin(self) -> np.ndarray:
+        if self._origin is None:
+            self.__computeGeometry()
+        return self._origin
+
+    @property
+    def versor(self) -> np.ndarray:
+        if self._versor is None:
+            self.__computeGeometry()
+        return self._versor
+
+    @property
+    def covDiag(self) -> np.ndarray:
+        if self._covDiag is None:
+            self.__computeGeometry()
+        return self._covDiag
+
+    @property
+    def covMat(self) -> np.ndarray:
+        # for now, I only have the diagonal
+        return np.diag(self.covDiag)
+
+    def __computeGeometry(self):
+        dphi = self.dphi
+        IP3D_signed_d0 = self.IP3D_signed_d0
         # eta -> theta conversion
-        thetaT = self.__theta(eta)
+        thetaT = self.__theta(self.eta)
         # versor
         xCern = m.sin(thetaT) * m.cos(dphi)
         yCern = m.sin(thetaT) * m.sin(dphi)
         zCern = m.cos(thetaT)
-        self.versor = np.array([zCern, xCern, yCern])
+        self._versor = np.array([zCern, xCern, yCern])
 
         # origin
         phiP = dphi - m.pi / 2 if IP3D_signed_d0 > 0 else dphi + m.pi / 2
         y0 = abs(IP3D_signed_d0) * m.sin(phiP)
         x0 = abs(IP3D_signed_d0) * m.cos(phiP)
-        self.origin = np.array([z0RelativeToBeamspot, x0, y0])
-        self.IP3D_signed_d0 = IP3D_signed_d0
+        self._origin = np.array([self.z0RelativeToBeamspot, x0, y0])
+
         # Errors
-        sigmaTheta = errors[0]
-        sigmaPhi = errors[1]
-        sigmaD0 = errors[2]
-        sigmaZ0 = errors[3]
+        sigmaTheta, sigmaPhi, sigmaD0, sigmaZ0 = self.errors
 
         # versor error
         eVersor = np.array(
@@ -161,14 +680,72 @@ class H5Track:
             ]
         )
 
-        eVersor = np.sqrt(eVersor)
-        eOrigin = np.sqrt(eOrigin)
+        # diagonal of the cov matrix
+        self._covDiag = np.sqrt(np.concatenate((eOrigin, eVersor)))
 
-        # cov matrix
-        # for now, I only have the diagonal
-        self.covMat = np.diag(np.concatenate((eOrigin, eVersor)))
+    @classmethod
+    def fromGeometry(
+        cls,
+        origin: np.ndarray,
+        versor: np.ndarray,
+        covDiag: np.ndarray,
+        pt: float,
+        eta: float,
+        dphi: float,
+        IP3D_signed_d0: float,
+        errors: list,
+        ftagTruthOriginLabel: int = 8,
+        gn2Origin: int = 8,
+        SV1VertexIndex: int = -2,
+        curvature: float = 0.0,
+    ):
+        """Alternative constructor that builds the track from its straight line representation,
+        as computed for many tracks at once by trackGeometry, skipping the scalar computation.
 
-        # MC truth and GN2 label
-        self.truthOriginLabel = self.truthOriginDict[ftagTruthOriginLabel]
-        self.gn2Origin = self.truthOriginDict[gn2Origin]
-        self.SV1VertexIndex = "From SV" if SV1VertexIndex == 0 else "From PV"
+        Parameters
+        ----------
+        origin : np.ndarray
+            track's origin of shape (3,)
+        versor : np.ndarray
+            track's versor of shape (3,)
+        covDiag : np.ndarray
+            diagonal of the track's covariance matrix of shape (6,)
+        pt : float
+            track's pt in MeV
+        eta : float
+            tracks's eta field in h5 file
+        dphi : float
+            tracks's dphi field in h5 file
+        IP3D_signed_d0 : float
+            tracks's IP3D_signed_d0 field in h5 file
+        errors : list
+            tracks's uncertainties on theta, phi, d0 and z0, in this order
+        ftagTruthOriginLabel : int, optional
+            tracks's ftagTruthOriginLabel field in h5 file, by default 8
+        gn2Origin : int, optional
+            tracks's GN2's origin prediction, by default 8
+        SV1VertexIndex : int, optional
+            tracks' SV1VertexIndex field in h5 file, by default -2
+        curvature : float, optional
+            tracks's curvature in 1/mm (see trackCurvature), by default 0.0 (straight track)
+
+        Returns
+        -------
+        H5Track
+            the track.
+        """
+        track = cls.__new__(cls)
+        track.pt = pt
+        track.eta = eta
+        track.dphi = dphi
+        track.IP3D_signed_d0 = IP3D_signed_d0
+        track.z0RelativeToBeamspot = origin[0]
+        track.errors = tuple(errors)
+        track.truthOriginLabel = int(ftagTruthOriginLabel)
+        track.gn2Origin = int(gn2Origin)
+        track.SV1VertexIndex = int(SV1VertexIndex)
+        track.curvature = float(curvature)
+        track._origin = origin
+        track._versor = versor
+        track._covDiag = covDiag
+        return track
@@ -0,0 +1,112 @@
+# Python import
+import numpy as np
+
+
+class ConvergencePolicy:
+    """Class that defines when an iterative vertex fit stops. An iteration is "small" if the vertex
+    moved by less than absoluteTolerance, or by less than relativeTolerance times the distance of
+    the vertex from the origin, or if the chi2 changed by less than chi2Tolerance (relative); the fit
+    converges after nConsecutive small iterations in a row. A fit that instead reaches maxIter
+    iterations, or runs out of its time budget, stops without converging and is flagged as such.
+    The default policy is the stopping rule of singleVertexFitter_straightTracks.
+
+    Public Members
+    --------------
+    self.absoluteTolerance : float, tolerance on the vertex increment;
+    self.relativeTolerance : float, tolerance on the vertex increment relative to the vertex distance
+        from the origin (0 to disable it);
+    self.chi2Tolerance : float, tolerance on the relative change of the chi2 (None to disable it);
+    self.nConsecutive : int, number of consecutive small iterations needed to converge
+        (1 means stopping at the first one);
+    self.maxIter : int, maximum number of iterations of each fit;
+    self.timeBudget : float, time budget in seconds of each fit (None to disable it); in a batch of
+        fits, each iteration is charged to the jets it updates in equal shares;
+
+    Public Methods
+    --------------
+    smallSteps(dv, v, chi2Old, chi2New) : returns the mask of the small iterations;
+    outOfTime(elapsed) : returns which fits ran out of their time budget;
+    key() : returns a str that identifies the policy;
+    """
+
+    def __init__(
+        self,
+        absoluteTolerance: float = 1e-8,
+        relativeTolerance: float = 0.0,
+        chi2Tolerance: float = None,
+        nConsecutive: int = 6,
+        maxIter: float = 1e2,
+        timeBudget: float = None,
+    ) -> None:
+        """Constructor of the class.
+
+        Parameters
+        ----------
+        absoluteTolerance : float, optional
+            tolerance on the vertex increment, by default 1e-8
+        relativeTolerance : float, optional
+            tolerance on the vertex increment relative to the vertex distance from the origin,
+            by default 0.0 (disabled)
+        chi2Tolerance : float, optional
+            tolerance on the relative change of the chi2, by default None (disabled); it requires
+            the chi2 to be computed at every iteration
+        nConsecutive : int, optional
+            number of consecutive small iterations needed to converge, by default 6
+        maxIter : float, optional
+            maximum number of iterations, by default 1e2
+        timeBudget : float, optional
+            time budget of each fit in seconds, by default None (disabled)
+        """
+        self.absoluteTolerance = absoluteTolerance
+        self.relativeTolerance = relativeTolerance
+        self.chi2Tolerance = chi2Tolerance
+        self.nConsecutive = int(nConsecutive)
+        self.maxIter = maxIter
+        self.timeBudget = timeBudget
+
+    def key(self) -> str:
+        """Returns a str that identifies the policy's settings."""
+        return (
+            f"{type(self).__name__}(absoluteTolerance={self.absoluteTolerance!r},"
+            f"relativeTolerance={self.relativeTolerance!r},chi2Tolerance={self.chi2Tolerance!r},"
+            f"nConsecutive={self.nConsecutive!r},maxIter={self.maxIter!r},"
+            f"timeBudget={self.timeBudget!r})"
+        )
+
+    def smallSteps(
+        self,
+        dv: np.ndarray,
+        v: np.ndarray,
+        chi2Old: np.ndarray = None,
+        chi2New: np.ndarray = None,
+    ) -> np.ndarray:
+        """Function that returns which of the last iterations of a batch of fits were small.
+
+        Parameters
+        ----------
+        dv : np.ndarray
+            norms of the vertexes' increments, of shape (Njets,)
+        v : np.ndarray
+            the vertexes, of shape (Njets, 3)
+        chi2Old, chi2New : np.ndarray, optional
+            chi2 before and after the iterations, of shape (Njets,), needed if chi2Tolerance is set
+
+        Returns
+        -------
+        np.ndarray
+            boolean mask of the small iterations, of shape (Njets,).
+        """
+        small = dv < self.absoluteTolerance
+        if self.relativeTolerance > 0:
+            small |= dv < self.relativeTolerance * np.linalg.norm(v, axis=-1)
+        if self.chi2Tolerance is not None and chi2Old is not None:
+            small |= np.abs(chi2New - chi2Old) <= self.chi2Tolerance * np.abs(chi2Old)
+        return small
+
+    def outOfTime(self, elapsed) -> np.ndarray:
+        """Returns which fits ran out of their time budget, given the time spent on them in
+        seconds (a float for a single fit, or an array of shape (Njets,) for a batch).
+        """
+        if self.timeBudget is None:
+            return np.zeros(np.shape(elapsed), dtype=bool)
+        return np.asarray(elapsed) > self.timeBudget
@@ -0,0 +1,371 @@
+# Python import
+import hashlib
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+
+# Name of the file whose modification time marks the last use of a cache entry
+lastUsedFilename = "lastUsed"
+# Number of consecutive jets (rows of the H5 file) stored in the segments of the same block
+blockJets = 2**16
+
+
+def fileIdentity(filepath: str) -> str:
+    """Function that returns a str identifying the content of a file, built from its size,
+    its modification time and the hash of its first MB (cheap even for very large files).
+    """
+    stat = os.stat(filepath)
+    h = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(filepath, "rb") as f:
+        h.update(f.read(2**20))
+    return h.hexdigest()
+
+
+class FitCache:
+    """Class that implements a persistent on-disk cache of per-jet fit results. Results are grouped
+    in entries keyed by the input file identity, the selection definition and the fitter's
+    algorithm, version and settings; inside an entry they are indexed by the jet's row in the
+    H5 file. Each entry is a directory of segment files (.npz): jets are grouped in blocks of
+    blockJets consecutive rows, each flush writes one new segment per block, and a lookup only
+    loads the blocks of the requested jets; the total size of the cache is bounded and the least
+    recently used entries are evicted first.
+
+    Public Members
+    --------------
+    self.directory : str, path of the cache;
+    self.fileId : str, identity of the input file (see fileIdentity);
+    self.maxBytes : int, maximum size of the cache on disk;
+    self.straightTracks : bool, wether the jets are imported with straight tracks;
+
+    Public Methods
+    --------------
+    lookup(selection, fitter, jetIndex) : returns the cached results of the given jets;
+    store(selection, fitter, jetIndex, vertexes, chi2, converged, covariances) : adds results to
+        the cache (in memory);
+    flush() : writes the stored results to disk and evicts entries above the size limit;
+    compact() : merges the segments of each block of each entry into a single one;
+    size() : returns the size of the cache on disk in bytes;
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        filepath: str,
+        maxBytes: float = 2e9,
+        straightTracks: bool = True,
+    ) -> None:
+        """Constructor of the class.
+
+        Parameters
+        ----------
+        directory : str
+            path of the cache
+        filepath : str
+            path of the input H5 file
+        maxBytes : float, optional
+            maximum size of the cache on disk in bytes, by default 2e9
+        straightTracks : bool, optional
+            Wether the jets are imported with straight (True) or curved (False) tracks (see
+            iterateH5), by default True; results of curved tracks are stored separately
+        """
+        self.directory = directory
+        self.fileId = fileIdentity(filepath)
+        self.maxBytes = int(maxBytes)
+        self.straightTracks = straightTracks
+        # (entry key, block) -> (jetIndex, vertexes, chi2, converged, covariances) loaded
+        # from disk
+        self.__loaded = {}
+        # entry key -> list of (jetIndex, vertexes, chi2, converged, covariances) not yet
+        # written to disk
+        self.__pending = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        # Worker processes start with empty in-memory data
+        state = self.__dict__.copy()
+        state["_FitCache__loaded"] = {}
+        state["_FitCache__pending"] = {}
+        return state
+
+    def __entryKey(self, selection, fitter) -> str:
+        key = f"{self.fileId}|{selection.key()}|{fitter.key()}"
+        if not self.straightTracks:
+            key += "|curvedTracks"
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def __entryPath(self, entryKey: str) -> str:
+        return os.path.join(self.directory, entryKey)
+
+    def __load(self, entryKey: str, block: int):
+        if (entryKey, block) in self.__loaded:
+            return self.__loaded[(entryKey, block)]
+        path = self.__entryPath(entryKey)
+        segments = []
+        if os.path.isdir(path):
+            for file in sorted(os.listdir(path)):
+                if file.endswith(".npz") and _segmentBlock(file) == block:
+                    segments.append(_readSegment(os.path.join(path, file)))
+            # Marking the entry as used
+            open(os.path.join(path, lastUsedFilename), "w").close()
+        self.__loaded[(entryKey, block)] = _mergeSegments(segments)
+        return self.__loaded[(entryKey, block)]
+
+    def lookup(self, selection, fitter, jetIndex: np.ndarray):
+        """Function that returns the cached results of the given jets.
+
+        Parameters
+        ----------
+        selection : TrackSelection
+            the track selection
+        fitter : singleVertexFitter_straightTracks
+            the fitter (any fitter with a key method)
+        jetIndex : np.ndarray
+            rows of the jets in the H5 file, of shape (Njets,)
+
+        Returns
+        -------
+        tuple of np.ndarray
+            boolean mask of the jets found in the cache of shape (Njets,), their vertexes of shape
+            (Njets, 3), chi2 of shape (Njets,) (nan for the jets not found), convergence flags
+            of shape (Njets,) (False for the jets not found) and vertexes' covariance matrices of
+            shape (Njets, 3, 3) (nan for the jets not found, or if the fitter does not give them).
+        """
+        entryKey = self.__entryKey(selection, fitter)
+        # Blocks are disjoint and sorted, so their merge is sorted by jetIndex
+        cached = _mergeSegments(
+            [
+                self.__load(entryKey, int(block))
+                for block in np.unique(np.asarray(jetIndex) // blockJets)
+            ]
+        )
+        cachedIndex, cachedVertexes, cachedChi2, cachedConverged, cachedCovariances = (
+            cached
+        )
+        vertexes = np.full((len(jetIndex), 3), np.nan)
+        chi2 = np.full(len(jetIndex), np.nan)
+        converged = np.zeros(len(jetIndex), dtype=bool)
+        covariances = np.full((len(jetIndex), 3, 3), np.nan)
+        position = np.searchsorted(cachedIndex, jetIndex)
+        position = np.minimum(position, len(cachedIndex) - 1)
+        found = (
+            cachedIndex[position] == jetIndex
+            if len(cachedIndex) > 0
+            else np.zeros(len(jetIndex), dtype=bool)
+        )
+        vertexes[found] = cachedVertexes[position[found]]
+        chi2[found] = cachedChi2[position[found]]
+        converged[found] = cachedConverged[position[found]]
+        covariances[found] = cachedCovariances[position[found]]
+        return found, vertexes, chi2, converged, covariances
+
+    def store(
+        self,
+        selection,
+        fitter,
+        jetIndex: np.ndarray,
+        vertexes: np.ndarray,
+        chi2: np.ndarray,
+        converged: np.ndarray,
+        covariances: np.ndarray = None,
+    ):
+        """Function that adds fit results to the cache; they are written to disk by flush.
+
+        Parameters
+        ----------
+        selection : TrackSelection
+            the track selection
+        fitter : singleVertexFitter_straightTracks
+            the fitter (any fitter with a key method)
+        jetIndex : np.ndarray
+            rows of the jets in the H5 file, of shape (Njets,)
+        vertexes : np.ndarray
+            fitted vertexes of shape (Njets, 3)
+        chi2 : np.ndarray
+            chi2 of the fits of shape (Njets,)
+        converged : np.ndarray
+            convergence flags of the fits of shape (Njets,)
+        covariances : np.ndarray, optional
+            covariance matrices of the vertexes of shape (Njets, 3, 3), by default None which
+            means that the fitter does not give them
+        """
+        if len(jetIndex) == 0:
+            return
+        if covariances is None:
+            covariances = np.full((len(jetIndex), 3, 3), np.nan)
+        entryKey = self.__entryKey(selection, fitter)
+        self.__pending.setdefault(entryKey, []).append(
+            (
+                np.asarray(jetIndex, dtype=np.int64),
+                vertexes,
+                chi2,
+                converged,
+                covariances,
+            )
+        )
+
+    def flush(self):
+        """Function that writes the stored results to disk, one new segment per entry and block,
+        and evicts the least recently used entries if the cache exceeds its size limit.
+        """
+        for entryKey, segments in self.__pending.items():
+            path = self.__entryPath(entryKey)
+            os.makedirs(path, exist_ok=True)
+            merged = _mergeSegments(segments)
+            for block in np.unique(merged[0] // blockJets):
+                block = int(block)
+                blockMerged = _blockRows(merged, block)
+                _writeSegment(path, block, blockMerged)
+                if (entryKey, block) in self.__loaded:
+                    self.__loaded[(entryKey, block)] = _mergeSegments(
+                        [self.__loaded[(entryKey, block)], blockMerged]
+                    )
+            open(os.path.join(path, lastUsedFilename), "w").close()
+        self.__pending = {}
+        self.__evict()
+
+    def compact(self):
+        """Function that merges the segments of each block of each entry of the cache into a
+        single segment. It must not run while other processes are writing to the cache.
+        """
+        for entryKey in os.listdir(self.directory):
+            path = self.__entryPath(entryKey)
+            if not os.path.isdir(path):
+                continue
+            # block -> its segment files
+            blockFiles = {}
+            for file in sorted(f for f in os.listdir(path) if f.endswith(".npz")):
+                blockFiles.setdefault(_segmentBlock(file), []).append(file)
+            for block, files in blockFiles.items():
+                if len(files) < 2:
+                    continue
+                # Same order of __load: older segments first, so that the last one wins
+                segments = [_readSegment(os.path.join(path, f)) for f in files]
+                _writeSegment(path, block, _mergeSegments(segments))
+                self.__loaded.pop((entryKey, block), None)
+                for file in files:
+                    os.remove(os.path.join(path, file))
+
+    def size(self) -> int:
+        return _directorySize(self.directory)
+
+    def __evict(self):
+        # The size of each entry is computed once and subtracted as the entries are removed
+        entries = []
+        size = 0
+        for entryKey in os.listdir(self.directory):
+            path = self.__entryPath(entryKey)
+            if not os.path.isdir(path):
+                size += os.path.getsize(path)
+                continue
+            lastUsed = os.path.join(path, lastUsedFilename)
+            usedTime = os.path.getmtime(lastUsed) if os.path.exists(lastUsed) else 0
+            entrySize = _directorySize(path)
+            entries.append((usedTime, entryKey, entrySize))
+            size += entrySize
+        # Least recently used first
+        for _, entryKey, entrySize in sorted(entries):
+            if size <= self.maxBytes:
+                break
+            shutil.rmtree(self.__entryPath(entryKey), ignore_errors=True)
+            size -= entrySize
+            for loadedKey in [k for k in self.__loaded if k[0] == entryKey]:
+                del self.__loaded[loadedKey]
+
+
+def _directorySize(directory: str) -> int:
+    """Function that returns the size in bytes of the files in a directory and its subdirectories."""
+    total = 0
+    for root, _, files in os.walk(directory):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def _segmentBlock(filename: str) -> int:
+    """Function that returns the block of the jets of a segment file (see _writeSegment)."""
+    return int(filename[len("block") :].split("_")[0])
+
+
+def _readSegment(filepath: str):
+    """Function that reads a segment file as (jetIndex, vertexes, chi2, converged, covariances)."""
+    with np.load(filepath) as segment:
+        nJets = len(segment["jetIndex"])
+        # Segments written before the convergence flags were stored
+        converged = (
+            segment["converged"]
+            if "converged" in segment.files
+            else np.ones(nJets, dtype=bool)
+        )
+        # Segments of fitters that do not give the vertexes' covariance
+        covariances = (
+            segment["covariances"]
+            if "covariances" in segment.files
+            else np.full((nJets, 3, 3), np.nan)
+        )
+        return (
+            segment["jetIndex"],
+            segment["vertexes"],
+            segment["chi2"],
+            converged,
+            covariances,
+        )
+
+
+def _writeSegment(path: str, block: int, segment: tuple):
+    """Function that writes a new segment file of the given block in the entry directory path;
+    names are unique, so that concurrent processes never write the same segment."""
+    jetIndex, vertexes, chi2, converged, covariances = segment
+    # The covariances are only written if the fitter gives them
+    optional = {}
+    if not np.isnan(covariances).all():
+        optional["covariances"] = covariances
+    segmentPath = os.path.join(
+        path, f"block{block}_{time.time_ns()}_{uuid.uuid4().hex}.npz"
+    )
+    with open(segmentPath + ".tmp", "wb") as ofile:
+        np.savez(
+            ofile,
+            jetIndex=jetIndex,
+            vertexes=vertexes,
+            chi2=chi2,
+            converged=converged,
+            **optional,
+        )
+    os.replace(segmentPath + ".tmp", segmentPath)
+
+
+def _blockRows(segment: tuple, block: int):
+    """Function that returns the rows of a segment whose jets belong to the given block."""
+    keep = segment[0] // blockJets == block
+    return tuple(column[keep] for column in segment)
+
+
+def _mergeSegments(segments: list):
+    """Function that merges segments of cached results (jetIndex, vertexes, chi2, converged,
+    covariances) into a single one sorted by jetIndex; for duplicated jets the last segment wins.
+    """
+    if len(segments) == 0:
+        return (
+            np.zeros(0, dtype=np.int64),
+            np.zeros((0, 3)),
+            np.zeros(0),
+            np.zeros(0, dtype=bool),
+            np.zeros((0, 3, 3)),
+        )
+    jetIndex = np.concatenate([s[0] for s in segments])
+    vertexes = np.concatenate([s[1] for s in segments])
+    chi2 = np.concatenate([s[2] for s in segments])
+    converged = np.concatenate([s[3] for s in segments])
+    covariances = np.concatenate([s[4] for s in segments])
+    # Last occurrence of each jet
+    reversedIndex = jetIndex[::-1]
+    jetIndex, position = np.unique(reversedIndex, return_index=True)
+    position = len(reversedIndex) - 1 - position
+    return (
+        jetIndex,
+        vertexes[position],
+        chi2[position],
+        converged[position],
+        covariances[position],
+    )
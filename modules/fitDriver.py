@@ -0,0 +1,343 @@
+# Modules import
+from modules.ImportH5 import iterateH5
+from modules.trackSelection import fitSelections
+from modules.geometryCache import iterateGeometryCache
+from modules.profiling import Profiler, ProgressMeter, profileStage
+
+# Python import
+import h5py
+import numpy as np
+from multiprocessing import Pool
+
+
+def fitBatchColumns(
+    fitter,
+    batch,
+    selections: list,
+    requiredSelections: list = [],
+    properties: list = [],
+    cache=None,
+    profiler=None,
+    scheduler=None,
+):
+    """Function that fits all the track selections of a batch of jets and returns the results
+    of the jets that are kept as compact columns.
+
+    Parameters
+    ----------
+    fitter : singleVertexFitter_straightTracks
+        the vertex fitter (any fitter with a fitBatch method)
+    batch : JetBatch
+        the jets
+    selections : list
+        list of TrackSelection (and WorkingPointScan) to be fitted
+    requiredSelections : list, optional
+        names of the selections that must select at least one track to keep the jet, by default []
+    properties : list, optional
+        jet properties (keys of JetBatch.properties) to be stored with the results, by default []
+    cache : FitCache, optional
+        persistent cache of the fit results (see fitSelections), by default None
+    profiler : Profiler, optional
+        instrumentation of the run (see fitSelections), by default None
+    scheduler : MultiplicityScheduler, optional
+        scheduler of the batches sent to the fitter (see fitSelections), by default None
+
+    Returns
+    -------
+    dict
+        column name -> np.ndarray with one row per kept jet; for each selection the columns are
+        <name>_vertex, <name>_Lxy, <name>_chi2, <name>_nTracks and <name>_converged (False for
+        fits that stopped without converging, see ConvergencePolicy), plus <name>_LxySigma (the
+        uncertainty of Lxy, so Lxy / LxySigma is its significance) if the fitter gives the
+        covariance of the vertexes (returnsCovariance), followed by the requested jet properties.
+    """
+    results = fitSelections(fitter, batch, selections, cache, profiler, scheduler)
+
+    # If no tracks are left, skip the jet
+    fitted = np.ones(len(batch), dtype=bool)
+    for name in requiredSelections:
+        fitted &= results[name][2] > 0
+
+    withCovariance = getattr(fitter, "returnsCovariance", False)
+    columns = {}
+    for name, (vertexes, chi2, nSelected, converged, covariances) in results.items():
+        columns[f"{name}_vertex"] = vertexes[fitted]
+        # Lxy of the fitted vertex (for the coordinate system see H5Track docs)
+        Lxy = np.linalg.norm(vertexes[fitted, 1:], axis=1)
+        columns[f"{name}_Lxy"] = Lxy
+        if withCovariance:
+            # Propagation of the covariance to Lxy, whose gradient is [0, x, y] / Lxy
+            gradient = np.zeros((len(Lxy), 3))
+            gradient[:, 1:] = vertexes[fitted, 1:] / Lxy[:, None]
+            columns[f"{name}_LxySigma"] = np.sqrt(
+                np.einsum("ni,nij,nj->n", gradient, covariances[fitted], gradient)
+            )
+        columns[f"{name}_chi2"] = chi2[fitted]
+        columns[f"{name}_nTracks"] = nSelected[fitted]
+        columns[f"{name}_converged"] = converged[fitted]
+    for p in properties:
+        columns[p] = batch.properties[p][fitted]
+    return columns
+
+
+def concatenateColumns(columnsList: list):
+    """Function that concatenates (in order) a list of dictionaries of result columns;
+    empty dictionaries (from ranges with no jets) are skipped."""
+    columnsList = [columns for columns in columnsList if len(columns) > 0]
+    if len(columnsList) == 0:
+        return {}
+    return {
+        k: np.concatenate([columns[k] for columns in columnsList])
+        for k in columnsList[0]
+    }
+
+
+def fitFile(
+    filepath: str,
+    fitter,
+    selections: list,
+    requiredSelections: list = [],
+    properties: list = [],
+    Nevents: int = -1,
+    firstEvent: int = 0,
+    customProperties: list = [],
+    jetFilters: list = [],
+    onlySV1: bool = False,
+    straightTracks: bool = True,
+    verbose: bool = False,
+    writer=None,
+    cache=None,
+    geometryCache: str = None,
+    profiler=None,
+    scheduler=None,
+):
+    """Function that imports and fits the jets of an H5 file (or of a range of its jets)
+    chunk by chunk, in a single process.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the H5 file
+    fitter : singleVertexFitter_straightTracks
+        the vertex fitter (any fitter with a fitBatch method)
+    selections : list
+        list of TrackSelection (and WorkingPointScan) to be fitted
+    requiredSelections : list, optional
+        names of the selections that must select at least one track to keep the jet, by default []
+    properties : list, optional
+        jet properties to be stored with the results, by default []
+    Nevents : int, optional
+        Number of jets to be read, by default -1 which means all the jets after firstEvent
+    firstEvent : int, optional
+        Index of the first jet to be read, by default 0
+    customProperties : list, optional
+        other jet properties to import (see importH5), by default []
+    jetFilters : list, optional
+        JetFilter applied before reading the tracks (see importH5), by default []
+    onlySV1 : bool, optional
+        Wether to filter only jets that have been fitted by SV1, by default False
+    straightTracks : bool, optional
+        Wether to use straight (True) or curved (False) tracks (see iterateH5), by default True;
+        curved tracks are only used by fitters that support them (see singleVertexFitter_helix)
+    verbose : bool, optional
+        Wether to print the progress (jets/s and ETA) while fitting, by default False
+    writer : ColumnStoreWriter, optional
+        if given, the results of each batch are appended to it as soon as the batch is fitted
+        instead of being kept in memory, by default None
+    cache : FitCache, optional
+        persistent cache of the fit results: only the jets missing in it are fitted, and the new
+        results are written to it at the end, by default None
+    geometryCache : str, optional
+        path of the memory-mapped geometry cache of the file (see geometryCache.buildGeometryCache)
+        to read the jets from instead of decoding the H5 file, by default None which means
+        decoding the H5 file
+    profiler : Profiler, optional
+        if given, the time spent in each stage (read, decode, select, cache, fit, write) and the
+        telemetry of the fits are added to it, by default None
+    scheduler : MultiplicityScheduler, optional
+        if given, the jets of each chunk are sent to the fitter in batches of similar number of
+        selected tracks (see fitSelections), by default None
+
+    Returns
+    -------
+    dict
+        result columns of the fitted jets, in file order (see fitBatchColumns);
+        empty if writer is given.
+    """
+    columnsList = []
+    nFittedJets = 0
+    progress = ProgressMeter(Nevents if Nevents != -1 else None) if verbose else None
+    if geometryCache is not None:
+        batches = iterateGeometryCache(
+            filepath,
+            Nevents=Nevents,
+            firstEvent=firstEvent,
+            onlySV1=onlySV1,
+            jetFilters=jetFilters,
+            cachePath=geometryCache,
+            straightTracks=straightTracks,
+            profiler=profiler,
+        )
+    else:
+        batches = iterateH5(
+            filepath=filepath,
+            Nevents=Nevents,
+            firstEvent=firstEvent,
+            customProperties=customProperties,
+            onlySV1=onlySV1,
+            straightTracks=straightTracks,
+            jetFilters=jetFilters,
+            asBatch=True,
+            profiler=profiler,
+        )
+    for batch in batches:
+        columns = fitBatchColumns(
+            fitter,
+            batch,
+            selections,
+            requiredSelections,
+            properties,
+            cache,
+            profiler,
+            scheduler,
+        )
+        nBatchJets = len(next(iter(columns.values())))
+        if writer is not None:
+            with profileStage(profiler, "write", nBatchJets):
+                writer.append(columns)
+        else:
+            columnsList.append(columns)
+        nFittedJets += nBatchJets
+        # Status
+        if progress is not None and len(batch) > 0:
+            progress.update(
+                int(batch.properties["jetIndex"][-1]) + 1 - firstEvent, nFittedJets
+            )
+    if cache is not None:
+        with profileStage(profiler, "cache"):
+            cache.flush()
+    if progress is not None:
+        progress.close()
+    return concatenateColumns(columnsList)
+
+
+def _fitShard(arguments: tuple):
+    """Function run by the worker processes: it opens the file and fits one shard of it;
+    it returns the result columns and the shard's Profiler (None if not profiling)."""
+    filepath, firstEvent, Nevents, settings, trackMemory = arguments
+    profiler = Profiler(trackMemory) if trackMemory is not None else None
+    columns = fitFile(
+        filepath,
+        firstEvent=firstEvent,
+        Nevents=Nevents,
+        profiler=profiler,
+        **settings,
+    )
+    return columns, profiler
+
+
+def parallelFitFile(
+    filepath: str,
+    fitter,
+    selections: list,
+    nWorkers: int = 1,
+    shardSize: int = None,
+    Nevents: int = -1,
+    writer=None,
+    verbose: bool = False,
+    profiler=None,
+    **settings,
+):
+    """Function that splits the jets of an H5 file in shards and fits them in parallel processes;
+    each worker opens the file, imports and fits its shard, and returns compact result columns,
+    which are merged in jet order. Shards are aligned to the on-disk chunks of the file, so the
+    results are identical to the ones of fitFile.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the H5 file
+    fitter : singleVertexFitter_straightTracks
+        the vertex fitter (any fitter with a fitBatch method); it must be picklable
+    selections : list
+        list of TrackSelection (and WorkingPointScan) to be fitted; they must be picklable
+    nWorkers : int, optional
+        Number of worker processes, by default 1
+    shardSize : int, optional
+        Number of jets of each shard, rounded up to a multiple of the on-disk chunk size,
+        by default None which means splitting the jets in 4 shards per worker
+    Nevents : int, optional
+        Number of jets to be read, by default -1 which means all the dataset
+    writer : ColumnStoreWriter, optional
+        if given, the results of each shard are appended to it (in jet order) as soon as
+        the shard is fitted instead of being kept in memory, by default None
+    verbose : bool, optional
+        Wether to print the progress (jets/s and ETA) as the shards are fitted, by default False
+    profiler : Profiler, optional
+        if given, the measures of all the shards (see fitFile) are merged into it, and the
+        time spent writing the results is added to its "write" stage, by default None
+    **settings:
+        other arguments of fitFile (requiredSelections, properties, customProperties,
+        jetFilters, onlySV1, straightTracks, cache, geometryCache, scheduler); the segments
+        written to the cache by the shards are compacted at the end (see FitCache.compact).
+
+    Returns
+    -------
+    dict
+        result columns of the fitted jets, in file order (see fitBatchColumns);
+        empty if writer is given.
+    """
+    with h5py.File(filepath, "r") as h5Database:
+        jetsDataset = h5Database["jets"]
+        nJets = len(jetsDataset) if Nevents == -1 else min(Nevents, len(jetsDataset))
+        diskChunk = jetsDataset.chunks[0] if jetsDataset.chunks is not None else 1000
+
+    # Shards aligned to the on-disk chunks
+    if shardSize is None:
+        shardSize = -(-nJets // (4 * nWorkers))
+    shardSize = max(-(-shardSize // diskChunk), 1) * diskChunk
+    settings = dict(settings, fitter=fitter, selections=selections)
+    trackMemory = profiler.trackMemory if profiler is not None else None
+    shards = [
+        (filepath, start, min(shardSize, nJets - start), settings, trackMemory)
+        for start in range(0, nJets, shardSize)
+    ]
+
+    columnsList = []
+    nDone, nFitted = 0, 0
+    progress = ProgressMeter(nJets) if verbose else None
+    pool = Pool(nWorkers) if nWorkers > 1 else None
+    try:
+        # imap keeps the shards' order
+        shardResults = pool.imap(_fitShard, shards) if pool else map(_fitShard, shards)
+        for shard, (columns, shardProfiler) in zip(shards, shardResults):
+            if profiler is not None:
+                profiler.merge(shardProfiler)
+            nShardJets = len(next(iter(columns.values()))) if len(columns) > 0 else 0
+            with profileStage(profiler, "write", nShardJets):
+                if writer is not None:
+                    writer.append(columns)
+                else:
+                    columnsList.append(columns)
+            # Status
+            nDone += shard[2]
+            nFitted += nShardJets
+            if progress is not None:
+                progress.update(nDone, nFitted)
+        if progress is not None:
+            progress.close()
+    except BaseException:
+        # Stopping the workers right away instead of waiting for the remaining shards
+        if pool:
+            pool.terminate()
+        raise
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    # Merging the cache segments written by the shards, now that no worker is writing
+    cache = settings.get("cache")
+    if cache is not None:
+        with profileStage(profiler, "cache"):
+            cache.compact()
+    return concatenateColumns(columnsList)
@@ -0,0 +1,232 @@
+# Modules import
+from modules.ImportH5 import iterateH5
+from modules.columnStore import ColumnStoreWriter, readColumnStore
+from modules.containers import JetBatch
+from modules.fitCache import fileIdentity
+from modules.profiling import profileStage
+
+# Python import
+import json
+import os
+import shutil
+import h5py
+import numpy as np
+
+
+def geometryCachePath(filepath: str, directory: str = ".") -> str:
+    """Returns the default path of the geometry cache of an H5 file, <file name>.geometry
+    in the given directory (by default the working directory)."""
+    return os.path.join(directory, os.path.basename(filepath) + ".geometry")
+
+
+def buildGeometryCache(
+    filepath: str,
+    cachePath: str = None,
+    customProperties: list = [],
+    chunkSize: int = None,
+    straightTracks: bool = True,
+    Nevents: int = -1,
+):
+    """Function that decodes the jets of an H5 file (all of them, or the first Nevents) once
+    and writes the derived per-track geometry (origins, versors, errors, curvatures), the track
+    labels, the GN2 probabilities, the jet properties and the jets' track counts to binary
+    columnar stores (see columnStore), which are later opened memory-mapped by
+    loadGeometryCache.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the H5 file
+    cachePath : str, optional
+        Path of the cache, by default None which means geometryCachePath(filepath)
+    customProperties : list, optional
+        other jet properties to store (see importH5), by default []
+    chunkSize : int, optional
+        Number of jets decoded at a time (see iterateH5), by default None
+    straightTracks : bool, optional
+        Wether to store straight (True) or curved (False) tracks (see iterateH5), by default True
+    Nevents : int, optional
+        Number of jets to be stored, from the first one, by default -1 which means all the jets
+        of the file
+    """
+    cachePath = geometryCachePath(filepath) if cachePath is None else cachePath
+    with h5py.File(filepath, "r") as h5Database:
+        jetsDataset = h5Database["jets"]
+        diskChunk = jetsDataset.chunks[0] if jetsDataset.chunks is not None else 1000
+        fileJets = len(jetsDataset)
+
+    try:
+        with ColumnStoreWriter(os.path.join(cachePath, "jets")) as jetsWriter:
+            with ColumnStoreWriter(os.path.join(cachePath, "tracks")) as tracksWriter:
+                for batch in iterateH5(
+                    filepath=filepath,
+                    Nevents=Nevents,
+                    chunkSize=chunkSize,
+                    customProperties=customProperties,
+                    onlySV1=False,
+                    straightTracks=straightTracks,
+                    asBatch=True,
+                ):
+                    tracksWriter.append(
+                        {name: getattr(batch, name) for name in JetBatch.trackColumns}
+                    )
+                    jetsWriter.append(
+                        dict(batch.properties, trackCount=batch.nTracks())
+                    )
+    except BaseException:
+        # Not leaving a partially written cache behind (e.g. when the disk is full)
+        shutil.rmtree(cachePath, ignore_errors=True)
+        raise
+
+    # Written last: a cache without it is incomplete
+    with open(os.path.join(cachePath, "info.json"), "w") as ofile:
+        json.dump(
+            {
+                "fileId": fileIdentity(filepath),
+                "diskChunk": diskChunk,
+                "nJets": fileJets if Nevents == -1 else min(Nevents, fileJets),
+                "fileJets": fileJets,
+                "customProperties": list(customProperties),
+                "straightTracks": straightTracks,
+                "trackColumns": list(JetBatch.trackColumns),
+            },
+            ofile,
+        )
+
+
+def hasGeometryCache(
+    filepath: str,
+    cachePath: str = None,
+    customProperties: list = [],
+    straightTracks: bool = True,
+    Nevents: int = -1,
+) -> bool:
+    """Returns wether an up-to-date geometry cache of the H5 file, storing the given
+    custom properties and the given kind of tracks of its first Nevents jets (-1 for all
+    the jets of the file), exists."""
+    cachePath = geometryCachePath(filepath) if cachePath is None else cachePath
+    infoPath = os.path.join(cachePath, "info.json")
+    if not os.path.exists(infoPath):
+        return False
+    with open(infoPath, "r") as ifile:
+        info = json.load(ifile)
+    neededJets = info["fileJets"] if Nevents == -1 else min(Nevents, info["fileJets"])
+    return (
+        info["fileId"] == fileIdentity(filepath)
+        and set(customProperties) <= set(info["customProperties"])
+        and info.get("straightTracks", True) == straightTracks
+        # Caches written before a track column was added are rebuilt
+        and info.get("trackColumns") == list(JetBatch.trackColumns)
+        and info["nJets"] >= neededJets
+    )
+
+
+def loadGeometryCache(
+    filepath: str, cachePath: str = None, straightTracks: bool = True
+):
+    """Function that opens the geometry cache of an H5 file as a JetBatch of the jets it holds
+    (all the jets of the file, or the first ones, see buildGeometryCache), whose columns are
+    memory-mapped (no data is read until it is used).
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the H5 file
+    cachePath : str, optional
+        Path of the cache, by default None which means geometryCachePath(filepath)
+    straightTracks : bool, optional
+        Wether the cache must store straight (True) or curved (False) tracks, by default True
+
+    Returns
+    -------
+    JetBatch
+        the jets of the cache.
+    """
+    cachePath = geometryCachePath(filepath) if cachePath is None else cachePath
+    if not hasGeometryCache(
+        filepath, cachePath, straightTracks=straightTracks, Nevents=0
+    ):
+        raise FileNotFoundError(
+            f"No up-to-date geometry cache of {filepath} in {cachePath}: run buildGeometryCache."
+        )
+    properties = readColumnStore(os.path.join(cachePath, "jets"))
+    tracks = readColumnStore(os.path.join(cachePath, "tracks"))
+    trackCount = properties.pop("trackCount")
+    offsets = np.concatenate(([0], np.cumsum(trackCount)))
+    return JetBatch(offsets, properties, **tracks)
+
+
+def iterateGeometryCache(
+    filepath: str,
+    Nevents: int = -1,
+    firstEvent: int = 0,
+    chunkSize: int = None,
+    onlySV1: bool = True,
+    jetFilters: list = [],
+    cachePath: str = None,
+    straightTracks: bool = True,
+    profiler=None,
+):
+    """Generator that yields the jets of the geometry cache of an H5 file as JetBatch,
+    chunk by chunk, with the same arguments and selections of iterateH5 (asBatch=True).
+    Jet filters are evaluated on the dictionary of the jets' properties, so the fields
+    they use must have been stored in the cache.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the H5 file
+    Nevents : int, optional
+        Number of jet to be read, by default -1 which means all the dataset; the cache must
+        hold them (see buildGeometryCache)
+    firstEvent : int, optional
+        Index of the first jet to be read, by default 0
+    chunkSize : int, optional
+        Number of jets yielded at a time, rounded up to a multiple of the on-disk chunk size
+        of the H5 file, by default None which means exactly one on-disk chunk
+    onlySV1 : bool, optional
+        Wether to filter only jets that have been fitted by SV1, by default True
+    jetFilters : list, optional
+        JetFilter that select the jets, by default []
+    cachePath : str, optional
+        Path of the cache, by default None which means geometryCachePath(filepath)
+    straightTracks : bool, optional
+        Wether to use straight (True) or curved (False) tracks, by default True; the cache must
+        have been built with the same choice
+    profiler : Profiler, optional
+        if given, the time spent reading the cache is added to its "read" stage, by default None
+
+    Yields
+    ------
+    JetBatch
+        the jets of each chunk.
+    """
+    cachePath = geometryCachePath(filepath) if cachePath is None else cachePath
+    allJets = loadGeometryCache(filepath, cachePath, straightTracks)
+    with open(os.path.join(cachePath, "info.json"), "r") as ifile:
+        info = json.load(ifile)
+    diskChunk = info["diskChunk"]
+    chunkSize = (
+        diskChunk if chunkSize is None else -(-chunkSize // diskChunk) * diskChunk
+    )
+    fileJets = info["fileJets"]
+    lastEvent = fileJets if Nevents == -1 else min(firstEvent + Nevents, fileJets)
+    if lastEvent > len(allJets):
+        raise ValueError(
+            f"The geometry cache of {filepath} only holds its first {len(allJets)} jets: "
+            "rebuild it with a larger Nevents."
+        )
+
+    for start in range(firstEvent, lastEvent, chunkSize):
+        stop = min(start + chunkSize, lastEvent)
+        with profileStage(profiler, "read", stop - start):
+            batch = allJets.jetRange(start, stop)
+            keep = np.ones(len(batch), dtype=bool)
+            if onlySV1:
+                keep &= ~np.isnan(batch.properties["SV1_L3d"])
+                keep &= batch.nSV1Tracks() > 0
+            for jetFilter in jetFilters:
+                keep &= jetFilter(batch.properties)
+            if not keep.all():
+                batch = batch.selectJets(keep)
+        yield batch
@@ -0,0 +1,253 @@
+# Python import
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+from contextlib import contextmanager, nullcontext
+
+
+class Profiler:
+    """Class that collects the instrumentation of an import and fit run: the time spent in each
+    stage (e.g. H5 read, track decode, selection, fit, results writing), the number of iterations
+    and the convergence of each fit and, optionally, the peak memory allocated in each stage
+    (with tracemalloc, which slows down the run). Stages must not be nested.
+    Profilers are picklable, so that worker processes can fill their own and send it back to be
+    merged.
+
+    Public Members
+    --------------
+    self.trackMemory : bool, wether the peak memory of the stages is measured;
+    self.stages : dict, stage name -> dict with the total time in seconds ("seconds"), the number
+        of calls ("calls"), the number of processed items ("items") and the peak memory in bytes
+        ("peakMemory");
+
+    Public Methods
+    --------------
+    stage(name, items) : context manager that measures a stage;
+    recordFits(info) : adds the telemetry of a batch of fits (see fitBatch with returnInfo);
+    recordPadding(nTracks, nSlots) : adds the padding of a batch of fits;
+    merge(other) : adds the measures of another Profiler;
+    report() : returns the measures as a dict;
+    save(filepath) : saves the report as a JSON file;
+    """
+
+    def __init__(self, trackMemory: bool = False) -> None:
+        """Constructor of the class.
+
+        Parameters
+        ----------
+        trackMemory : bool, optional
+            Wether to measure the peak memory of each stage with tracemalloc, by default False
+        """
+        self.trackMemory = trackMemory
+        self.stages = {}
+        # Histogram of the fits' number of iterations, and number of unconverged fits
+        self.__iterations = np.zeros(0, dtype=np.int64)
+        self.__nUnconverged = 0
+        # Number of tracks and of slots of the padded arrays of the fits
+        self.__nTracks = 0
+        self.__nSlots = 0
+
+    @contextmanager
+    def stage(self, name: str, items: int = 0):
+        """Context manager that adds the time spent in its block to the given stage.
+
+        Parameters
+        ----------
+        name : str
+            name of the stage
+        items : int, optional
+            number of items (e.g. jets) processed in the block, by default 0
+        """
+        if self.trackMemory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(
+                name, {"seconds": 0.0, "calls": 0, "items": 0, "peakMemory": 0}
+            )
+            stage["seconds"] += time.perf_counter() - start
+            stage["calls"] += 1
+            stage["items"] += int(items)
+            if self.trackMemory:
+                peak = tracemalloc.get_traced_memory()[1]
+                stage["peakMemory"] = max(stage["peakMemory"], peak)
+
+    def recordFits(self, info: dict):
+        """Function that adds the telemetry of a batch of fits.
+
+        Parameters
+        ----------
+        info : dict
+            number of iterations ("nIterations") and convergence flags ("converged") of the fits,
+            as returned by fitBatch with returnInfo=True
+        """
+        counts = np.bincount(np.asarray(info["nIterations"], dtype=np.int64))
+        self.__addIterations(counts)
+        self.__nUnconverged += int(np.count_nonzero(~np.asarray(info["converged"])))
+
+    def recordPadding(self, nTracks: int, nSlots: int):
+        """Function that adds the padding of a batch of fits.
+
+        Parameters
+        ----------
+        nTracks : int
+            number of tracks fitted in the batch
+        nSlots : int
+            number of slots of the zero-padded arrays of the batch (jets times maximum tracks)
+        """
+        self.__nTracks += int(nTracks)
+        self.__nSlots += int(nSlots)
+
+    def __addIterations(self, counts: np.ndarray):
+        size = max(len(counts), len(self.__iterations))
+        self.__iterations = np.pad(
+            self.__iterations, (0, size - len(self.__iterations))
+        )
+        self.__iterations[: len(counts)] += counts
+
+    def merge(self, other):
+        """Function that adds the measures of another Profiler to this one."""
+        for name, otherStage in other.stages.items():
+            stage = self.stages.setdefault(
+                name, {"seconds": 0.0, "calls": 0, "items": 0, "peakMemory": 0}
+            )
+            stage["seconds"] += otherStage["seconds"]
+            stage["calls"] += otherStage["calls"]
+            stage["items"] += otherStage["items"]
+            stage["peakMemory"] = max(stage["peakMemory"], otherStage["peakMemory"])
+        self.__addIterations(other.__iterations)
+        self.__nUnconverged += other.__nUnconverged
+        self.__nTracks += other.__nTracks
+        self.__nSlots += other.__nSlots
+
+    def report(self) -> dict:
+        """Function that returns the measures as a dict (JSON serializable).
+
+        Returns
+        -------
+        dict
+            "stages": stage name -> seconds, calls, items, items per second, fraction of the
+            total time and (if measured) peak memory in MB;
+            "fits": number of fits, mean and maximum number of iterations, number of unconverged
+            fits and histogram of the number of iterations (list indexed by the number of iterations);
+            "padding": number of fitted tracks, number of slots of the padded arrays and padding
+            efficiency (tracks over slots, see MultiplicityScheduler).
+        """
+        total = sum(stage["seconds"] for stage in self.stages.values())
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = {
+                "seconds": stage["seconds"],
+                "calls": stage["calls"],
+                "items": stage["items"],
+                "itemsPerSecond": (
+                    stage["items"] / stage["seconds"] if stage["seconds"] > 0 else 0.0
+                ),
+                "fraction": stage["seconds"] / total if total > 0 else 0.0,
+            }
+            if self.trackMemory:
+                stages[name]["peakMemoryMB"] = stage["peakMemory"] / 2**20
+        nFits = int(self.__iterations.sum())
+        iterations = np.arange(len(self.__iterations))
+        fits = {
+            "nFits": nFits,
+            "meanIterations": (
+                float(iterations @ self.__iterations / nFits) if nFits > 0 else 0.0
+            ),
+            "maxIterations": int(iterations[self.__iterations > 0].max(initial=0)),
+            "nUnconverged": self.__nUnconverged,
+            "iterationsHistogram": self.__iterations.tolist(),
+        }
+        padding = {
+            "nTracks": self.__nTracks,
+            "nSlots": self.__nSlots,
+            "efficiency": (
+                self.__nTracks / self.__nSlots if self.__nSlots > 0 else 1.0
+            ),
+        }
+        return {"stages": stages, "fits": fits, "padding": padding}
+
+    def save(self, filepath: str):
+        """Function that saves the report (see report) as a JSON file."""
+        with open(filepath, "w") as ofile:
+            json.dump(self.report(), ofile, indent=1)
+
+
+def profileStage(profiler, name: str, items: int = 0):
+    """Returns the context manager that measures a stage with the given Profiler,
+    or one that does nothing if profiler is None."""
+    return nullcontext() if profiler is None else profiler.stage(name, items)
+
+
+class ProgressMeter:
+    """Class that prints a live progress line (done jets, jets/s and estimated time left),
+    refreshed at most every minInterval seconds.
+
+    Public Methods
+    --------------
+    update(done, fitted) : updates the number of processed (and fitted) jets;
+    close() : prints the final line;
+    """
+
+    def __init__(
+        self, total: int = None, minInterval: float = 0.5, stream=None
+    ) -> None:
+        """Constructor of the class.
+
+        Parameters
+        ----------
+        total : int, optional
+            total number of jets to be processed, by default None which means unknown (no ETA)
+        minInterval : float, optional
+            minimum time between two refreshes of the line in seconds, by default 0.5
+        stream : file, optional
+            where the line is printed, by default None which means sys.stdout
+        """
+        self.total = total
+        self.minInterval = minInterval
+        self.stream = sys.stdout if stream is None else stream
+        self.__start = time.perf_counter()
+        self.__lastPrint = -float("inf")
+        self.__done = 0
+        self.__fitted = None
+
+    def update(self, done: int, fitted: int = None):
+        """Function that updates the number of processed jets (and of the fitted ones)
+        and refreshes the line if enough time has passed."""
+        self.__done = done
+        self.__fitted = fitted
+        now = time.perf_counter()
+        if now - self.__lastPrint >= self.minInterval:
+            self.__lastPrint = now
+            self.__print(now, end="\r")
+
+    def close(self):
+        self.__print(time.perf_counter(), end="\n")
+
+    def __print(self, now: float, end: str):
+        elapsed = now - self.__start
+        rate = self.__done / elapsed if elapsed > 0 else 0.0
+        line = f"Processed {self.__done}"
+        if self.total is not None:
+            line += f"/{self.total}"
+        line += " jets"
+        if self.__fitted is not None:
+            line += f" ({self.__fitted} fitted)"
+        line += f", {rate:.0f} jets/s"
+        if self.total is not None and rate > 0 and end == "\r":
+            line += f", ETA {_formatSeconds((self.total - self.__done) / rate)}"
+        elif end == "\n":
+            line += f", {_formatSeconds(elapsed)} elapsed"
+        print(line, end=end, file=self.stream, flush=True)
+
+
+def _formatSeconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
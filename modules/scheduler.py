@@ -0,0 +1,148 @@
+# Python import
+import numpy as np
+
+
+class MultiplicityScheduler:
+    """Class that schedules the batched fits of a set of jets: jets are sorted by their number of
+    selected tracks, split into multiplicity buckets and sent to the fitter in batches of at most
+    batchSize jets, so that the zero-padded arrays of each batch (see JetBatch.padded) waste few
+    slots on padding; the results are returned in the original jet order. The padding efficiency
+    is the fraction of the slots of the padded arrays filled by real tracks.
+
+    Public Members
+    --------------
+    self.edges : list, upper bounds (included) of the number of tracks of the buckets; jets with
+        more tracks than the last edge are in a last open bucket;
+    self.batchSize : int, maximum number of jets of each batch (None for no limit);
+
+    Public Methods
+    --------------
+    plan(nTracks) : returns the indexes of the jets of each batch;
+    paddingEfficiency(nTracks) : returns the padding efficiency of the batches;
+    run(fitJets, jetMask, nTracks, profiler) : fits the jets batch by batch and returns the
+        results in jet order;
+    """
+
+    def __init__(
+        self, edges: list = [1, 2, 3, 4, 6, 8, 12, 16, 24, 32], batchSize: int = 2048
+    ) -> None:
+        """Constructor of the class.
+
+        Parameters
+        ----------
+        edges : list, optional
+            upper bounds (included) of the number of tracks of the buckets, by default
+            [1, 2, 3, 4, 6, 8, 12, 16, 24, 32]; [] means a single bucket
+        batchSize : int, optional
+            maximum number of jets of each batch, by default 2048; None means no limit
+        """
+        self.edges = sorted(edges)
+        self.batchSize = batchSize
+
+    def plan(self, nTracks: np.ndarray) -> list:
+        """Function that splits jets into batches of similar number of tracks.
+
+        Parameters
+        ----------
+        nTracks : np.ndarray
+            number of tracks of each jet of shape (Njets,)
+
+        Returns
+        -------
+        list
+            np.ndarray with the indexes of the jets of each batch, sorted by number of tracks.
+        """
+        nTracks = np.asarray(nTracks)
+        order = np.argsort(nTracks, kind="stable")
+        bucket = np.searchsorted(self.edges, nTracks[order], side="left")
+        # First jet of each bucket
+        starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+        stops = np.append(starts[1:], len(order))
+        batches = []
+        for start, stop in zip(starts, stops):
+            step = stop - start if self.batchSize is None else self.batchSize
+            for batchStart in range(start, stop, step):
+                batches.append(order[batchStart : min(batchStart + step, stop)])
+        return batches
+
+    def paddingEfficiency(self, nTracks: np.ndarray) -> float:
+        """Function that returns the padding efficiency of the batches of the given jets
+        (see plan), i.e. the number of tracks over the number of slots of the padded arrays.
+        """
+        nTracks = np.asarray(nTracks)
+        slots = sum(len(b) * nTracks[b].max() for b in self.plan(nTracks))
+        return float(nTracks.sum() / slots) if slots > 0 else 1.0
+
+    def run(self, fitJets, jetMask: np.ndarray, nTracks: np.ndarray, profiler=None):
+        """Function that fits the selected jets batch by batch.
+
+        Parameters
+        ----------
+        fitJets : callable
+            function of a boolean mask of the jets to fit (of shape (Njets,)) returning a tuple of
+            their results (arrays with one row per fitted jet, in jet order, or dict of them,
+            e.g. the telemetry of fitBatch with returnInfo)
+        jetMask : np.ndarray
+            boolean mask of the jets to fit of shape (Njets,)
+        nTracks : np.ndarray
+            number of tracks of each jet of shape (Njets,)
+        profiler : Profiler, optional
+            if given, the padding of the batches is added to it, by default None
+
+        Returns
+        -------
+        tuple
+            results of the selected jets, in jet order, with the same structure of the ones of
+            fitJets; rows of per-track arrays of different batches are zero-padded to the same
+            length.
+        """
+        jetIndex = np.flatnonzero(jetMask)
+        batches = self.plan(nTracks[jetIndex])
+        merged = None
+        for batch in batches:
+            selected = jetIndex[batch]
+            if profiler is not None:
+                profiler.recordPadding(
+                    nTracks[selected].sum(), len(selected) * nTracks[selected].max()
+                )
+            # fitJets returns the jets in jet order
+            batch = np.sort(batch)
+            batchMask = np.zeros(len(jetMask), dtype=bool)
+            batchMask[jetIndex[batch]] = True
+            results = fitJets(batchMask)
+            if len(batches) == 1:
+                return results
+            if merged is None:
+                merged = _allocate(results, len(jetIndex))
+            merged = _scatter(merged, results, batch)
+        return merged
+
+
+def _allocate(results, nJets: int):
+    """Allocates the merged results with the structure of the results of a batch."""
+    if isinstance(results, dict):
+        return {k: _allocate(v, nJets) for k, v in results.items()}
+    if isinstance(results, tuple):
+        return tuple(_allocate(v, nJets) for v in results)
+    results = np.asarray(results)
+    return np.zeros((nJets,) + results.shape[1:], dtype=results.dtype)
+
+
+def _scatter(merged, results, rows: np.ndarray):
+    """Copies the results of a batch into the given rows of the merged results, growing the
+    per-track arrays if needed."""
+    if isinstance(results, dict):
+        for k, v in results.items():
+            merged[k] = _scatter(merged[k], v, rows)
+        return merged
+    if isinstance(results, tuple):
+        return tuple(_scatter(m, v, rows) for m, v in zip(merged, results))
+    results = np.asarray(results)
+    if merged.shape[1:] != results.shape[1:]:
+        # Zero-padding per-track arrays to the widest batch
+        shape = np.maximum(merged.shape[1:], results.shape[1:])
+        grown = np.zeros((len(merged),) + tuple(shape), dtype=merged.dtype)
+        grown[(slice(None),) + tuple(slice(0, n) for n in merged.shape[1:])] = merged
+        merged = grown
+    merged[(rows,) + tuple(slice(0, n) for n in results.shape[1:])] = results
+    return merged
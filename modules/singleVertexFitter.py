@@ -1,12 +1,116 @@
+# Modules import
+from modules.convergence import ConvergencePolicy
+from modules.containers import helixPoint, helixClosestApproach
+
+# Python import
+import time
 import numpy as np
 
 
+def padTracks(trackLists: list):
+    """Function that packs lists of tracks (H5Tracks) of several jets into zero-padded arrays,
+    as expected by singleVertexFitter_straightTracks.fitBatch.
+
+    Parameters
+    ----------
+    trackLists : list
+        list of lists of H5Tracks, one list per jet
+
+    Returns
+    -------
+    tuple of np.ndarray
+        origins and versors of shape (Njets, maxTracks, 3), diagonals of the tracks'
+        covariance matrices of shape (Njets, maxTracks, 6) and the boolean mask of the
+        non-padded tracks of shape (Njets, maxTracks).
+    """
+    Njets = len(trackLists)
+    maxTracks = max([len(tracks) for tracks in trackLists], default=0)
+    origins = np.zeros((Njets, maxTracks, 3))
+    versors = np.zeros((Njets, maxTracks, 3))
+    covDiag = np.zeros((Njets, maxTracks, 6))
+    mask = np.zeros((Njets, maxTracks), dtype=bool)
+    for i, tracks in enumerate(trackLists):
+        for j, t in enumerate(tracks):
+            origins[i, j] = t.origin
+            versors[i, j] = t.versor
+            covDiag[i, j] = t.covDiag
+            mask[i, j] = True
+    return origins, versors, covDiag, mask
+
+
+def _chi2Batch(origins, versors, v, mask):
+    """Function that returns the chi2 of the fits of a batch of jets (see fitBatch)
+    for the vertexes v of shape (Njets, 3); mask can also be the tracks' weights."""
+    Di = np.cross(origins - v[:, None, :], versors) ** 2
+    D = np.sqrt(np.sum(Di**2, axis=2))
+    return np.sum(D * mask, axis=1)
+
+
+def _trackVariances(origins, versors, covDiag, v, norm):
+    """Function that returns the variances of the tracks' distances from the vertexes v of shape
+    (Njets, 3), as in singleVertexFitter_straightTracks, for tracks given as zero-padded arrays
+    (see fitBatch); norm is the normalization of the derivatives, of shape (Njets, 1).
+    """
+    d = origins - v[:, None, :]
+    c = np.cross(versors, d)
+    Dir = norm[:, :, None] * np.cross(c, versors)
+    Dia = norm[:, :, None] * np.cross(d, c)
+    sigma = np.sum(Dir**2 * covDiag[:, :, :3], axis=2) + np.sum(
+        Dia**2 * covDiag[:, :, 3:], axis=2
+    )
+    # stability for the inversion
+    return sigma + 1e-9
+
+
+def _trackChi2(origins, versors, covDiag, v):
+    """Function that returns the chi2 of each track with respect to the vertexes v of shape
+    (Njets, 3): the squared distance of the track from the vertex divided by the variance of the
+    distance, for tracks given as zero-padded arrays (see fitBatch). At the true vertex it follows
+    a chi2 distribution with about 2 degrees of freedom (see benchmark.checkTrackChi2).
+    """
+    c = np.cross(versors, origins - v[:, None, :])
+    D = np.sum(c**2, axis=2)
+    # With norm 1 _trackVariances differentiates D/2, so norm 1/sqrt(D) gives the derivatives of
+    # the distance sqrt(D); covDiag holds the uncertainties, squared here to get the variances
+    norm = 1 / np.sqrt(np.maximum(D, np.finfo(float).tiny))
+    return D / _trackVariances(origins, versors, covDiag**2, v, norm)
+
+
+def _projectors(origins, versors):
+    """Function that returns the tracks' projectors H_i = |a_i|^2 * 1 - a_i a_i^T, of shape
+    (..., 3, 3), and H_i r_i, of shape (..., 3), for tracks of shape (..., 3)."""
+    H = (np.sum(versors**2, axis=-1)[..., None, None] * np.eye(3)) - (
+        versors[..., :, None] * versors[..., None, :]
+    )
+    Hr = (H @ origins[..., :, None])[..., 0]
+    return H, Hr
+
+
+def _solveNormalEquations(A, b):
+    """Function that solves a batch of 3x3 linear systems A v = b, of shapes (Njets, 3, 3) and
+    (Njets, 3); singular systems (e.g. of a single track, or of parallel tracks) are solved
+    with the pseudo-inverse."""
+    scale = np.trace(A, axis1=1, axis2=2) / 3
+    singular = ~(np.abs(np.linalg.det(A)) > 1e-12 * scale**3)
+    v = np.empty_like(b)
+    if (~singular).any():
+        v[~singular] = np.linalg.solve(A[~singular], b[~singular, :, None])[:, :, 0]
+    if singular.any():
+        v[singular] = (np.linalg.pinv(A[singular]) @ b[singular, :, None])[:, :, 0]
+    return v
+
+
 class singleVertexFitter_straightTracks:
     """Class that implements a Single Vertex Fitter on straight tracks based on least squares minimization.
     For a complete explanation of the algorithm see the docs.
     """
 
-    def __init__(self, eps: float = 1e-8, maxIter: float = 1e2) -> None:
+    # Version of the algorithm, to be increased whenever a change modifies the fit results
+    version = 1
+
+    def __init__(
+        self, eps: float = 1e-8, maxIter: float = 1e2, policy: ConvergencePolicy = None
+    ) -> None:
         """Constructor of the fitter.
 
         Parameters
@@ -15,15 +119,35 @@ class singleVertexFitter_straightTracks:
             stability tolerance that, when reached, stops the fit, by default 1e-8
         maxIter : float, optional
             maximum number of minimization iteration, by default 1e2
+        policy : ConvergencePolicy, optional
+            stopping rule of the fit, by default None which means the vertex increment must be
+            below eps for 6 iterations in a row, within maxIter iterations; if given, eps and
+            maxIter are ignored
         """
         self.eps = eps
         self.maxIter = maxIter
+        self.customPolicy = policy
+
+    @property
+    def policy(self) -> ConvergencePolicy:
+        if self.customPolicy is not None:
+            return self.customPolicy
+        return ConvergencePolicy(
+            absoluteTolerance=self.eps, nConsecutive=6, maxIter=self.maxIter
+        )
+
+    def key(self) -> str:
+        """Returns a str that identifies the fitter's algorithm, version and settings."""
+        key = f"{type(self).__name__}(version={self.version},eps={self.eps!r},maxIter={self.maxIter!r}"
+        if self.customPolicy is not None:
+            key += f",policy={self.customPolicy.key()}"
+        return key + ")"
 
     def __Di(self, r, v, a):
         Di = np.cross((r - v), a) ** 2
         return Di
 
-    def fit(self, tracks: list):
+    def fit(self, tracks: list, returnInfo: bool = False):
         """Functions that fit a single vertex on the tracks (H5Tracks)
         contained in the given list, assumed to be straight tracks.
 
@@ -31,106 +155,94 @@ class singleVertexFitter_straightTracks:
         ----------
         tracks : list
             tracks (list of H5Tracks): list of tracks to be fitted
+        returnInfo : bool, optional
+            Wether to also return the fit telemetry (see fitArrays), by default False
 
         Returns
         -------
         np.ndarray of shape (3,)
             coordinates of the fitted vertex [z,x,y].
         """
+        origins = np.array([t.origin for t in tracks])
+        versors = np.array([t.versor for t in tracks])
+        covDiag = np.array([t.covDiag for t in tracks])
+        return self.fitArrays(origins, versors, covDiag, returnInfo)
+
+    def fitArrays(
+        self,
+        origins: np.ndarray,
+        versors: np.ndarray,
+        covDiag: np.ndarray,
+        returnInfo: bool = False,
+    ):
+        """Functions that fit a single vertex on straight tracks given as arrays,
+        with whole-array operations over the tracks.
+
+        Parameters
+        ----------
+        origins : np.ndarray
+            tracks' origins of shape (Ntracks, 3)
+        versors : np.ndarray
+            tracks' versors of shape (Ntracks, 3)
+        covDiag : np.ndarray
+            diagonals of the tracks' covariance matrices of shape (Ntracks, 6)
+        returnInfo : bool, optional
+            Wether to also return the fit telemetry, by default False
+
+        Returns
+        -------
+        tuple
+            coordinates of the fitted vertex [z,x,y] as np.ndarray of shape (3,) and chi2 of the fit;
+            if returnInfo, also a dict with the number of iterations ("nIterations") and wether the
+            fit converged ("converged") instead of reaching maxIter.
+        """
+        # Float64 computations, also for float32 tracks (e.g. read from the H5 file)
+        origins = np.asarray(origins, dtype=float)
+        versors = np.asarray(versors, dtype=float)
+        covDiag = np.asarray(covDiag, dtype=float)
+
         # Handy variables
-        Ntracks = len(tracks)
+        Ntracks = len(origins)
         iter = 0
-        dv = 100
-        v = np.zeros(3)
+        policy = self.policy
+        start = time.perf_counter()
+
+        # Tracks' hessians H_i = |a_i|^2 * 1 - a_i a_i^T, which only depend on the versors
+        H = (np.sum(versors**2, axis=1)[:, None, None] * np.eye(3)) - (
+            versors[:, :, None] * versors[:, None, :]
+        )
 
         # Initialize the vertex in the average origin of the tracks
-        for t in tracks:
-            v = v + (t.origin)
-        v = v / (Ntracks)
-        # Number of times the vertex has not been significantly moved
+        v = np.mean(origins, axis=0)
+        # Number of consecutive iterations that have not significantly moved the vertex
         nStuck = 0
+        chi2Old = None
 
         # Minimization loop
-        while iter < self.maxIter:
-            # Current jacobian
-            J = []
-            # Current derivative wrt tracks origin
-            Dr = []
-            # If no significant increment wrt the previous iteration
-            if dv < self.eps:
-                # increment the counter
-                nStuck += 1
-                # if maximum tries are reached, stop
-                if nStuck > 5:
-                    break
-            # Else, resetting the counter
-            else:
-                nStuck = 0
+        while iter < policy.maxIter:
+            # If the stability criteria is hit enough times in a row, or out of time, stop
+            if nStuck >= policy.nConsecutive:
+                break
+            if policy.outOfTime(time.perf_counter() - start):
+                break
 
-            # Iterate over tracks to build the Jacobian of the least squares
-            for t in tracks:
-                # auxiliary variables defined in the literature
-                di = t.origin - v
-                eta = np.zeros((3, 3))
-                ai = t.versor
-
-                # Building eta
-                for j in range(3):
-                    for k in range(3):
-                        eta[j, k] = ai[j] * di[k] - ai[k] * di[j]
-
-                # Derivative wrt track's origin
-                Dir = [
-                    ai[1] * eta[1, 0] - ai[2] * eta[0, 2],
-                    ai[2] * eta[2, 1] - ai[0] * eta[1, 0],
-                    ai[0] * eta[0, 2] - ai[1] * eta[2, 1],
-                ]
-
-                # Derivative wrt track's versor
-                Dia = [
-                    di[2] * eta[0, 2] - di[1] * eta[1, 0],
-                    di[0] * eta[1, 0] - di[2] * eta[2, 1],
-                    di[1] * eta[2, 1] - di[0] * eta[0, 2],
-                ]
-
-                Dir = 2 / Ntracks * np.array(Dir)
-                Dia = 2 / Ntracks * np.array(Dia)
-
-                # Storing derivative
-                Dr.append(Dir)
-                # Building the Jacobian
-                Ji = np.concatenate((Dir, Dia), axis=0)
-                J.append(Ji)
+            # auxiliary variables defined in the literature
+            d = origins - v
+            c = np.cross(versors, d)
+            # Derivatives wrt tracks' origins and versors
+            Dir = 2 / Ntracks * np.cross(c, versors)
+            Dia = 2 / Ntracks * np.cross(d, c)
 
             # Calculating tracks' weights
-            sigma = []
-            for i, Ji in enumerate(J):
-                sigmai = Ji.T @ tracks[i].covMat @ Ji
-                # stability for the inversion
-                sigmai += 1e-9
-                sigma.append(sigmai)
-
-            # Calculating the gradient of the least squares
-            gradS = np.zeros(3)
-            for Dir, sigmai in zip(Dr, sigma):
-                gradS = gradS - (sigmai**-1) * Dir
-
-            # Calculating the Hessian of the least squares
-            laplS = np.zeros((3, 3))
-            # Iterating over each track to build the respective hessian
-            for i, t in enumerate(tracks):
-                ai = t.versor
-                Hi = np.diag(
-                    [
-                        ai[1] ** 2 + ai[2] ** 2,
-                        ai[0] ** 2 + ai[2] ** 2,
-                        ai[0] ** 2 + ai[1] ** 2,
-                    ]
-                )
-                Hi[0, 1] = Hi[1, 0] = -ai[0] * ai[1]
-                Hi[0, 2] = Hi[2, 0] = -ai[0] * ai[2]
-                Hi[1, 2] = Hi[2, 1] = -ai[1] * ai[2]
-                laplS = laplS + 2 / Ntracks * (sigma[i] ** -1) * Hi
+            sigma = np.sum(Dir**2 * covDiag[:, :3], axis=1) + np.sum(
+                Dia**2 * covDiag[:, 3:], axis=1
+            )
+            # stability for the inversion
+            sigma += 1e-9
+
+            # Calculating the gradient and the Hessian of the least squares
+            gradS = -np.sum(Dir / sigma[:, None], axis=0)
+            laplS = np.sum((2 / Ntracks / sigma)[:, None, None] * H, axis=0)
 
             # Storing old vertex
             vold = np.copy(v)
@@ -141,11 +253,1375 @@ class singleVertexFitter_straightTracks:
             # Incrementing iteration counter
             iter += 1
 
-        D = []
-        for t in tracks:
-            Di = self.__Di(t.origin, v, t.versor)
-            D.append(np.sqrt(np.sum(Di**2)))
-        chi2 = np.sum(np.array(D))
+            # If no significant increment wrt the previous iteration increment the counter,
+            # else reset it
+            chi2New = None
+            if policy.chi2Tolerance is not None:
+                chi2New = np.sum(
+                    np.sqrt(np.sum(self.__Di(origins, v, versors) ** 2, axis=1))
+                )
+            if policy.smallSteps(dv, v, chi2Old, chi2New):
+                nStuck += 1
+            else:
+                nStuck = 0
+            chi2Old = chi2New
+
+        Di = self.__Di(origins, v, versors)
+        D = np.sqrt(np.sum(Di**2, axis=1))
+        chi2 = np.sum(D)
 
         # Returning vertex and chi2
+        if returnInfo:
+            converged = nStuck >= policy.nConsecutive
+            return np.array(v), chi2, {"nIterations": iter, "converged": converged}
         return np.array(v), chi2
+
+    def fitBatch(
+        self,
+        origins: np.ndarray,
+        versors: np.ndarray,
+        covDiag: np.ndarray,
+        mask: np.ndarray = None,
+        returnInfo: bool = False,
+        initialVertexes: np.ndarray = None,
+        trackWeights: np.ndarray = None,
+    ):
+        """Functions that fit a single vertex for each jet of a batch of jets at once,
+        with the same algorithm of fit. Tracks are given as zero-padded arrays
+        (see padTracks); jets that reach the stopping criteria drop out of the iterations,
+        while the others keep being updated.
+
+        Parameters
+        ----------
+        origins : np.ndarray
+            tracks' origins of shape (Njets, maxTracks, 3)
+        versors : np.ndarray
+            tracks' versors of shape (Njets, maxTracks, 3)
+        covDiag : np.ndarray
+            diagonals of the tracks' covariance matrices of shape (Njets, maxTracks, 6)
+        mask : np.ndarray, optional
+            boolean mask of the non-padded tracks of shape (Njets, maxTracks),
+            by default None which means that all tracks are used
+        returnInfo : bool, optional
+            Wether to also return the fit telemetry, by default False
+        initialVertexes : np.ndarray, optional
+            starting points of the fits of shape (Njets, 3) (e.g. the vertexes fitted on a subset
+            of the tracks), by default None; jets with a nan starting point start from the
+            average origin of their tracks
+        trackWeights : np.ndarray, optional
+            weights of the tracks' terms of the chi2 of shape (Njets, maxTracks) (e.g. the GN2
+            heavy flavour probabilities, for a soft track selection), on top of the weights given
+            by the tracks' uncertainties, by default None which means equal weights
+
+        Returns
+        -------
+        tuple of np.ndarray
+            coordinates of the fitted vertexes [z,x,y] of shape (Njets, 3) and chi2
+            of the fits (weighted by trackWeights) of shape (Njets,); jets with no tracks
+            are filled with nan.
+            If returnInfo, also a dict with the number of iterations of each fit ("nIterations",
+            of shape (Njets,)) and wether it converged ("converged", of shape (Njets,)) instead
+            of reaching maxIter; jets with no tracks have 0 iterations and are not converged.
+        """
+        origins = np.asarray(origins, dtype=float)
+        versors = np.asarray(versors, dtype=float)
+        covDiag = np.asarray(covDiag, dtype=float)
+        if mask is None:
+            mask = np.ones(origins.shape[:2], dtype=bool)
+        mask = np.asarray(mask, dtype=bool)
+        # Tracks' weights, null for the padded tracks
+        weights = mask.astype(float)
+        if trackWeights is not None:
+            weights *= np.asarray(trackWeights, dtype=float)
+
+        # Handy variables
+        Ntracks = mask.sum(axis=1)
+        valid = Ntracks > 0
+        vertexes = np.full((len(mask), 3), np.nan)
+        chi2 = np.full(len(mask), np.nan)
+        info = {
+            "nIterations": np.zeros(len(mask), dtype=int),
+            "converged": np.zeros(len(mask), dtype=bool),
+        }
+        if not valid.any():
+            return (vertexes, chi2, info) if returnInfo else (vertexes, chi2)
+
+        # Only jets with at least one track are fitted
+        origins = origins[valid]
+        versors = versors[valid]
+        covDiag = covDiag[valid]
+        mask = mask[valid]
+        weights = weights[valid]
+        Ntracks = Ntracks[valid]
+        # 2 / Ntracks factor of the derivatives, broadcastable on the tracks' axis
+        norm = (2 / Ntracks)[:, None]
+
+        # Tracks' hessians H_i = |a_i|^2 * 1 - a_i a_i^T, which only depend on the versors
+        H = (np.sum(versors**2, axis=2)[:, :, None, None] * np.eye(3)) - (
+            versors[:, :, :, None] * versors[:, :, None, :]
+        )
+
+        # Initialize the vertexes in the (weighted) average origin of the tracks
+        totalWeight = np.sum(weights, axis=1)
+        totalWeight = np.where(totalWeight > 0, totalWeight, 1.0)
+        v = np.sum(origins * weights[:, :, None], axis=1) / totalWeight[:, None]
+        if initialVertexes is not None:
+            initialVertexes = np.asarray(initialVertexes, dtype=float)[valid]
+            warm = ~np.isnan(initialVertexes).any(axis=1)
+            v[warm] = initialVertexes[warm]
+        nIter = np.zeros(len(v), dtype=int)
+        # Number of consecutive iterations that have not significantly moved the vertexes
+        nStuck = np.zeros(len(v), dtype=int)
+        chi2Old = np.full(len(v), np.nan)
+        # Jets still being minimized
+        active = np.ones(len(v), dtype=bool)
+        policy = self.policy
+        # Time spent on each fit: each iteration is charged to the jets it updates
+        elapsed = np.zeros(len(v))
+
+        # Minimization loop
+        while True:
+            # Stopping criteria, evaluated as in fit
+            active &= (nStuck < policy.nConsecutive) & (nIter < policy.maxIter)
+            active &= ~policy.outOfTime(elapsed)
+            idx = np.flatnonzero(active)
+            if len(idx) == 0:
+                break
+            start = time.perf_counter()
+
+            # auxiliary variables defined in the literature
+            a = versors[idx]
+            d = origins[idx] - v[idx, None, :]
+            c = np.cross(a, d)
+            # Derivatives wrt tracks' origins and versors
+            Dir = norm[idx, :, None] * np.cross(c, a)
+            Dia = norm[idx, :, None] * np.cross(d, c)
+
+            # Calculating tracks' weights, padded tracks get a null weight
+            sigma = np.sum(Dir**2 * covDiag[idx, :, :3], axis=2) + np.sum(
+                Dia**2 * covDiag[idx, :, 3:], axis=2
+            )
+            # stability for the inversion
+            sigma += 1e-9
+            w = weights[idx] / sigma
+
+            # Gradient and Hessian of the least squares
+            gradS = -np.sum(w[:, :, None] * Dir, axis=1)
+            laplS = np.sum((norm[idx] * w)[:, :, None, None] * H[idx], axis=1)
+
+            # Updating the vertexes
+            step = np.linalg.pinv(laplS) @ gradS[:, :, None]
+            v[idx] -= step[:, :, 0]
+            # Calculating the increments
+            dv = np.linalg.norm(step[:, :, 0], axis=1)
+            # Incrementing iteration counters
+            nIter[idx] += 1
+
+            # Counting the consecutive iterations without significant increments
+            chi2New = None
+            if policy.chi2Tolerance is not None:
+                chi2New = _chi2Batch(origins[idx], a, v[idx], weights[idx])
+            small = policy.smallSteps(dv, v[idx], chi2Old[idx], chi2New)
+            nStuck[idx] = np.where(small, nStuck[idx] + 1, 0)
+            if chi2New is not None:
+                chi2Old[idx] = chi2New
+            elapsed[idx] += (time.perf_counter() - start) / len(idx)
+
+        # chi2 of the fits, as in fit
+        vertexes[valid] = v
+        chi2[valid] = _chi2Batch(origins, versors, v, weights)
+
+        # Returning vertexes and chi2
+        if returnInfo:
+            info["nIterations"][valid] = nIter
+            info["converged"][valid] = nStuck >= policy.nConsecutive
+            return vertexes, chi2, info
+        return vertexes, chi2
+
+
+class singleVertexFitter_irls:
+    """Class that implements an iterative Single Vertex Fitter on straight tracks that, instead of
+    Newton steps, minimizes the weighted least squares by iteratively reweighted closed-form solves:
+    for fixed tracks' weights the chi2 is quadratic in the vertex, and its minimum is the solution
+    of a 3x3 linear system built from the tracks' projectors. Since the weights depend on the
+    vertex, the system is solved again while the weights change by more than weightTolerance, which
+    takes about 8 solves per jet on synthetic jets (about 18 Newton iterations for
+    singleVertexFitter_straightTracks); maxIter=2 stops after a single reweighting, at about 0.04 mm
+    (median) from the minimum, with the fits flagged as not converged. The chi2 and the weights
+    are the same of singleVertexFitter_straightTracks; for a complete explanation see the docs.
+    """
+
+    # Version of the algorithm, to be increased whenever a change modifies the fit results
+    version = 1
+
+    def __init__(
+        self,
+        eps: float = 1e-6,
+        maxIter: float = 1e2,
+        weightTolerance: float = 1e-2,
+        policy: ConvergencePolicy = None,
+    ) -> None:
+        """Constructor of the fitter.
+
+        Parameters
+        ----------
+        eps : float, optional
+            the fit stops when the vertex moves by less than eps between two solves, by default 1e-6
+        maxIter : float, optional
+            maximum number of solves, by default 1e2
+        weightTolerance : float, optional
+            the fit stops when no track's weight changes by more than this relative amount
+            between two solves, by default 1e-2
+        policy : ConvergencePolicy, optional
+            stopping rule of the fit on the vertex increments, by default None which means the fit
+            stops at the first increment below eps, within maxIter solves; if given, eps and
+            maxIter are ignored. The fit also stops when the weights are stable (weightTolerance).
+        """
+        self.eps = eps
+        self.maxIter = maxIter
+        self.weightTolerance = weightTolerance
+        self.customPolicy = policy
+
+    @property
+    def policy(self) -> ConvergencePolicy:
+        if self.customPolicy is not None:
+            return self.customPolicy
+        return ConvergencePolicy(
+            absoluteTolerance=self.eps, nConsecutive=1, maxIter=self.maxIter
+        )
+
+    def key(self) -> str:
+        """Returns a str that identifies the fitter's algorithm, version and settings."""
+        key = (
+            f"{type(self).__name__}(version={self.version},eps={self.eps!r},"
+            f"maxIter={self.maxIter!r},weightTolerance={self.weightTolerance!r}"
+        )
+        if self.customPolicy is not None:
+            key += f",policy={self.customPolicy.key()}"
+        return key + ")"
+
+    def fit(self, tracks: list, returnInfo: bool = False):
+        """Functions that fit a single vertex on the tracks (H5Tracks)
+        contained in the given list, assumed to be straight tracks.
+
+        Parameters
+        ----------
+        tracks : list
+            tracks (list of H5Tracks): list of tracks to be fitted
+        returnInfo : bool, optional
+            Wether to also return the fit telemetry (see fitBatch), by default False
+
+        Returns
+        -------
+        tuple
+            coordinates of the fitted vertex [z,x,y] as np.ndarray of shape (3,) and chi2 of the fit.
+        """
+        origins = np.array([t.origin for t in tracks])
+        versors = np.array([t.versor for t in tracks])
+        covDiag = np.array([t.covDiag for t in tracks])
+        return self.fitArrays(origins, versors, covDiag, returnInfo)
+
+    def fitArrays(
+        self,
+        origins: np.ndarray,
+        versors: np.ndarray,
+        covDiag: np.ndarray,
+        returnInfo: bool = False,
+    ):
+        """Functions that fit a single vertex on straight tracks given as arrays
+        of shape (Ntracks, 3), (Ntracks, 3) and (Ntracks, 6) (see fitBatch)."""
+        vertexes, chi2, info = self.fitBatch(
+            origins[None], versors[None], covDiag[None], returnInfo=True
+        )
+        if returnInfo:
+            return (
+                vertexes[0],
+                chi2[0],
+                {
+                    "nIterations": int(info["nIterations"][0]),
+                    "converged": bool(info["converged"][0]),
+                },
+            )
+        return vertexes[0], chi2[0]
+
+    def __solve(self, H, Hr, w):
+        # Minimum of sum_i w_i (r_i - v)^T H_i (r_i - v): (sum_i w_i H_i) v = sum_i w_i H_i r_i
+        A = np.sum(w[:, :, None, None] * H, axis=1)
+        b = np.sum(w[:, :, None] * Hr, axis=1)
+        return _solveNormalEquations(A, b)
+
+    def fitBatch(
+        self,
+        origins: np.ndarray,
+        versors: np.ndarray,
+        covDiag: np.ndarray,
+        mask: np.ndarray = None,
+        returnInfo: bool = False,
+        initialVertexes: np.ndarray = None,
+        trackWeights: np.ndarray = None,
+    ):
+        """Functions that fit a single vertex for each jet of a batch of jets at once.
+        Tracks are given as zero-padded arrays (see padTracks); jets that reach the stopping
+        criteria drop out of the solves, while the others keep being updated.
+
+        Parameters
+        ----------
+        origins : np.ndarray
+            tracks' origins of shape (Njets, maxTracks, 3)
+        versors : np.ndarray
+            tracks' versors of shape (Njets, maxTracks, 3)
+        covDiag : np.ndarray
+            diagonals of the tracks' covariance matrices of shape (Njets, maxTracks, 6)
+        mask : np.ndarray, optional
+            boolean mask of the non-padded tracks of shape (Njets, maxTracks),
+            by default None which means that all tracks are used
+        returnInfo : bool, optional
+            Wether to also return the fit telemetry, by default False
+        initialVertexes : np.ndarray, optional
+            vertexes where the first weights are evaluated, of shape (Njets, 3) (e.g. the vertexes
+            fitted on a subset of the tracks), by default None; jets with a nan starting point
+            start with a solve with equal weights
+        trackWeights : np.ndarray, optional
+            weights of the tracks' terms of the chi2 of shape (Njets, maxTracks) (e.g. the GN2
+            heavy flavour probabilities, for a soft track selection), on top of the weights given
+            by the tracks' uncertainties, by default None which means equal weights
+
+        Returns
+        -------
+        tuple of np.ndarray
+            coordinates of the fitted vertexes [z,x,y] of shape (Njets, 3) and chi2
+            of the fits (weighted by trackWeights) of shape (Njets,); jets with no tracks
+            are filled with nan.
+            If returnInfo, also a dict with the number of solves of each fit ("nIterations",
+            of shape (Njets,)) and wether it converged ("converged", of shape (Njets,)) instead
+            of reaching maxIter; jets with no tracks have 0 solves and are not converged.
+        """
+        origins = np.asarray(origins, dtype=float)
+        versors = np.asarray(versors, dtype=float)
+        covDiag = np.asarray(covDiag, dtype=float)
+        if mask is None:
+            mask = np.ones(origins.shape[:2], dtype=bool)
+        mask = np.asarray(mask, dtype=bool)
+        # Tracks' weights, null for the padded tracks
+        weights = mask.astype(float)
+        if trackWeights is not None:
+            weights *= np.asarray(trackWeights, dtype=float)
+
+        # Handy variables
+        Ntracks = mask.sum(axis=1)
+        valid = Ntracks > 0
+        vertexes = np.full((len(mask), 3), np.nan)
+        chi2 = np.full(len(mask), np.nan)
+        info = {
+            "nIterations": np.zeros(len(mask), dtype=int),
+            "converged": np.zeros(len(mask), dtype=bool),
+        }
+        if not valid.any():
+            return (vertexes, chi2, info) if returnInfo else (vertexes, chi2)
+
+        # Only jets with at least one track are fitted
+        origins = origins[valid]
+        versors = versors[valid]
+        covDiag = covDiag[valid]
+        mask = mask[valid]
+        weights = weights[valid]
+        norm = (2 / Ntracks[valid])[:, None]
+
+        # Tracks' projectors H_i = |a_i|^2 * 1 - a_i a_i^T and H_i r_i, fixed during the fit
+        H, Hr = _projectors(origins, versors)
+
+        # First solve with equal weights: the point of closest approach to all the tracks,
+        # skipped by the jets with a starting point
+        v = np.empty((len(mask), 3))
+        cold = np.ones(len(v), dtype=bool)
+        if initialVertexes is not None:
+            initialVertexes = np.asarray(initialVertexes, dtype=float)[valid]
+            cold = np.isnan(initialVertexes).any(axis=1)
+            v[~cold] = initialVertexes[~cold]
+        if cold.any():
+            v[cold] = self.__solve(H[cold], Hr[cold], weights[cold])
+        sigma = _trackVariances(origins, versors, covDiag, v, norm)
+        nIter = cold.astype(int)
+        # Number of consecutive solves that have not significantly moved the vertexes
+        nStuck = np.zeros(len(v), dtype=int)
+        chi2Old = np.full(len(v), np.nan)
+        stableWeights = np.zeros(len(v), dtype=bool)
+        active = np.ones(len(v), dtype=bool)
+        policy = self.policy
+        # Time spent on each fit: each solve is charged to the jets it updates
+        elapsed = np.zeros(len(v))
+
+        # Re-solving while the weights change
+        while True:
+            converged = stableWeights | (nStuck >= policy.nConsecutive)
+            active &= ~converged & (nIter < policy.maxIter)
+            active &= ~policy.outOfTime(elapsed)
+            idx = np.flatnonzero(active)
+            if len(idx) == 0:
+                break
+            start = time.perf_counter()
+            vNew = self.__solve(H[idx], Hr[idx], weights[idx] / sigma[idx])
+            sigmaNew = _trackVariances(
+                origins[idx], versors[idx], covDiag[idx], vNew, norm[idx]
+            )
+            # Largest relative change of the weights, and vertex increment
+            weightChange = np.max(
+                np.abs(sigmaNew - sigma[idx]) / sigma[idx] * mask[idx], axis=1
+            )
+            dv = np.linalg.norm(vNew - v[idx], axis=1)
+            v[idx] = vNew
+            sigma[idx] = sigmaNew
+            nIter[idx] += 1
+
+            # Stopping criteria
+            stableWeights[idx] = weightChange < self.weightTolerance
+            chi2New = None
+            if policy.chi2Tolerance is not None:
+                chi2New = _chi2Batch(origins[idx], versors[idx], vNew, weights[idx])
+            small = policy.smallSteps(dv, vNew, chi2Old[idx], chi2New)
+            nStuck[idx] = np.where(small, nStuck[idx] + 1, 0)
+            if chi2New is not None:
+                chi2Old[idx] = chi2New
+            elapsed[idx] += (time.perf_counter() - start) / len(idx)
+
+        # chi2 of the fits, as in singleVertexFitter_straightTracks
+        vertexes[valid] = v
+        chi2[valid] = _chi2Batch(origins, versors, v, weights)
+
+        # Returning vertexes and chi2
+        if returnInfo:
+            info["nIterations"][valid] = nIter
+            info["converged"][valid] = converged
+            return vertexes, chi2, info
+        return vertexes, chi2
+
+
+class singleVertexFitter_incremental:
+    """Class that implements a stateful Single Vertex Fitter on straight tracks, for fits where tracks
+    are added or removed one at a time (e.g. outlier removal, or scans of track selections). As
+    singleVertexFitter_irls, it minimizes the weighted chi2 in closed form; it keeps the sums
+    A = sum_i w_i H_i and b = sum_i w_i H_i r_i of the tracks' projectors, so that adding or removing
+    a track is a rank-2 update of A and b followed by a 3x3 solve, independent of the number of
+    tracks. The weight of an added track is evaluated at the current vertex and the others are kept
+    frozen: refit re-evaluates all of them until they are stable, giving back the result of
+    singleVertexFitter_irls. For a complete explanation see the docs.
+
+    Public Members
+    --------------
+    self.origins, self.versors, self.covDiag : np.ndarray, the tracks in the fit, of shape
+        (Ntracks, 3), (Ntracks, 3) and (Ntracks, 6);
+    self.weights : np.ndarray, the tracks' weights, of shape (Ntracks,);
+    self.trackIds : np.ndarray, identifiers of the tracks in the fit: their positions in the arrays
+        given to fitArrays, then the order of the addTrack calls;
+    self.vertex : np.ndarray, the current vertex [z,x,y], nan if there are no tracks;
+    self.chi2 : float, the chi2 of the current vertex;
+
+    Public Methods
+    --------------
+    fit(tracks) : starts a new fit on a list of H5Tracks;
+    fitArrays(origins, versors, covDiag) : starts a new fit on tracks given as arrays;
+    addTrack(origin, versor, covDiag) : adds a track and returns the updated vertex and chi2;
+    removeTrack(position) : removes a track and returns the updated vertex and chi2;
+    refit() : re-evaluates the weights of all the tracks until they are stable;
+    trackChi2() : returns the tracks' chi2 with respect to the current vertex;
+    removeOutliers(maxChi2, minTracks, refit) : removes the worst track while it is an outlier;
+    reset() : removes all the tracks;
+    """
+
+    # Version of the algorithm, to be increased whenever a change modifies the fit results
+    version = 1
+
+    def __init__(
+        self, eps: float = 1e-6, maxIter: float = 1e2, weightTolerance: float = 1e-2
+    ) -> None:
+        """Constructor of the fitter.
+
+        Parameters
+        ----------
+        eps : float, optional
+            refit stops when the vertex moves by less than eps between two solves, by default 1e-6
+        maxIter : float, optional
+            maximum number of solves of refit, by default 1e2
+        weightTolerance : float, optional
+            refit stops when no track's weight changes by more than this relative amount
+            between two solves, by default 1e-2
+        """
+        self.eps = eps
+        self.maxIter = maxIter
+        self.weightTolerance = weightTolerance
+        self.reset()
+
+    def key(self) -> str:
+        """Returns a str that identifies the fitter's algorithm, version and settings."""
+        return (
+            f"{type(self).__name__}(version={self.version},eps={self.eps!r},"
+            f"maxIter={self.maxIter!r},weightTolerance={self.weightTolerance!r})"
+        )
+
+    def reset(self):
+        """Function that removes all the tracks from the fit."""
+        self.origins = np.zeros((0, 3))
+        self.versors = np.zeros((0, 3))
+        self.covDiag = np.zeros((0, 6))
+        self.weights = np.zeros(0)
+        self.trackIds = np.zeros(0, dtype=int)
+        self.vertex = np.full(3, np.nan)
+        self.chi2 = np.nan
+        self.__H = np.zeros((0, 3, 3))
+        self.__Hr = np.zeros((0, 3))
+        self.__A = np.zeros((3, 3))
+        self.__b = np.zeros(3)
+        self.__nextId = 0
+        # Normalization of the derivatives of the tracks' variances, as in
+        # singleVertexFitter_straightTracks (2/Ntracks of the last refit)
+        self.__norm = 1.0
+
+    def fit(self, tracks: list):
+        """Functions that start a new fit on the tracks (H5Tracks) contained in the given list,
+        assumed to be straight tracks.
+
+        Parameters
+        ----------
+        tracks : list
+            tracks (list of H5Tracks): list of tracks to be fitted
+
+        Returns
+        -------
+        tuple
+            coordinates of the fitted vertex [z,x,y] as np.ndarray of shape (3,) and chi2 of the fit.
+        """
+        origins = np.array([t.origin for t in tracks]).reshape(-1, 3)
+        versors = np.array([t.versor for t in tracks]).reshape(-1, 3)
+        covDiag = np.array([t.covDiag for t in tracks]).reshape(-1, 6)
+        return self.fitArrays(origins, versors, covDiag)
+
+    def fitArrays(self, origins: np.ndarray, versors: np.ndarray, covDiag: np.ndarray):
+        """Functions that start a new fit on straight tracks given as arrays of shape
+        (Ntracks, 3), (Ntracks, 3) and (Ntracks, 6): the vertex is first found with equal
+        weights, then refitted (see refit)."""
+        self.reset()
+        self.origins = np.array(origins, dtype=float).reshape(-1, 3)
+        self.versors = np.array(versors, dtype=float).reshape(-1, 3)
+        self.covDiag = np.array(covDiag, dtype=float).reshape(-1, 6)
+        self.trackIds = np.arange(len(self.origins))
+        self.__nextId = len(self.origins)
+        self.__H, self.__Hr = _projectors(self.origins, self.versors)
+        return self.refit(warmStart=False)
+
+    def addTrack(self, origin: np.ndarray, versor: np.ndarray, covDiag: np.ndarray):
+        """Function that adds a straight track to the fit, with its weight evaluated at the
+        current vertex (the weights of the other tracks are not changed). While the fit has
+        less than 2 tracks the vertex is not defined, so the second track starts a full fit.
+
+        Parameters
+        ----------
+        origin : np.ndarray
+            track's origin of shape (3,)
+        versor : np.ndarray
+            track's versor of shape (3,)
+        covDiag : np.ndarray
+            diagonal of the track's covariance matrix of shape (6,)
+
+        Returns
+        -------
+        tuple
+            coordinates of the updated vertex [z,x,y] as np.ndarray of shape (3,) and chi2 of the fit.
+        """
+        origin = np.asarray(origin, dtype=float).reshape(1, 3)
+        versor = np.asarray(versor, dtype=float).reshape(1, 3)
+        covDiag = np.asarray(covDiag, dtype=float).reshape(1, 6)
+        H, Hr = _projectors(origin, versor)
+        self.origins = np.concatenate([self.origins, origin])
+        self.versors = np.concatenate([self.versors, versor])
+        self.covDiag = np.concatenate([self.covDiag, covDiag])
+        self.trackIds = np.append(self.trackIds, self.__nextId)
+        self.__nextId += 1
+        self.__H = np.concatenate([self.__H, H])
+        self.__Hr = np.concatenate([self.__Hr, Hr])
+        if len(self.origins) <= 2:
+            return self.refit(warmStart=False)
+
+        # Rank-2 update of the sums
+        # the weight has the normalization of the frozen ones, since a common scale of the
+        # weights does not change the solution
+        w = 1 / self.__variances(origin, versor, covDiag, self.vertex, self.__norm)
+        self.weights = np.append(self.weights, w)
+        self.__A += w[0] * H[0]
+        self.__b += w[0] * Hr[0]
+        return self.__update()
+
+    def removeTrack(self, position: int):
+        """Function that removes a track from the fit; the weights of the other tracks are not
+        changed. The following tracks shift by one position, as in list.pop.
+
+        Parameters
+        ----------
+        position : int
+            position of the track in the fit (see trackIds)
+
+        Returns
+        -------
+        tuple
+            coordinates of the updated vertex [z,x,y] as np.ndarray of shape (3,) and chi2 of the fit.
+        """
+        w = self.weights[position]
+        H = self.__H[position]
+        Hr = self.__Hr[position]
+        self.origins = np.delete(self.origins, position, axis=0)
+        self.versors = np.delete(self.versors, position, axis=0)
+        self.covDiag = np.delete(self.covDiag, position, axis=0)
+        self.weights = np.delete(self.weights, position)
+        self.trackIds = np.delete(self.trackIds, position)
+        self.__H = np.delete(self.__H, position, axis=0)
+        self.__Hr = np.delete(self.__Hr, position, axis=0)
+
+        # Rank-2 downdate of the sums; if the track dominated them, the difference
+        # would lose precision, so the sums are recomputed
+        if w * np.trace(H) > 0.5 * np.trace(self.__A):
+            self.__resum()
+        else:
+            self.__A -= w * H
+            self.__b -= w * Hr
+        return self.__update()
+
+    def refit(self, warmStart: bool = True):
+        """Function that re-evaluates the weights of all the tracks at the vertex and solves again,
+        until the weights change by less than weightTolerance or the vertex by less than eps.
+
+        Parameters
+        ----------
+        warmStart : bool, optional
+            Wether the first weights are evaluated at the current vertex, by default True;
+            otherwise the fit starts from equal weights
+
+        Returns
+        -------
+        tuple
+            coordinates of the fitted vertex [z,x,y] as np.ndarray of shape (3,) and chi2 of the fit.
+        """
+        if len(self.origins) == 0:
+            return self.__update()
+        self.__norm = 2 / len(self.origins)
+        if not warmStart or np.isnan(self.vertex).any():
+            # First solve with equal weights, as in singleVertexFitter_irls
+            self.weights = np.ones(len(self.origins))
+            self.__resum()
+            self.__update()
+        sigma = self.__variances(
+            self.origins, self.versors, self.covDiag, self.vertex, self.__norm
+        )
+        nIter = 1
+        while nIter < self.maxIter:
+            self.weights = 1 / sigma
+            self.__resum()
+            vOld = self.vertex
+            self.__update()
+            sigmaNew = self.__variances(
+                self.origins, self.versors, self.covDiag, self.vertex, self.__norm
+            )
+            weightChange = np.max(np.abs(sigmaNew - sigma) / sigma)
+            sigma = sigmaNew
+            nIter += 1
+            if (
+                weightChange < self.weightTolerance
+                or np.linalg.norm(self.vertex - vOld) < self.eps
+            ):
+                break
+        return self.vertex, self.chi2
+
+    def trackChi2(self) -> np.ndarray:
+        """Function that returns the chi2 of each track with respect to the current vertex: the
+        squared distance of the track from the vertex divided by its variance (see the docs).
+
+        Returns
+        -------
+        np.ndarray
+            tracks' chi2 of shape (Ntracks,), in the order of trackIds.
+        """
+        return _trackChi2(
+            self.origins[None],
+            self.versors[None],
+            self.covDiag[None],
+            self.vertex[None],
+        )[0]
+
+    def removeOutliers(
+        self, maxChi2: float, minTracks: int = 2, refit: bool = False
+    ) -> list:
+        """Function that removes the track with the largest chi2 (see trackChi2), one at a time,
+        until no track has a chi2 above maxChi2 or only minTracks tracks are left.
+
+        Parameters
+        ----------
+        maxChi2 : float
+            maximum chi2 of the tracks kept in the fit
+        minTracks : int, optional
+            minimum number of tracks kept in the fit, by default 2
+        refit : bool, optional
+            Wether to refit (see refit) after each removal, by default False which means that
+            the vertex is only updated without re-evaluating the weights
+
+        Returns
+        -------
+        list
+            identifiers (see trackIds) of the removed tracks, in order of removal.
+        """
+        removed = []
+        while len(self.origins) > minTracks:
+            trackChi2 = self.trackChi2()
+            worst = int(np.argmax(trackChi2))
+            if not trackChi2[worst] > maxChi2:
+                break
+            removed.append(int(self.trackIds[worst]))
+            self.removeTrack(worst)
+            if refit:
+                self.refit()
+        return removed
+
+    def __variances(self, origins, versors, covDiag, v, norm):
+        return _trackVariances(
+            origins[None], versors[None], covDiag[None], v[None], np.full((1, 1), norm)
+        )[0]
+
+    def __resum(self):
+        self.__A = np.sum(self.weights[:, None, None] * self.__H, axis=0)
+        self.__b = np.sum(self.weights[:, None] * self.__Hr, axis=0)
+
+    def __update(self):
+        # Solve of the normal equations and chi2, as in singleVertexFitter_straightTracks
+        if len(self.origins) == 0:
+            self.vertex = np.full(3, np.nan)
+            self.chi2 = np.nan
+        else:
+            self.vertex = _solveNormalEquations(self.__A[None], self.__b[None])[0]
+            self.chi2 = _chi2Batch(
+                self.origins[None],
+                self.versors[None],
+                self.vertex[None],
+                np.ones((1, len(self.origins)), dtype=bool),
+            )[0]
+        return self.vertex, self.chi2
+
+
+class singleVertexFitter_kalman:
+    """Class that implements a sequential Single Vertex Fitter on straight tracks, in the style of the
+    Kalman filter (Billoir) vertex fits: starting from a loose prior, the tracks are added one at a
+    time, each one with a linearized update of the vertex and of its weight matrix (the inverse of
+    its covariance matrix), so the cost of a fit grows linearly with the number of tracks. Each
+    track measures the two coordinates of the vertex orthogonal to its direction; the measurement
+    covariance is propagated from the track's uncertainties at the current vertex. Besides the
+    vertex, the fit gives its 3x3 covariance matrix and the chi2 contribution of each track (see
+    fitBatch with returnInfo).
+    Note that the chi2 is the usual sum of squared residuals over their variances, not the chi2
+    of singleVertexFitter_straightTracks; for a complete explanation see the docs.
+
+    Public Members
+    --------------
+    self.priorVariance : float, variance in mm^2 of each coordinate of the prior vertex;
+    self.nPasses : int, number of passes over the tracks;
+    self.returnsCovariance : bool, True: fitBatch with returnInfo also returns the vertexes'
+        covariance matrices;
+
+    Public Methods
+    --------------
+    fit(tracks) : fits a single vertex on a list of H5Tracks;
+    fitArrays(origins, versors, covDiag) : fits a single vertex on tracks given as arrays;
+    fitBatch(origins, versors, covDiag, mask) : fits a single vertex for each jet of a batch;
+    key() : returns a str that identifies the fitter's algorithm, version and settings;
+    """
+
+    # Version of the algorithm, to be increased whenever a change modifies the fit results
+    version = 2
+    returnsCovariance = True
+
+    def __init__(self, priorVariance: float = 1e4, nPasses: int = 1) -> None:
+        """Constructor of the fitter.
+
+        Parameters
+        ----------
+        priorVariance : float, optional
+            variance in mm^2 of each coordinate of the prior vertex, by default 1e4 (a prior
+            with no practical effect on the fit)
+        nPasses : int, optional
+            number of passes over the tracks, by default 1; each further pass restarts from the
+            prior, propagating the tracks' uncertainties at the vertex of the previous pass
+        """
+        self.priorVariance = priorVariance
+        self.nPasses = int(nPasses)
+
+    def key(self) -> str:
+        """Returns a str that identifies the fitter's algorithm, version and settings."""
+        return (
+            f"{type(self).__name__}(version={self.version},"
+            f"priorVariance={self.priorVariance!r},nPasses={self.nPasses!r})"
+        )
+
+    def fit(self, tracks: list, returnInfo: bool = False):
+        """Functions that fit a single vertex on the tracks (H5Tracks)
+        contained in the given list, assumed to be straight tracks.
+
+        Parameters
+        ----------
+        tracks : list
+            tracks (list of H5Tracks): list of tracks to be fitted
+        returnInfo : bool, optional
+            Wether to also return the fit telemetry, the vertex covariance matrix and the tracks'
+            chi2 (see fitBatch), by default False
+
+        Returns
+        -------
+        tuple
+            coordinates of the fitted vertex [z,x,y] as np.ndarray of shape (3,) and chi2 of the fit.
+        """
+        origins = np.array([t.origin for t in tracks]).reshape(-1, 3)
+        versors = np.array([t.versor for t in tracks]).reshape(-1, 3)
+        covDiag = np.array([t.covDiag for t in tracks]).reshape(-1, 6)
+        return self.fitArrays(origins, versors, covDiag, returnInfo)
+
+    def fitArrays(
+        self,
+        origins: np.ndarray,
+        versors: np.ndarray,
+        covDiag: np.ndarray,
+        returnInfo: bool = False,
+    ):
+        """Functions that fit a single vertex on straight tracks given as arrays
+        of shape (Ntracks, 3), (Ntracks, 3) and (Ntracks, 6) (see fitBatch)."""
+        vertexes, chi2, info = self.fitBatch(
+            origins[None], versors[None], covDiag[None], returnInfo=True
+        )
+        if returnInfo:
+            return (
+                vertexes[0],
+                chi2[0],
+                {
+                    "nIterations": int(info["nIterations"][0]),
+                    "converged": bool(info["converged"][0]),
+                    "covariance": info["covariance"][0],
+                    "trackChi2": info["trackChi2"][0],
+                },
+            )
+        return vertexes[0], chi2[0]
+
+    def fitBatch(
+        self,
+        origins: np.ndarray,
+        versors: np.ndarray,
+        covDiag: np.ndarray,
+        mask: np.ndarray = None,
+        returnInfo: bool = False,
+        initialVertexes: np.ndarray = None,
+        trackWeights: np.ndarray = None,
+    ):
+        """Functions that fit a single vertex for each jet of a batch of jets at once: the k-th
+        tracks of all the jets are added together. Tracks are given as zero-padded arrays
+        (see padTracks).
+
+        Parameters
+        ----------
+        origins : np.ndarray
+            tracks' origins of shape (Njets, maxTracks, 3)
+        versors : np.ndarray
+            tracks' versors of shape (Njets, maxTracks, 3)
+        covDiag : np.ndarray
+            diagonals of the tracks' covariance matrices of shape (Njets, maxTracks, 6)
+        mask : np.ndarray, optional
+            boolean mask of the non-padded tracks of shape (Njets, maxTracks),
+            by default None which means that all tracks are used
+        returnInfo : bool, optional
+            Wether to also return the fit telemetry, by default False
+        initialVertexes : np.ndarray, optional
+            prior vertexes of shape (Njets, 3), by default None which means the (weighted)
+            average origin of the tracks; jets with a nan prior use the average origin too
+        trackWeights : np.ndarray, optional
+            weights of the tracks of shape (Njets, maxTracks), which divide the covariance of
+            their measurements (e.g. the GN2 heavy flavour probabilities, for a soft track
+            selection), by default None which means equal weights; tracks with a null weight
+            are skipped
+
+        Returns
+        -------
+        tuple of np.ndarray
+            coordinates of the fitted vertexes [z,x,y] of shape (Njets, 3) and chi2 of the fits of
+            shape (Njets,); jets with no tracks are filled with nan.
+            If returnInfo, also a dict with the number of passes of each fit ("nIterations", of
+            shape (Njets,)), wether it was fitted ("converged", of shape (Njets,), False only for
+            the jets with no tracks), the vertexes' covariance matrices ("covariance", of shape
+            (Njets, 3, 3)) and the chi2 of each track with respect to the fitted vertex
+            ("trackChi2", of shape (Njets, maxTracks), zero for the padded tracks), whose sum
+            is the chi2 of the fit.
+        """
+        origins = np.asarray(origins, dtype=float)
+        versors = np.asarray(versors, dtype=float)
+        covDiag = np.asarray(covDiag, dtype=float)
+        if mask is None:
+            mask = np.ones(origins.shape[:2], dtype=bool)
+        mask = np.asarray(mask, dtype=bool)
+        weights = mask.astype(float)
+        if trackWeights is not None:
+            weights *= np.asarray(trackWeights, dtype=float)
+        used = weights > 0
+
+        # Handy variables
+        Njets, maxTracks = mask.shape
+        valid = used.any(axis=1)
+        totalWeight = np.where(valid, np.sum(weights, axis=1), 1.0)
+
+        # Orthonormal bases (u1, u2) of the planes orthogonal to the tracks: each track measures
+        # the projections of the vertex on them, m = U^T r
+        # (padded tracks get an arbitrary direction)
+        directions = np.where(mask[:, :, None], versors, np.array([1.0, 0.0, 0.0]))
+        axis = np.eye(3)[np.argmin(np.abs(directions), axis=2)]
+        u1 = np.cross(directions, axis)
+        u1 /= np.linalg.norm(u1, axis=2, keepdims=True)
+        u2 = np.cross(directions, u1)
+        u2 /= np.linalg.norm(u2, axis=2, keepdims=True)
+        UT = np.stack([u1, u2], axis=2)
+        U = np.swapaxes(UT, 2, 3)
+        m = (UT @ origins[:, :, :, None])[:, :, :, 0]
+
+        # Origins' and versors' variances (covDiag holds the uncertainties)
+        originVariances = covDiag[:, :, :3] ** 2
+        versorVariances = covDiag[:, :, 3:] ** 2
+        originCov = UT @ (originVariances[:, :, :, None] * U)
+        versorCov = UT @ (versorVariances[:, :, :, None] * U)
+
+        # Prior vertexes
+        v0 = np.sum(origins * weights[:, :, None], axis=1) / totalWeight[:, None]
+        if initialVertexes is not None:
+            initialVertexes = np.asarray(initialVertexes, dtype=float)
+            warm = ~np.isnan(initialVertexes).any(axis=1)
+            v0[warm] = initialVertexes[warm]
+        linearization = None
+
+        for _ in range(self.nPasses):
+            # Information (weight matrix) form of the filter, which does not lose precision
+            # with a loose prior: W = C^-1 and b = W v
+            v = v0.copy()
+            W = np.broadcast_to(np.eye(3) / self.priorVariance, (Njets, 3, 3)).copy()
+            b = (W @ v[:, :, None])[:, :, 0]
+            for k in range(maxTracks):
+                idx = np.flatnonzero(used[:, k])
+                if len(idx) == 0:
+                    continue
+                Hk = UT[idx, k]
+                # Measurement covariance, with the versor's uncertainties propagated on the
+                # distance between the track's origin and the vertex
+                point = v[idx] if linearization is None else linearization[idx]
+                leverArm = np.sum(versors[idx, k] * (point - origins[idx, k]), axis=1)
+                Vk = (
+                    originCov[idx, k] + leverArm[:, None, None] ** 2 * versorCov[idx, k]
+                )
+                # Update of the weight matrix and of the vertex
+                HTVinv = np.swapaxes(Hk, 1, 2) @ (
+                    np.linalg.inv(Vk) * weights[idx, k, None, None]
+                )
+                W[idx] += HTVinv @ Hk
+                b[idx] += (HTVinv @ m[idx, k, :, None])[:, :, 0]
+                v[idx] = np.linalg.solve(W[idx], b[idx][:, :, None])[:, :, 0]
+            linearization = v
+        C = np.linalg.inv(W)
+
+        # Tracks' chi2 with respect to the fitted vertexes
+        leverArm = np.sum(versors * (v[:, None, :] - origins), axis=2)
+        V = originCov + leverArm[:, :, None, None] ** 2 * versorCov
+        # stability for the inversion of the padded tracks
+        V += 1e-12 * np.eye(2)
+        residual = m - (UT @ v[:, None, :, None])[:, :, :, 0]
+        trackChi2 = np.sum(
+            residual * (np.linalg.inv(V) @ residual[:, :, :, None])[:, :, :, 0], axis=2
+        )
+        trackChi2 = np.where(used, weights * trackChi2, 0.0)
+
+        vertexes = np.where(valid[:, None], v, np.nan)
+        chi2 = np.where(valid, np.sum(trackChi2, axis=1), np.nan)
+
+        # Returning vertexes and chi2
+        if returnInfo:
+            info = {
+                "nIterations": np.where(valid, self.nPasses, 0),
+                "converged": valid,
+                "covariance": np.where(valid[:, None, None], C, np.nan),
+                "trackChi2": trackChi2,
+            }
+            return vertexes, chi2, info
+        return vertexes, chi2
+
+
+class singleVertexFitter_helix:
+    """Class that implements a Single Vertex Fitter on curved (helical) tracks, by linearizing
+    them around the current vertex: each track is replaced by the straight line tangent to it at
+    its point of closest approach to the vertex in the transverse plane, with the uncertainties
+    of the origin propagated along the track, and the vertex is fitted again with a straight
+    tracks engine, until it moves by less than eps. All the steps are batched over the jets;
+    straight tracks (null curvature) are fitted as by the engine.
+
+    Public Members
+    --------------
+    self.engine : straight tracks fitter used for each linearization (any fitter with a fitBatch
+        method supporting initialVertexes);
+    self.eps : float, stopping threshold (in mm) on the vertex change between linearizations;
+    self.maxIter : int, maximum number of linearizations;
+    self.curvedTracks : bool, True: fitBatch takes the tracks' curvatures;
+    self.returnsCovariance : bool, wether fitBatch with returnInfo also returns the vertexes'
+        covariance matrices (as the engine does);
+
+    Public Methods
+    --------------
+    fit(tracks) : fits a single vertex on a list of H5Tracks;
+    fitArrays(origins, versors, covDiag, curvatures) : fits a single vertex on tracks given
+        as arrays;
+    fitBatch(origins, versors, covDiag, mask, curvatures) : fits a single vertex for each jet
+        of a batch;
+    linearize(origins, versors, covDiag, curvatures, vertexes) : returns the straight lines
+        tangent to the tracks at their closest approach to the vertexes;
+    key() : returns a str that identifies the fitter's algorithm, version and settings;
+    """
+
+    # Version of the algorithm, to be increased whenever a change modifies the fit results
+    version = 1
+    curvedTracks = True
+
+    def __init__(self, engine=None, eps: float = 1e-6, maxIter: float = 20) -> None:
+        """Constructor of the fitter.
+
+        Parameters
+        ----------
+        engine : optional
+            straight tracks fitter used for each linearization, by default None which means
+            singleVertexFitter_kalman()
+        eps : float, optional
+            stopping threshold in mm on the vertex change between linearizations, by default 1e-6
+        maxIter : float, optional
+            maximum number of linearizations, by default 20
+        """
+        self.engine = singleVertexFitter_kalman() if engine is None else engine
+        self.eps = eps
+        self.maxIter = int(maxIter)
+
+    @property
+    def returnsCovariance(self) -> bool:
+        return getattr(self.engine, "returnsCovariance", False)
+
+    def key(self) -> str:
+        """Returns a str that identifies the fitter's algorithm, version and settings."""
+        return (
+            f"{type(self).__name__}(version={self.version},engine={self.engine.key()},"
+            f"eps={self.eps!r},maxIter={self.maxIter!r})"
+        )
+
+    def fit(self, tracks: list, returnInfo: bool = False):
+        """Functions that fit a single vertex on the tracks (H5Tracks)
+        contained in the given list, using their curvatures.
+
+        Parameters
+        ----------
+        tracks : list
+            tracks (list of H5Tracks): list of tracks to be fitted
+        returnInfo : bool, optional
+            Wether to also return the fit telemetry (see fitBatch), by default False
+
+        Returns
+        -------
+        tuple
+            coordinates of the fitted vertex [z,x,y] as np.ndarray of shape (3,) and chi2 of the fit.
+        """
+        origins = np.array([t.origin for t in tracks]).reshape(-1, 3)
+        versors = np.array([t.versor for t in tracks]).reshape(-1, 3)
+        covDiag = np.array([t.covDiag for t in tracks]).reshape(-1, 6)
+        curvatures = np.array([t.curvature for t in tracks], dtype=float)
+        return self.fitArrays(origins, versors, covDiag, curvatures, returnInfo)
+
+    def fitArrays(
+        self,
+        origins: np.ndarray,
+        versors: np.ndarray,
+        covDiag: np.ndarray,
+        curvatures: np.ndarray,
+        returnInfo: bool = False,
+    ):
+        """Functions that fit a single vertex on curved tracks given as arrays of shape
+        (Ntracks, 3), (Ntracks, 3), (Ntracks, 6) and (Ntracks,) (see fitBatch)."""
+        vertexes, chi2, info = self.fitBatch(
+            origins[None],
+            versors[None],
+            covDiag[None],
+            returnInfo=True,
+            curvatures=np.asarray(curvatures, dtype=float)[None],
+        )
+        if returnInfo:
+            return vertexes[0], chi2[0], {k: v[0] for k, v in info.items()}
+        return vertexes[0], chi2[0]
+
+    def linearize(
+        self,
+        origins: np.ndarray,
+        versors: np.ndarray,
+        covDiag: np.ndarray,
+        curvatures: np.ndarray,
+        vertexes: np.ndarray,
+    ):
+        """Function that replaces the tracks of each jet with the straight lines tangent to them
+        at their closest approach to the jet's vertex in the transverse plane.
+
+        Parameters
+        ----------
+        origins, versors, covDiag, curvatures : np.ndarray
+            tracks' perigees, versors at the perigee, diagonals of the covariance matrices and
+            curvatures, of shape (Njets, maxTracks, ...) (see fitBatch)
+        vertexes : np.ndarray
+            vertexes of shape (Njets, 3)
+
+        Returns
+        -------
+        tuple of np.ndarray
+            origins and versors of the tangent lines of shape (Njets, maxTracks, 3) and diagonals
+            of their covariance matrices of shape (Njets, maxTracks, 6), whose origin errors
+            include the versor errors propagated from the perigee.
+        """
+        points = vertexes[:, None, :]
+        s = helixClosestApproach(origins, versors, curvatures, points)
+        tangentOrigins, tangentVersors = helixPoint(origins, versors, curvatures, s)
+        # Path length from the perigee (3D)
+        sinTheta = np.hypot(versors[:, :, 1], versors[:, :, 2])
+        pathLength = s / np.where(sinTheta > 0, sinTheta, 1.0)
+        tangentCovDiag = covDiag.copy()
+        tangentCovDiag[:, :, :3] = np.sqrt(
+            covDiag[:, :, :3] ** 2 + (pathLength[:, :, None] * covDiag[:, :, 3:]) ** 2
+        )
+        return tangentOrigins, tangentVersors, tangentCovDiag
+
+    def fitBatch(
+        self,
+        origins: np.ndarray,
+        versors: np.ndarray,
+        covDiag: np.ndarray,
+        mask: np.ndarray = None,
+        returnInfo: bool = False,
+        initialVertexes: np.ndarray = None,
+        trackWeights: np.ndarray = None,
+        curvatures: np.ndarray = None,
+    ):
+        """Functions that fit a single vertex for each jet of a batch of jets at once. Tracks are
+        given as zero-padded arrays (see padTracks and JetBatch.paddedColumn); the first fit
+        uses the lines tangent to the tracks at their perigee, and jets whose vertex has moved by
+        less than eps are not linearized again.
+
+        Parameters
+        ----------
+        origins : np.ndarray
+            tracks' perigees of shape (Njets, maxTracks, 3)
+        versors : np.ndarray
+            tracks' versors at the perigee of shape (Njets, maxTracks, 3)
+        covDiag : np.ndarray
+            diagonals of the tracks' covariance matrices of shape (Njets, maxTracks, 6)
+        mask : np.ndarray, optional
+            boolean mask of the non-padded tracks of shape (Njets, maxTracks),
+            by default None which means that all tracks are used
+        returnInfo : bool, optional
+            Wether to also return the fit telemetry, by default False
+        initialVertexes : np.ndarray, optional
+            starting vertexes of the first fit of shape (Njets, 3) (see the engine's fitBatch),
+            by default None
+        trackWeights : np.ndarray, optional
+            weights of the tracks of shape (Njets, maxTracks) (see the engine's fitBatch),
+            by default None which means equal weights
+        curvatures : np.ndarray, optional
+            tracks' curvatures in 1/mm of shape (Njets, maxTracks) (see trackCurvature),
+            by default None which means straight tracks
+
+        Returns
+        -------
+        tuple of np.ndarray
+            coordinates of the fitted vertexes [z,x,y] of shape (Njets, 3) and chi2 of the last
+            fits of shape (Njets,); jets with no tracks are filled with nan.
+            If returnInfo, also the telemetry of the last fit of each jet (see the engine's
+            fitBatch), with the total number of iterations of the engine ("nIterations") and
+            wether the vertex converged, both in the last fit and between the linearizations
+            ("converged").
+        """
+        origins = np.asarray(origins, dtype=float)
+        versors = np.asarray(versors, dtype=float)
+        covDiag = np.asarray(covDiag, dtype=float)
+        if mask is None:
+            mask = np.ones(origins.shape[:2], dtype=bool)
+        if curvatures is None:
+            curvatures = np.zeros(origins.shape[:2])
+        curvatures = np.where(mask, curvatures, 0.0)
+
+        # Fit of the lines tangent at the perigee
+        vertexes, chi2, info = self.engine.fitBatch(
+            origins,
+            versors,
+            covDiag,
+            mask,
+            returnInfo=True,
+            initialVertexes=initialVertexes,
+            trackWeights=trackWeights,
+        )
+        info = {k: np.array(v) for k, v in info.items()}
+        valid = ~np.isnan(vertexes).any(axis=1)
+        stable = np.zeros(len(vertexes), dtype=bool)
+
+        for _ in range(self.maxIter):
+            active = np.flatnonzero(valid & ~stable)
+            if len(active) == 0:
+                break
+            lines = self.linearize(
+                origins[active],
+                versors[active],
+                covDiag[active],
+                curvatures[active],
+                vertexes[active],
+            )
+            newVertexes, chi2[active], newInfo = self.engine.fitBatch(
+                *lines,
+                mask[active],
+                returnInfo=True,
+                initialVertexes=vertexes[active],
+                trackWeights=None if trackWeights is None else trackWeights[active],
+            )
+            # Vertex change between linearizations
+            stable[active] = np.max(np.abs(newVertexes - vertexes[active]), axis=1) < (
+                self.eps
+            )
+            vertexes[active] = newVertexes
+            for k, v in newInfo.items():
+                if k == "nIterations":
+                    info[k][active] += v
+                else:
+                    info[k][active] = v
+
+        # Returning vertexes and chi2
+        if returnInfo:
+            info["converged"] = info["converged"] & stable
+            return vertexes, chi2, info
+        return vertexes, chi2
+
+
+def annealedFitBatch(
+    fitter,
+    origins: np.ndarray,
+    versors: np.ndarray,
+    covDiag: np.ndarray,
+    mask: np.ndarray = None,
+    trackWeights: np.ndarray = None,
+    temperatures: list = [64.0, 16.0, 4.0, 1.0],
+    chi2Cut: float = 25.0,
+    returnInfo: bool = False,
+    curvatures: np.ndarray = None,
+    initialWeights: np.ndarray = None,
+):
+    """Function that fits a single vertex for each jet of a batch with deterministic annealing:
+    after a first fit with the given tracks' weights p_i (or with initialWeights, e.g. a hard
+    selection of the tracks), the jets are fitted again at decreasing temperatures T, each fit
+    starting from the previous vertex, with the weights
+        w_i = p_i / (1 + exp((chi2_i - chi2Cut) / 2T))
+    where chi2_i is the chi2 of the track with respect to the previous vertex. At high temperature
+    all the tracks keep about half their weight, while at low temperature the tracks incompatible
+    with the vertex (chi2_i above chi2Cut) are switched off; for a complete explanation see the docs.
+
+    Parameters
+    ----------
+    fitter : singleVertexFitter_straightTracks
+        the vertex fitter (any fitter whose fitBatch supports initialVertexes and trackWeights)
+    origins : np.ndarray
+        tracks' origins of shape (Njets, maxTracks, 3)
+    versors : np.ndarray
+        tracks' versors of shape (Njets, maxTracks, 3)
+    covDiag : np.ndarray
+        diagonals of the tracks' covariance matrices of shape (Njets, maxTracks, 6)
+    mask : np.ndarray, optional
+        boolean mask of the non-padded tracks of shape (Njets, maxTracks),
+        by default None which means that all tracks are used
+    trackWeights : np.ndarray, optional
+        prior weights of the tracks of shape (Njets, maxTracks) (e.g. the GN2 heavy flavour
+        probabilities), by default None which means equal weights
+    temperatures : list, optional
+        decreasing temperatures of the annealing, by default [64.0, 16.0, 4.0, 1.0];
+        an empty list means a single fit with the prior weights
+    chi2Cut : float, optional
+        chi2 of a track at which its weight is halved, by default 25.0
+    returnInfo : bool, optional
+        Wether to also return the fit telemetry, by default False
+    curvatures : np.ndarray, optional
+        tracks' curvatures of shape (Njets, maxTracks) for fitters of curved tracks (see
+        singleVertexFitter_helix), by default None; the tracks' chi2 are then evaluated on the
+        lines tangent to the tracks at the vertex
+    initialWeights : np.ndarray, optional
+        tracks' weights of the first fit of shape (Njets, maxTracks), by default None which means
+        the prior weights; jets whose initial weights are all null start from the prior weights.
+        Starting from the vertex of a hard selection keeps the annealing away from the crossings
+        of the misclassified tracks, where a fit of all the tracks can get stuck
+
+    Returns
+    -------
+    tuple of np.ndarray
+        coordinates of the fitted vertexes [z,x,y] of shape (Njets, 3), chi2 of the fits (weighted
+        by the final weights) of shape (Njets,) and the final tracks' weights of shape
+        (Njets, maxTracks). If returnInfo, also the telemetry of the last fit (see the fitter's
+        fitBatch) with the total number of iterations of the fits of each jet ("nIterations").
+    """
+    origins = np.asarray(origins, dtype=float)
+    versors = np.asarray(versors, dtype=float)
+    covDiag = np.asarray(covDiag, dtype=float)
+    if mask is None:
+        mask = np.ones(origins.shape[:2], dtype=bool)
+    prior = np.asarray(mask, dtype=float)
+    if trackWeights is not None:
+        prior = prior * np.asarray(trackWeights, dtype=float)
+
+    # Curved tracks are only given to the fitters that support them
+    fitArguments = {} if curvatures is None else {"curvatures": curvatures}
+
+    weights = prior
+    if initialWeights is not None:
+        weights = mask * np.asarray(initialWeights, dtype=float)
+        empty = ~(np.sum(weights, axis=1) > 0)
+        weights = np.where(empty[:, None], prior, weights)
+    vertexes, chi2, info = fitter.fitBatch(
+        origins,
+        versors,
+        covDiag,
+        mask,
+        returnInfo=True,
+        trackWeights=weights,
+        **fitArguments,
+    )
+    nIterations = info["nIterations"].copy()
+    for T in temperatures:
+        # Jets with no tracks keep their nan vertexes
+        valid = ~np.isnan(vertexes).any(axis=1)
+        if not valid.any():
+            break
+        lines = (origins[valid], versors[valid], covDiag[valid])
+        if curvatures is not None:
+            lines = fitter.linearize(*lines, curvatures[valid], vertexes[valid])
+        trackChi2 = np.zeros(prior.shape)
+        trackChi2[valid] = _trackChi2(*lines, vertexes[valid])
+        # Logistic function written with tanh, which does not overflow
+        newWeights = prior * 0.5 * (1 - np.tanh((trackChi2 - chi2Cut) / (4 * T)))
+        # Jets whose tracks would all be switched off keep their weights
+        switchedOff = ~(np.sum(newWeights, axis=1) > 0)
+        weights = np.where(switchedOff[:, None], weights, newWeights)
+        vertexes, chi2, info = fitter.fitBatch(
+            origins,
+            versors,
+            covDiag,
+            mask,
+            returnInfo=True,
+            initialVertexes=vertexes,
+            trackWeights=weights,
+            **fitArguments,
+        )
+        nIterations += info["nIterations"]
+
+    # Returning vertexes, chi2 and weights
+    if returnInfo:
+        return (
+            vertexes,
+            chi2,
+            weights,
+            dict(info, nIterations=nIterations),
+        )
+    return vertexes, chi2, weights
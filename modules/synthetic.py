@@ -0,0 +1,298 @@
+# Modules import
+from modules.ImportH5 import trackFields, helixFields, originProbabilityFields
+from modules.ImportH5 import _buildBatch
+from modules.containers import trackCurvature, helixPoint, helixClosestApproach
+
+# Python import
+import h5py
+import numpy as np
+
+# Dtypes of the synthetic jets and tracks records, with the fields read by iterateH5
+syntheticJetDtype = np.dtype(
+    [
+        ("n_tracks_loose", "i4"),
+        ("SV1_L3d", "f4"),
+        ("SV1_Lxy", "f4"),
+        ("eta", "f4"),
+        ("phi", "f4"),
+        ("pt", "f4"),
+        ("primaryVertexDetectorZ", "f4"),
+        ("HadronConeExclTruthLabelID", "i4"),
+        ("HadronConeExclTruthLabelLxy", "f4"),
+    ]
+)
+syntheticTrackDtype = np.dtype(
+    [
+        (f, "i4" if f in ("ftagTruthOriginLabel", "SV1VertexIndex") else "f4")
+        for f in trackFields + helixFields + originProbabilityFields
+    ]
+    + [("valid", "?")]
+)
+
+
+def _trackCounts(rng, nJets: int, nTracks):
+    """Returns the number of tracks of each jet: nTracks if it is an int, otherwise uniformly
+    distributed between the two values of the tuple nTracks (included)."""
+    if np.ndim(nTracks) == 0:
+        return np.full(nJets, int(nTracks))
+    return rng.integers(nTracks[0], nTracks[1] + 1, nJets)
+
+
+def syntheticRecords(
+    nJets: int,
+    nTracks=(2, 20),
+    displacement: float = 3.0,
+    errorScale: float = 1.0,
+    heavyFlavourFraction: float = 0.5,
+    flavourFractions: dict = {5: 1.0},
+    maxTracks: int = 40,
+    seed: int = 0,
+    magneticField: float = None,
+):
+    """Function that generates synthetic jets as records of an ATLAS H5 file (see iterateH5).
+    Each b/c jet has a secondary vertex along its axis, at a flight distance exponentially
+    distributed, and its tracks are straight lines (or helixes, if magneticField is given)
+    coming either from it (heavy flavour tracks) or from the origin (primary tracks); light jets
+    only have primary tracks. Tracks' parameters are smeared by their uncertainties,
+    so that fitting the heavy flavour tracks gives back the true vertex.
+
+    Parameters
+    ----------
+    nJets : int
+        Number of jets
+    nTracks : int or tuple, optional
+        Number of tracks of each jet, or (min, max) range of a uniform distribution,
+        by default (2, 20)
+    displacement : float, optional
+        Mean flight distance of the secondary vertexes in mm, by default 3.0
+    errorScale : float, optional
+        Scale factor of the tracks' uncertainties (and of their smearing), by default 1.0
+    heavyFlavourFraction : float, optional
+        Probability of a track of a b/c jet to come from the secondary vertex, by default 0.5
+    flavourFractions : dict, optional
+        HadronConeExclTruthLabelID (5, 4 or 0) -> fraction of the jets, by default {5: 1.0};
+        c jets fly half as far as b jets
+    maxTracks : int, optional
+        Number of tracks per jet in the padded tracks records, by default 40
+    seed : int, optional
+        Seed of the random generator (int or np.random.SeedSequence), by default 0
+    magneticField : float, optional
+        magnetic field along the beam axis in T, by default None which means straight tracks
+        (with null qOverP); curved tracks have a random charge
+
+    Returns
+    -------
+    tuple of np.ndarray
+        jets records of shape (Njets,), zero-padded tracks records of shape (Njets, maxTracks)
+        and true vertexes (in H5Track coordinates) of shape (Njets, 3), at the origin for
+        light jets.
+    """
+    rng = np.random.default_rng(seed)
+    flavourLabels = np.array(list(flavourFractions.keys()))
+    fractions = np.array(list(flavourFractions.values()), dtype=float)
+    flavour = rng.choice(flavourLabels, nJets, p=fractions / fractions.sum())
+    counts = np.minimum(_trackCounts(rng, nJets, nTracks), maxTracks)
+    jetIndex = np.repeat(np.arange(nJets), counts)
+    nTotal = len(jetIndex)
+
+    # Jets' axes, in the frame of the imported tracks (jet along phi = pi/2)
+    jetEta = rng.uniform(-2.5, 2.5, nJets)
+    jetTheta = 2 * np.arctan(np.exp(-jetEta))
+    jetAxis = np.stack([np.cos(jetTheta), np.zeros(nJets), np.sin(jetTheta)], axis=1)
+    flight = rng.exponential(displacement, nJets) * np.select(
+        [flavour == 5, flavour == 4], [1.0, 0.5], 0.0
+    )
+    vertexes = flight[:, None] * jetAxis
+
+    # Tracks' directions, around the jet axis
+    fromSV = (rng.random(nTotal) < heavyFlavourFraction) & (flavour[jetIndex] != 0)
+    theta = np.clip(jetTheta[jetIndex] + rng.normal(0, 0.1, nTotal), 0.05, np.pi - 0.05)
+    phi = np.pi / 2 + rng.normal(0, 0.1, nTotal)
+    start = np.where(fromSV[:, None], vertexes[jetIndex], 0.0)
+
+    if magneticField is None:
+        # Perigee parameters of the straight lines (inverse of trackGeometry)
+        sinTheta = np.sin(theta)
+        transverse = start[:, 1] * np.cos(phi) + start[:, 2] * np.sin(phi)
+        d0 = start[:, 1] * np.sin(phi) - start[:, 2] * np.cos(phi)
+        z0 = start[:, 0] - np.cos(theta) / sinTheta * transverse
+    else:
+        # Perigee parameters of the helixes: moving from the start to the closest approach
+        # to the beam axis
+        pt = rng.exponential(5e3, nTotal) + 500
+        charge = rng.choice([-1.0, 1.0], nTotal)
+        curvatures = trackCurvature(charge, pt, magneticField)
+        directions = np.stack(
+            [np.cos(theta), np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi)],
+            axis=1,
+        )
+        s = helixClosestApproach(start, directions, curvatures, np.zeros(3))
+        perigees, directions = helixPoint(start, directions, curvatures, s)
+        phi = np.arctan2(directions[:, 2], directions[:, 1])
+        d0 = perigees[:, 1] * np.sin(phi) - perigees[:, 2] * np.cos(phi)
+        z0 = perigees[:, 0]
+
+    # Uncertainties and smearing
+    sigmaD0 = errorScale * rng.uniform(0.01, 0.1, nTotal)
+    sigmaZ0 = errorScale * rng.uniform(0.01, 0.1, nTotal)
+    sigmaTheta = errorScale * rng.uniform(1e-4, 1e-3, nTotal)
+    sigmaPhi = errorScale * rng.uniform(1e-4, 1e-3, nTotal)
+    d0 = d0 + rng.normal(0, 1, nTotal) * sigmaD0
+    z0 = z0 + rng.normal(0, 1, nTotal) * sigmaZ0
+    theta = theta + rng.normal(0, 1, nTotal) * sigmaTheta
+    phi = phi + rng.normal(0, 1, nTotal) * sigmaPhi
+
+    # Truth labels (FromB, FromC or Primary) and GN2-like probabilities peaked on them
+    truthLabel = np.where(fromSV, np.where(flavour[jetIndex] == 5, 3, 5), 2)
+    concentration = np.ones((nTotal, len(originProbabilityFields)))
+    concentration[np.arange(nTotal), truthLabel] += 8
+    probabilities = rng.gamma(concentration)
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+    flatTracks = np.zeros(nTotal, dtype=syntheticTrackDtype)
+    if magneticField is None:
+        flatTracks["pt"] = rng.exponential(5e3, nTotal) + 500
+    else:
+        flatTracks["pt"] = pt
+        flatTracks["qOverP"] = charge * np.sin(theta) / pt
+    flatTracks["eta"] = -np.log(np.tan(theta / 2))
+    flatTracks["dphi"] = phi - np.pi / 2
+    flatTracks["IP3D_signed_d0"] = d0
+    flatTracks["z0RelativeToBeamspot"] = z0
+    flatTracks["ftagTruthOriginLabel"] = truthLabel
+    flatTracks["SV1VertexIndex"] = np.where(fromSV & (rng.random(nTotal) < 0.7), 0, -1)
+    flatTracks["z0RelativeToBeamspotUncertainty"] = sigmaZ0
+    flatTracks["phiUncertainty"] = sigmaPhi
+    flatTracks["thetaUncertainty"] = sigmaTheta
+    flatTracks["d0Uncertainty"] = sigmaD0
+    for i, f in enumerate(originProbabilityFields):
+        flatTracks[f] = probabilities[:, i]
+    flatTracks["valid"] = True
+
+    # Zero-padded tracks records
+    tracks = np.zeros((nJets, maxTracks), dtype=syntheticTrackDtype)
+    rank = np.arange(nTotal) - np.repeat(np.cumsum(counts) - counts, counts)
+    tracks[jetIndex, rank] = flatTracks
+
+    lxy = np.linalg.norm(vertexes[:, 1:], axis=1)
+    jets = np.zeros(nJets, dtype=syntheticJetDtype)
+    jets["n_tracks_loose"] = counts
+    hasSV1 = np.bincount(jetIndex[flatTracks["SV1VertexIndex"] == 0], minlength=nJets)
+    jets["SV1_L3d"] = np.where(hasSV1 > 0, flight, np.nan)
+    jets["SV1_Lxy"] = np.where(hasSV1 > 0, lxy, np.nan)
+    jets["eta"] = jetEta
+    jets["phi"] = rng.uniform(-np.pi, np.pi, nJets)
+    jets["pt"] = rng.exponential(5e4, nJets) + 2e4
+    jets["HadronConeExclTruthLabelID"] = flavour
+    jets["HadronConeExclTruthLabelLxy"] = np.where(flavour != 0, lxy, np.nan)
+    return jets, tracks, vertexes
+
+
+def syntheticBatch(nJets: int, **settings):
+    """Function that generates synthetic jets (see syntheticRecords) and imports them
+    into a JetBatch, as iterateH5 does with the records of an H5 file (with curved tracks if
+    magneticField is given).
+
+    Parameters
+    ----------
+    nJets : int
+        Number of jets
+    **settings:
+        other arguments of syntheticRecords.
+
+    Returns
+    -------
+    tuple
+        the JetBatch and the true vertexes of shape (Njets, 3).
+    """
+    jets, tracks, vertexes = syntheticRecords(nJets, **settings)
+    batch = _buildBatch(
+        jets,
+        tracks,
+        np.arange(nJets),
+        customProperties=["HadronConeExclTruthLabelLxy"],
+        onlySV1=False,
+        straightTracks=settings.get("magneticField") is None,
+    )
+    return batch, vertexes
+
+
+def writeSyntheticH5(
+    filepath: str,
+    nJets: int,
+    chunkSize: int = 10000,
+    maxTracks: int = 40,
+    flavourFractions: dict = {5: 0.4, 4: 0.3, 0: 0.3},
+    compression: str = None,
+    seed: int = 0,
+    verbose: bool = False,
+    **settings,
+):
+    """Function that writes a synthetic H5 file with the schema of the ATLAS files read by
+    iterateH5: a "jets" dataset, a zero-padded "tracks_loose" dataset with the GN2 origin
+    probabilities, plus a "truthVertices" dataset with the true secondary vertex of each jet
+    (in H5Track coordinates, see syntheticRecords). Jets are generated and written one chunk
+    at a time, so files of any size can be written with a bounded memory; each chunk has its
+    own random stream, so the file only depends on the seed and on the chunk size.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the H5 file
+    nJets : int
+        Number of jets
+    chunkSize : int, optional
+        Number of jets generated at a time, which is also the on-disk chunk size of the
+        datasets, by default 10000
+    maxTracks : int, optional
+        Number of tracks per jet in the tracks dataset, by default 40
+    flavourFractions : dict, optional
+        fractions of b (5), c (4) and light (0) jets, by default {5: 0.4, 4: 0.3, 0: 0.3}
+    compression : str, optional
+        h5py compression filter of the datasets (e.g. "gzip" or "lzf"), by default None
+    seed : int, optional
+        Seed of the random generator, by default 0
+    verbose : bool, optional
+        Wether to print the number of written jets while writing, by default False
+    **settings:
+        other arguments of syntheticRecords (nTracks, displacement, errorScale, ...).
+    """
+    chunkSize = max(min(chunkSize, nJets), 1)
+    seeds = np.random.SeedSequence(seed).spawn(-(-nJets // chunkSize))
+    with h5py.File(filepath, "w") as h5Database:
+        jetsDataset = h5Database.create_dataset(
+            "jets",
+            shape=(nJets,),
+            dtype=syntheticJetDtype,
+            chunks=(chunkSize,),
+            compression=compression,
+        )
+        tracksDataset = h5Database.create_dataset(
+            "tracks_loose",
+            shape=(nJets, maxTracks),
+            dtype=syntheticTrackDtype,
+            chunks=(chunkSize, maxTracks),
+            compression=compression,
+        )
+        verticesDataset = h5Database.create_dataset(
+            "truthVertices",
+            shape=(nJets, 3),
+            dtype="f8",
+            chunks=(chunkSize, 3),
+            compression=compression,
+        )
+        for chunk, start in enumerate(range(0, nJets, chunkSize)):
+            stop = min(start + chunkSize, nJets)
+            jets, tracks, vertexes = syntheticRecords(
+                stop - start,
+                flavourFractions=flavourFractions,
+                maxTracks=maxTracks,
+                seed=seeds[chunk],
+                **settings,
+            )
+            jetsDataset[start:stop] = jets
+            tracksDataset[start:stop] = tracks
+            verticesDataset[start:stop] = vertexes
+            # Status
+            if verbose:
+                print("Written", stop, "jets", end="\r")
@@ -0,0 +1,538 @@
+# Modules import
+from modules.profiling import profileStage
+from modules.scheduler import MultiplicityScheduler
+from modules.singleVertexFitter import annealedFitBatch
+
+# Python import
+import hashlib
+import inspect
+import numpy as np
+from functools import partial
+
+# Origin codes of heavy flavour tracks: FromB, FromBC, FromC (see H5Track.truthOriginDict)
+heavyFlavourOrigins = [3, 4, 5]
+
+
+def truthHeavyFlavour(batch):
+    """Selects the tracks whose MC truth origin is FromB, FromBC or FromC (perfect track selection)."""
+    return np.isin(batch.truthOriginLabel, heavyFlavourOrigins)
+
+
+def gn2HeavyFlavour(batch):
+    """Selects the tracks whose GN2 predicted origin (argmax) is FromB, FromBC or FromC."""
+    return np.isin(batch.gn2Origin, heavyFlavourOrigins)
+
+
+def sv1Selected(batch):
+    """Selects the tracks selected by SV1 for the secondary vertex."""
+    return np.asarray(batch.SV1Selected, dtype=bool)
+
+
+def gn2HeavyFlavourProbability(batch, power: float = 1.0):
+    """Returns the GN2 probability P(FromB)+P(FromBC)+P(FromC) of each track of the batch, raised
+    to power (powers above 1 sharpen the weights of a SoftTrackSelection)."""
+    return np.sum(batch.originProbabilities[:, heavyFlavourOrigins], axis=1) ** power
+
+
+def gn2ProbabilityCut(batch, threshold: float = 0.5):
+    """Selects the tracks whose GN2 probability P(FromB)+P(FromBC)+P(FromC) is >= threshold."""
+    return gn2HeavyFlavourProbability(batch) >= threshold
+
+
+class TrackSelection:
+    """Class that defines a named track selection, evaluated on all the tracks of a JetBatch at once.
+
+    Public Members
+    --------------
+    self.name : str, name of the selection;
+    self.function : callable that takes a JetBatch (and the parameters) and returns the boolean
+        mask of the selected tracks of shape (Ntracks,); it is identified by its source code, or
+        by its version attribute if it declares one;
+    self.parameters : dict of the parameters of the selection;
+
+    Public Methods
+    --------------
+    key() : returns a str that identifies the selection's definition;
+    """
+
+    def __init__(self, name: str, function, **parameters) -> None:
+        """Constructor of the class.
+
+        Parameters
+        ----------
+        name : str
+            name of the selection
+        function : callable
+            function of the JetBatch (and the parameters) returning the mask of the selected tracks
+        **parameters:
+            parameters passed to function (e.g. threshold for gn2ProbabilityCut)
+        """
+        self.name = name
+        self.function = function
+        self.parameters = parameters
+
+    def __call__(self, batch) -> np.ndarray:
+        return np.asarray(self.function(batch, **self.parameters), dtype=bool)
+
+    def key(self) -> str:
+        # The digest of the function's source (or declared version) tells apart functions with
+        # the same qualified name, such as lambdas, and changes when the function is edited
+        parameters = ",".join(
+            f"{k}={_valueRepr(v)}" for k, v in sorted(self.parameters.items())
+        )
+        return (
+            f"{self.name}:{_functionName(self.function)}"
+            f"[{_functionDigest(self.function)}]({parameters})"
+        )
+
+
+def _functionName(function) -> str:
+    # Qualified name of a selection function (of the wrapped one for partial)
+    if isinstance(function, partial):
+        return _functionName(function.func)
+    module = getattr(function, "__module__", None) or type(function).__module__
+    qualname = getattr(function, "__qualname__", None) or type(function).__qualname__
+    return f"{module}.{qualname}"
+
+
+def _functionDigest(function) -> str:
+    """Function that returns a digest of a selection function, built from its declared version
+    (a version attribute of the function) or else from its source code, and from the values it
+    captures (closure and default arguments). Functions without a version whose source is not
+    available (e.g. defined in an interactive session) cannot be identified across runs and raise
+    a ValueError.
+    """
+    digest = hashlib.sha1()
+    if isinstance(function, partial):
+        digest.update(_functionDigest(function.func).encode())
+        digest.update(_valueRepr((function.args, function.keywords)).encode())
+        return digest.hexdigest()[:16]
+
+    version = getattr(function, "version", None)
+    if version is not None:
+        digest.update(f"version={_valueRepr(version)}".encode())
+    else:
+        try:
+            digest.update(inspect.getsource(function).encode())
+        except (OSError, TypeError):
+            raise ValueError(
+                f"The source of the selection function {function!r} is not available: "
+                "declare its version as a version attribute of the function."
+            )
+    closure = [
+        cell.cell_contents for cell in getattr(function, "__closure__", None) or ()
+    ]
+    defaults = getattr(function, "__defaults__", None)
+    kwdefaults = getattr(function, "__kwdefaults__", None)
+    digest.update(_valueRepr((closure, defaults, kwdefaults)).encode())
+    return digest.hexdigest()[:16]
+
+
+def _valueRepr(value) -> str:
+    """Function that returns a representation of a value used by a selection function (parameter,
+    captured or default value) that is the same across runs; values whose repr would hold a memory
+    address raise a ValueError."""
+    if isinstance(value, np.generic):
+        return repr(value.item())
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        return repr(value)
+    if isinstance(value, np.ndarray):
+        content = hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest()[:16]
+        return f"array({value.dtype.str},{value.shape},{content})"
+    if isinstance(value, (list, tuple)):
+        return type(value).__name__ + "(" + ",".join(_valueRepr(v) for v in value) + ")"
+    if isinstance(value, (set, frozenset)):
+        return "set(" + ",".join(sorted(_valueRepr(v) for v in value)) + ")"
+    if isinstance(value, dict):
+        items = sorted(f"{_valueRepr(k)}:{_valueRepr(v)}" for k, v in value.items())
+        return "dict(" + ",".join(items) + ")"
+    if callable(value):
+        return f"{_functionName(value)}[{_functionDigest(value)}]"
+    raise ValueError(
+        f"The value {value!r} of a selection cannot be identified across runs."
+    )
+
+
+class SoftTrackSelection(TrackSelection):
+    """Class that defines a named soft track selection: instead of a mask, its function returns a
+    weight in [0, 1] for each track of a JetBatch (e.g. gn2HeavyFlavourProbability), and all the
+    tracks with a non-null weight are fitted with their chi2 terms weighted by it, with
+    deterministic annealing (see annealedFitBatch) optionally started from the vertex of a hard
+    selection (seed), whose tracks keep full weight. A single soft fit per jet can replace several
+    hard selections fitted to hedge against misclassified tracks.
+
+    Public Members
+    --------------
+    self.name : str, name of the selection;
+    self.function : callable that takes a JetBatch (and the parameters) and returns the tracks'
+        weights of shape (Ntracks,);
+    self.parameters : dict of the parameters of the selection;
+    self.seed : callable that takes a JetBatch and returns the mask of the tracks of the first
+        fit, whose weights are set to 1, or None to start from the weights;
+    self.temperatures : list, temperatures of the deterministic annealing (empty to disable it);
+    self.chi2Cut : float, chi2 of a track at which the annealing halves its weight;
+
+    Public Methods
+    --------------
+    weights(batch) : returns the tracks' weights;
+    initialWeights(batch) : returns the tracks' weights of the first fit;
+    key() : returns a str that identifies the selection's definition;
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function,
+        seed=None,
+        temperatures: list = [64.0, 16.0, 4.0, 1.0],
+        chi2Cut: float = 25.0,
+        **parameters,
+    ) -> None:
+        """Constructor of the class.
+
+        Parameters
+        ----------
+        name : str
+            name of the selection
+        function : callable
+            function of the JetBatch (and the parameters) returning the tracks' weights
+        seed : callable, optional
+            function of the JetBatch returning the mask of the tracks of the first fit (e.g.
+            gn2HeavyFlavour), whose weights are set to 1, by default None which means a first
+            fit with the function's weights
+        temperatures : list, optional
+            decreasing temperatures of the deterministic annealing, by default
+            [64.0, 16.0, 4.0, 1.0]; an empty list means a single fit with the first weights
+        chi2Cut : float, optional
+            chi2 of a track at which the annealing halves its weight, by default 25.0
+        **parameters:
+            parameters passed to function
+        """
+        super().__init__(name, function, **parameters)
+        self.seed = seed
+        self.temperatures = list(temperatures)
+        self.chi2Cut = chi2Cut
+
+    def weights(self, batch) -> np.ndarray:
+        weights = np.clip(
+            np.asarray(self.function(batch, **self.parameters), dtype=float), 0, 1
+        )
+        if self.seed is None:
+            return weights
+        return np.where(np.asarray(self.seed(batch), dtype=bool), 1.0, weights)
+
+    def initialWeights(self, batch) -> np.ndarray:
+        if self.seed is None:
+            return self.weights(batch)
+        return np.asarray(self.seed(batch), dtype=float)
+
+    def __call__(self, batch) -> np.ndarray:
+        return self.weights(batch) > 0
+
+    def key(self) -> str:
+        return (
+            f"soft({super().key()},seed={_valueRepr(self.seed)},"
+            f"temperatures={_valueRepr(self.temperatures)},"
+            f"chi2Cut={_valueRepr(self.chi2Cut)})"
+        )
+
+
+class WorkingPointScan:
+    """Class that defines a scan of GN2 working points: the selections of the tracks whose
+    probability P(FromB)+P(FromBC)+P(FromC) is >= each of the thresholds (see gn2ProbabilityCut).
+    The selections are nested, so fitSelections fits them from the tightest to the loosest,
+    reusing the fit of the tighter working point when a jet gains no tracks, and by default
+    starting the fits of the looser working point from its vertex.
+
+    Public Members
+    --------------
+    self.name : str, prefix of the names of the working points' selections;
+    self.thresholds : np.ndarray, the thresholds, from the tightest to the loosest;
+    self.warmStart : bool, wether the fits start from the vertexes of the tighter working point;
+
+    Public Methods
+    --------------
+    selections() : returns the TrackSelection of each working point;
+    masks(batch) : returns the masks of the selected tracks of all the working points;
+    """
+
+    def __init__(self, name: str, thresholds: list, warmStart: bool = True) -> None:
+        """Constructor of the class.
+
+        Parameters
+        ----------
+        name : str
+            prefix of the names of the selections, which are <name>_<threshold>
+            (e.g. GN2_wp_0.5)
+        thresholds : list
+            thresholds on the GN2 heavy flavour probability, in any order
+        warmStart : bool, optional
+            Wether the fits of each working point start from the vertexes of the tighter one
+            (the fitter's fitBatch must support initialVertexes), by default True. It saves
+            iterations, but the chi2 has several local minima, so the fits can converge to
+            different vertexes than fits from the default starting points: warm-started results
+            depend on the thresholds, so they are neither stored in the FitCache nor reused by
+            other selections (only the tightest working point is cached)
+        """
+        self.name = name
+        self.thresholds = np.unique(np.asarray(thresholds, dtype=float))[::-1]
+        self.warmStart = warmStart
+
+    def selections(self) -> list:
+        """Returns the TrackSelection of each working point, from the tightest to the loosest."""
+        return [
+            TrackSelection(f"{self.name}_{t:g}", gn2ProbabilityCut, threshold=t)
+            for t in self.thresholds
+        ]
+
+    def masks(self, batch) -> dict:
+        """Function that evaluates all the working points on all the tracks of a batch of jets,
+        computing the GN2 probability of each track once.
+
+        Returns
+        -------
+        dict
+            name of the selection -> boolean mask of the selected tracks of shape (Ntracks,).
+        """
+        # Index of the tightest working point selecting each track, which selects it in all
+        # the looser ones (len(thresholds) if none)
+        level = np.searchsorted(
+            -self.thresholds, -gn2HeavyFlavourProbability(batch), side="left"
+        )
+        return {
+            selection.name: level <= k for k, selection in enumerate(self.selections())
+        }
+
+
+def expandSelections(selections: list):
+    """Function that replaces the WorkingPointScan in a list of selections with the
+    TrackSelection of their working points.
+
+    Returns
+    -------
+    tuple
+        the list of TrackSelection, a dict name of a working point's selection -> name of
+        the next tighter working point of its scan, and the set of the names of the
+        warm-started working points.
+    """
+    expanded = []
+    tighter = {}
+    warmStarted = set()
+    for selection in selections:
+        if isinstance(selection, WorkingPointScan):
+            workingPoints = selection.selections()
+            for tight, loose in zip(workingPoints[:-1], workingPoints[1:]):
+                tighter[loose.name] = tight.name
+                if selection.warmStart:
+                    warmStarted.add(loose.name)
+            expanded += workingPoints
+        else:
+            expanded.append(selection)
+    return expanded, tighter, warmStarted
+
+
+def evaluateSelections(batch, selections: list):
+    """Function that evaluates many track selections on all the tracks of a batch of jets.
+
+    Parameters
+    ----------
+    batch : JetBatch
+        the jets
+    selections : list
+        list of TrackSelection and WorkingPointScan
+
+    Returns
+    -------
+    dict
+        name of the selection -> boolean mask of the selected tracks of shape (Ntracks,);
+        a WorkingPointScan gives one selection per working point.
+    """
+    masks = {}
+    for selection in selections:
+        if isinstance(selection, WorkingPointScan):
+            masks.update(selection.masks(batch))
+        else:
+            masks[selection.name] = selection(batch)
+    return masks
+
+
+def fitSelections(
+    fitter, batch, selections: list, cache=None, profiler=None, scheduler=None
+):
+    """Function that fits the vertex of each jet of a batch for each track selection. All the fits
+    share the tracks' geometry stored in the batch; when a selection picks exactly the same tracks
+    of a jet as a previous selection, the previous fit result is reused instead of refitting.
+    The working points of a WorkingPointScan are fitted from the tightest, and a jet that gains
+    no tracks reuses the fit of the tighter working point; the fits of the looser working points
+    start from the tighter vertexes, and are neither cached nor reused by the other selections
+    (see WorkingPointScan).
+    The tracks of a SoftTrackSelection are fitted with their weights (the fitter's fitBatch must
+    support trackWeights, and initialVertexes for the annealing), and are never reused.
+    If a FitCache is given, results found in it are not refitted, and new ones are stored in it.
+    If the fitter gives the covariance of the vertexes (returnsCovariance), it is returned too;
+    fitters of curved tracks (curvedTracks) are also given the tracks' curvatures.
+    The jets to fit are sent to the fitter in batches planned by a MultiplicityScheduler.
+
+    Parameters
+    ----------
+    fitter : singleVertexFitter_straightTracks
+        the vertex fitter (any fitter with a fitBatch method supporting returnInfo)
+    batch : JetBatch
+        the jets
+    selections : list
+        list of TrackSelection, SoftTrackSelection and WorkingPointScan
+    cache : FitCache, optional
+        persistent cache of the fit results, by default None; it requires the jetIndex
+        property in the batch
+    profiler : Profiler, optional
+        if given, the time spent evaluating the selections ("select" stage), reading and writing
+        the cache ("cache" stage) and fitting ("fit" stage) is added to it, together with the
+        telemetry of the fits and the padding of the batches, by default None
+    scheduler : MultiplicityScheduler, optional
+        scheduler of the batches of jets sent to the fitter, by default None which means a single
+        batch with all the jets to fit of each selection
+
+    Returns
+    -------
+    dict
+        name of the selection (see WorkingPointScan for the names of the working points) ->
+        tuple of the fitted vertexes of shape (Njets, 3), the chi2 of the fits of shape (Njets,),
+        the number of selected tracks (with non-null weight) of shape (Njets,), the convergence
+        flags of the fits of shape (Njets,) and the covariance matrices of the vertexes of shape
+        (Njets, 3, 3) (nan if the fitter does not give them); jets with no selected tracks have
+        nan vertex, chi2 and covariance and are not converged.
+    """
+    with profileStage(profiler, "select", len(batch)):
+        masks = evaluateSelections(batch, selections)
+        jetIndex = batch.trackJetIndex()
+    selections, tighter, warmStarted = expandSelections(selections)
+    if scheduler is None:
+        scheduler = MultiplicityScheduler(edges=[], batchSize=None)
+    soft = {s.name for s in selections if isinstance(s, SoftTrackSelection)}
+    results = {}
+    for selection in selections:
+        name = selection.name
+        mask = masks[name]
+        nSelected = np.bincount(jetIndex[mask], minlength=len(batch))
+        vertexes = np.full((len(batch), 3), np.nan)
+        chi2 = np.full(len(batch), np.nan)
+        converged = np.zeros(len(batch), dtype=bool)
+        covariances = np.full((len(batch), 3, 3), np.nan)
+        toFit = np.ones(len(batch), dtype=bool)
+        useCache = cache is not None and name not in warmStarted
+
+        # Reading the results already in the cache
+        if useCache:
+            with profileStage(profiler, "cache", len(batch)):
+                found, vertexes, chi2, converged, covariances = cache.lookup(
+                    selection, fitter, batch.properties["jetIndex"]
+                )
+            toFit &= ~found
+            computed = toFit.copy()
+
+        # Reusing the fits of the previous selections for jets with identical selected tracks;
+        # working points are nested, so they only need to be compared with the tighter one,
+        # while weighted fits differ from the unweighted ones even on the same tracks, and
+        # warm-started fits depend on their scan (they would otherwise reach the cache)
+        with profileStage(profiler, "select"):
+            if name in soft:
+                identical = {}
+            elif name in tighter:
+                previous = results[tighter[name]]
+                identical = {tighter[name]: nSelected == previous[2]}
+            else:
+                identical = {
+                    previousName: np.bincount(
+                        jetIndex[mask != masks[previousName]], minlength=len(batch)
+                    )
+                    == 0
+                    for previousName in results
+                    if previousName not in soft and previousName not in warmStarted
+                }
+            for previousName, same in identical.items():
+                previous = results[previousName]
+                same = toFit & same
+                vertexes[same] = previous[0][same]
+                chi2[same] = previous[1][same]
+                converged[same] = previous[3][same]
+                covariances[same] = previous[4][same]
+                toFit &= ~same
+
+        # Fitting the remaining jets (jets with no selected tracks are left to nan)
+        toFit &= nSelected > 0
+        if toFit.any():
+            fitJets = partial(
+                _fitJets,
+                fitter,
+                batch,
+                selection,
+                mask,
+                trackWeights=selection.weights(batch) if name in soft else None,
+                initialWeights=(
+                    selection.initialWeights(batch) if name in soft else None
+                ),
+                initialVertexes=(
+                    results[tighter[name]][0] if name in warmStarted else None
+                ),
+            )
+            with profileStage(profiler, "fit", np.count_nonzero(toFit)):
+                vertexes[toFit], chi2[toFit], info = scheduler.run(
+                    fitJets, toFit, nSelected, profiler
+                )
+                converged[toFit] = info["converged"]
+                if "covariance" in info:
+                    covariances[toFit] = info["covariance"]
+            if profiler is not None:
+                profiler.recordFits(info)
+        if useCache:
+            with profileStage(profiler, "cache"):
+                cache.store(
+                    selection,
+                    fitter,
+                    batch.properties["jetIndex"][computed],
+                    vertexes[computed],
+                    chi2[computed],
+                    converged[computed],
+                    covariances[computed],
+                )
+        results[name] = (vertexes, chi2, nSelected, converged, covariances)
+    return results
+
+
+def _fitJets(
+    fitter,
+    batch,
+    selection,
+    mask: np.ndarray,
+    jetMask: np.ndarray,
+    trackWeights: np.ndarray = None,
+    initialWeights: np.ndarray = None,
+    initialVertexes: np.ndarray = None,
+):
+    """Function that fits the selected tracks (mask) of the selected jets (jetMask) of a batch
+    (see fitSelections), with the annealing of a SoftTrackSelection if the tracks' weights (and
+    the weights of the first fit) are given; it returns the vertexes, the chi2 and the telemetry
+    of the fits."""
+    fitArguments = {}
+    if getattr(fitter, "curvedTracks", False):
+        fitArguments["curvatures"] = batch.paddedColumn(batch.curvatures, mask, jetMask)
+    if trackWeights is not None:
+        *tracks, paddedWeights = batch.padded(mask, jetMask, trackWeights)
+        fitArguments["initialWeights"] = batch.paddedColumn(
+            initialWeights, mask, jetMask
+        )
+        vertexes, chi2, _, info = annealedFitBatch(
+            fitter,
+            *tracks,
+            trackWeights=paddedWeights,
+            temperatures=selection.temperatures,
+            chi2Cut=selection.chi2Cut,
+            returnInfo=True,
+            **fitArguments,
+        )
+        return vertexes, chi2, info
+    if initialVertexes is not None:
+        fitArguments["initialVertexes"] = initialVertexes[jetMask]
+    return fitter.fitBatch(
+        *batch.padded(mask, jetMask), returnInfo=True, **fitArguments
+    )
@@ -2,7 +2,8 @@
 
 from puma import Histogram, HistogramPlot
 from puma.utils import get_good_colours
-import numpy as np
+from modules.columnStore import readColumnStore, convertLegacyResults
+import os
 
 
 def plot_Lxy_comparison(
@@ -118,36 +119,20 @@ def plot_chi2_comparison(perfect_tracksel_chi2, GN2_chi2, title, filename):
 
 
 if __name__ == "__main__":
-    GN2_Lxy = []
-    GN2_chi2 = []
-    perfect_tracksel_Lxy = []
-    perfect_tracksel_chi2 = []
-    SV1_Lxy = []
-    MCtruth_Lxy = []
-    jet_flav = []
-
-    # Reading fit results
-    with open("fit_results.dat", "r") as ifile:
-        ifile.readline()
-        for line in ifile:
-            glxy, plxy, sv1lxy, tlxy, flav, TruthChi2, GN2chi2 = [
-                float(i) for i in line.split(" ")
-            ]
-            GN2_Lxy.append(glxy)
-            GN2_chi2.append(GN2chi2)
-            perfect_tracksel_Lxy.append(plxy)
-            perfect_tracksel_chi2.append(TruthChi2)
-            SV1_Lxy.append(sv1lxy)
-            MCtruth_Lxy.append(tlxy)
-            jet_flav.append(flav)
-
-    GN2_Lxy = np.array(GN2_Lxy)
-    GN2_chi2 = np.array(GN2_chi2)
-    perfect_tracksel_Lxy = np.array(perfect_tracksel_Lxy)
-    perfect_tracksel_chi2 = np.array(perfect_tracksel_chi2)
-    SV1_Lxy = np.array(SV1_Lxy)
-    MCtruth_Lxy = np.array(MCtruth_Lxy)
-    jet_flav = np.array(jet_flav)
+    # Converting the fit results written by the first versions of fit.py, if needed
+    if not os.path.isdir("fit_results") and os.path.isfile("fit_results.dat"):
+        print("Converting fit_results.dat into the fit_results store.")
+        convertLegacyResults("fit_results.dat", "fit_results")
+
+    # Reading fit results (memory-mapped from the binary store written by fit.py)
+    results = readColumnStore("fit_results")
+    GN2_Lxy = results["GN2_tracksel_Lxy"]
+    GN2_chi2 = results["GN2_tracksel_chi2"]
+    perfect_tracksel_Lxy = results["perfect_tracksel_Lxy"]
+    perfect_tracksel_chi2 = results["perfect_tracksel_chi2"]
+    SV1_Lxy = results["SV1_Lxy"]
+    MCtruth_Lxy = results["HadronConeExclTruthLabelLxy"]
+    jet_flav = results["HadronConeExclTruthLabelID"]
 
     # Plots inclusive flavour
     plot_Lxy_comparison(